@@ -0,0 +1,112 @@
+"""Fixtures providing a local MongoDB stand-in seeded with synthetic data.
+
+Benchmarks run against an in-process mongomock client by default. To run
+them against a real local mongod instead, set the SHLEEM_BENCH_MONGODB_URI
+environment variable to its connection URI; the shleem_bench database on it
+is dropped and re-seeded. Collection sizes are set by the comma-separated
+SHLEEM_BENCH_SIZES environment variable, and default to 1000 and 10000.
+"""
+
+import os
+import random
+
+import pytest
+
+import shleem.mongodb
+from shleem.mongodb.connection import CONNECTIONS
+
+
+BENCH_SERVER_NAME = 'shleem_bench_server'
+BENCH_DB_NAME = 'shleem_bench'
+BOROUGHS = ['Queens', 'Brooklyn', 'Manhattan', 'Bronx', 'Staten Island']
+CUISINES = ['Bakery', 'Pizza', 'Chinese', 'American', 'Irish', 'Thai']
+
+
+def bench_sizes():
+    sizes = os.environ.get('SHLEEM_BENCH_SIZES', '1000,10000')
+    return [int(size) for size in sizes.split(',')]
+
+
+def collection_name(size):
+    return 'restaurants_{}'.format(size)
+
+
+def synthetic_restaurants(size, seed=0):
+    rnd = random.Random(seed)
+    for i in range(size):
+        yield {
+            'restaurant_id': str(30000000 + i),
+            'name': 'restaurant {}'.format(i),
+            'borough': rnd.choice(BOROUGHS),
+            'cuisine': rnd.choice(CUISINES),
+            'address': {
+                'building': str(rnd.randint(1, 2000)),
+                'street': 'street {}'.format(rnd.randint(1, 300)),
+                'zipcode': str(rnd.randint(10000, 11500)),
+                'coord': [rnd.uniform(-74.3, -73.7), rnd.uniform(40.5, 40.9)],
+            },
+            'grades': [
+                {'grade': rnd.choice('ABC'), 'score': rnd.randint(0, 40)}
+                for _ in range(rnd.randint(1, 5))
+            ],
+        }
+
+
+def _client():
+    uri = os.environ.get('SHLEEM_BENCH_MONGODB_URI')
+    if uri:
+        from pymongo import MongoClient
+        return MongoClient(uri)
+    mongomock = pytest.importorskip('mongomock')
+    return mongomock.MongoClient()
+
+
+@pytest.fixture(scope='session')
+def bench_server():
+    """A MongoDBServer data source backed by the local MongoDB stand-in,
+    holding a synthetic restaurants collection per benchmarked size."""
+    client = _client()
+    client.drop_database(BENCH_DB_NAME)
+    for size in bench_sizes():
+        col = client[BENCH_DB_NAME][collection_name(size)]
+        col.insert_many(synthetic_restaurants(size))
+    # register the client as the connection of the benchmark server, so no
+    # credentials file is needed
+    CONNECTIONS.client(BENCH_SERVER_NAME, lambda: client)
+    yield shleem.mongodb.server(BENCH_SERVER_NAME)
+    client.drop_database(BENCH_DB_NAME)
+    CONNECTIONS.close(BENCH_SERVER_NAME)
+
+
+@pytest.fixture(scope='session')
+def raw_batches_supported():
+    """True if the local MongoDB stand-in serves raw BSON batches, which
+    mongomock does not."""
+    return bool(os.environ.get('SHLEEM_BENCH_MONGODB_URI'))
+
+
+@pytest.fixture(scope='session')
+def bench_db(bench_server):
+    return bench_server[BENCH_DB_NAME]
+
+
+def pytest_generate_tests(metafunc):
+    if 'size' in metafunc.fixturenames:
+        metafunc.parametrize('size', bench_sizes())
+
+
+@pytest.fixture
+def bench_collection(bench_db, size):
+    """The synthetic restaurants collection of the benchmarked size."""
+    return bench_db[collection_name(size)]
+
+
+@pytest.fixture
+def bench_dump(tmpdir, size):
+    """A BSON dump of synthetic restaurants of the benchmarked size."""
+    from shleem.bsondump import dump
+    from shleem.docfile import write_documents
+    fpath = str(tmpdir.mkdir(BENCH_DB_NAME).join(
+        collection_name(size) + '.bson'))
+    write_documents(fpath, synthetic_restaurants(size))
+    return dump(fpath)
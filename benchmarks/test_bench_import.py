@@ -0,0 +1,27 @@
+"""Benchmarks of the import-time cost of the shleem package.
+
+Each benchmark round imports the package in a fresh interpreter, so module
+caching does not hide the cost. Run with:
+
+    pytest benchmarks/test_bench_import.py
+"""
+
+import sys
+import subprocess
+
+import pytest
+
+
+def _run(code):
+    subprocess.check_call([sys.executable, '-c', code])
+
+
+@pytest.mark.parametrize('code', [
+    'pass',
+    'import shleem',
+    'import shleem.mongodb',
+    'import pymongo',
+], ids=['interpreter', 'shleem', 'shleem.mongodb', 'pymongo'])
+def test_import_time(benchmark, code):
+    benchmark.group = 'import'
+    benchmark.pedantic(_run, args=(code,), rounds=10, iterations=1)
@@ -0,0 +1,77 @@
+"""Micro-benchmarks of MongoDB query resolution in the shleem package.
+
+Run with pytest and the pytest-benchmark plugin installed:
+
+    pytest benchmarks
+"""
+
+import copy
+
+import pytest
+
+from shleem.mongodb.template import QueryTemplate
+
+
+def getter(field_name):
+    return lambda **kwargs: kwargs[field_name]
+
+
+def _resolve_helper(obj, **kwargs):
+    if isinstance(obj, dict):
+        for key in obj.keys():
+            if callable(obj[key]):
+                obj[key] = obj[key](**kwargs)
+            if isinstance(obj[key], (dict, list, tuple)):
+                obj[key] = _resolve_helper(obj[key], **kwargs)
+        return obj
+    new_list = []
+    for item in obj:
+        if callable(item):
+            new_list.append(item(**kwargs))
+        elif isinstance(item, (dict, list, tuple)):
+            new_list.append(_resolve_helper(item, **kwargs))
+        else:
+            new_list.append(item)
+    return new_list
+
+
+def deepcopy_resolve(query, **kwargs):
+    """The resolution of queries preceding QueryTemplate, deep copying the
+    whole query on every tap, kept as the baseline of these benchmarks."""
+    return _resolve_helper(copy.deepcopy(query), **kwargs)
+
+
+def _in_list_query(size):
+    return {
+        "address.zipcode": {"$in": [str(i) for i in range(size)]},
+        "grades.score": {"$gte": getter("min_score")},
+    }
+
+
+def _long_pipeline(num_stages):
+    pipeline = [
+        {"$match": {"borough": {"$in": ["Queens", "Brooklyn", "Bronx"]}}}
+        for _ in range(num_stages)
+    ]
+    pipeline.append({"$match": {"avg_score": {"$gt": getter("threshold")}}})
+    return pipeline
+
+
+QUERIES = {
+    'in_list_10k': (_in_list_query(10000), {'min_score': 10}),
+    'pipeline_200_stages': (_long_pipeline(200), {'threshold': 13.5}),
+}
+
+
+@pytest.mark.parametrize('query_name', sorted(QUERIES))
+def test_deepcopy_resolve(benchmark, query_name):
+    query, kwargs = QUERIES[query_name]
+    benchmark(deepcopy_resolve, query, **kwargs)
+
+
+@pytest.mark.parametrize('query_name', sorted(QUERIES))
+def test_template_resolve(benchmark, query_name):
+    query, kwargs = QUERIES[query_name]
+    template = QueryTemplate(query)
+    resolved = benchmark(template.resolve, **kwargs)
+    assert resolved == deepcopy_resolve(query, **kwargs)
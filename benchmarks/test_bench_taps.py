@@ -0,0 +1,148 @@
+"""Benchmarks of data source identifiers, tap throughput and dataset
+materialization in the shleem package, against a local MongoDB stand-in (see
+conftest.py).
+
+    pytest benchmarks/test_bench_taps.py --no-cov
+"""
+
+import functools
+
+import pytest
+
+from shleem import (
+    DataTap,
+    TapCache,
+)
+from shleem.shared import key_hash
+from shleem.mongodb.mongodb import default_identifier
+
+
+def getter(field_name):
+    return lambda **kwargs: kwargs[field_name]
+
+
+IDENTIFIER_QUERIES = {
+    'small': {'borough': 'Queens'},
+    'small_callable': {'address.zipcode': {'$gte': getter('min_zip')}},
+    'in_list_1k': {'address.zipcode': {'$in': [
+        str(10000 + i) for i in range(1000)]}},
+    'pipeline_50_stages_callable': [
+        {'$match': {'grades.score': {'$gte': getter('min_score')}}}
+        for _ in range(50)
+    ],
+}
+
+
+@pytest.mark.parametrize('query_name', sorted(IDENTIFIER_QUERIES))
+def test_default_identifier(benchmark, query_name):
+    benchmark.group = 'identifier'
+    benchmark(default_identifier, IDENTIFIER_QUERIES[query_name])
+
+
+def test_tap_hash(benchmark, bench_db):
+    benchmark.group = 'identifier'
+    query = bench_db.restaurants.query(
+        {'address.zipcode': {'$gte': getter('min_zip')}},
+        identifier='zipcode_min')
+    benchmark(query.tap_hash, min_zip='10500')
+    assert key_hash(query.tap_key(min_zip='10500')) == query.tap_hash(
+        min_zip='10500')
+
+
+def _consume(iterator):
+    count = 0
+    for _ in iterator:
+        count += 1
+    return count
+
+
+def test_query_tap(benchmark, bench_collection, size):
+    benchmark.group = 'query tap'
+    query = bench_collection.query({})
+    assert benchmark(lambda: _consume(query.tap())) == size
+
+
+def test_parameterized_query_tap(benchmark, bench_collection):
+    benchmark.group = 'query tap'
+    query = bench_collection.query(
+        {'borough': getter('borough'),
+         'grades.score': {'$gte': getter('min_score')}},
+        projection=['name', 'address.zipcode'])
+    benchmark(lambda: _consume(query.tap(borough='Queens', min_score=20)))
+
+
+def test_aggregation_tap(benchmark, bench_collection):
+    benchmark.group = 'aggregation tap'
+    aggregation = bench_collection.aggregation([
+        {'$match': {'cuisine': getter('cuisine')}},
+        {'$unwind': '$grades'},
+        {'$group': {'_id': '$borough', 'avg_score': {'$avg': '$grades.score'},
+                    'count': {'$sum': 1}}},
+    ])
+    num_groups = benchmark(lambda: _consume(aggregation.tap(cuisine='Pizza')))
+    assert num_groups <= 5
+
+
+def test_materialize_list(benchmark, bench_collection, size):
+    benchmark.group = 'materialization'
+    query = bench_collection.query({})
+    assert len(benchmark(lambda: list(query.tap()))) == size
+
+
+def test_materialize_columns(benchmark, bench_collection, size):
+    pytest.importorskip('numpy')
+    benchmark.group = 'materialization'
+    query = bench_collection.query(
+        {}, projection=['name', 'borough', 'address.zipcode'])
+    columns = benchmark(query.to_columns)
+    assert len(columns['name']) == size
+
+
+def _arrow_query(bench_collection, raw_batches_supported):
+    query = bench_collection.query({}, projection=['name', 'borough'])
+    if not raw_batches_supported:
+        # use the generic path, converting decoded documents
+        query.tap_arrow = functools.partial(DataTap.tap_arrow, query)
+    return query
+
+
+def test_materialize_arrow(benchmark, bench_collection, size,
+                           raw_batches_supported):
+    pytest.importorskip('pyarrow')
+    benchmark.group = 'materialization'
+    query = _arrow_query(bench_collection, raw_batches_supported)
+    batches = benchmark(lambda: list(query.tap_arrow()))
+    assert sum(batch.num_rows for batch in batches) == size
+
+
+def test_materialize_cache(benchmark, bench_collection, size, tmpdir):
+    benchmark.group = 'materialization'
+    query = bench_collection.query({})
+    cache = TapCache(cache_dir=str(tmpdir))
+
+    def materialize():
+        cache.clear()
+        return _consume(cache.tap(query))
+
+    assert benchmark(materialize) == size
+
+
+def test_materialize_store(benchmark, bench_collection, size, tmpdir,
+                           raw_batches_supported):
+    pytest.importorskip('pyarrow')
+    from shleem.store import DatasetStore
+    benchmark.group = 'materialization'
+    query = _arrow_query(bench_collection, raw_batches_supported)
+    store = DatasetStore(store_dir=str(tmpdir))
+    entry = benchmark(store.write, query)
+    assert store.load(
+        query.identifier, entry['version']).num_rows == size
+
+
+def test_bsondump_tap(benchmark, bench_dump):
+    benchmark.group = 'bson dump tap'
+    query = bench_dump.query(
+        {'borough': getter('borough'),
+         'grades.score': {'$gte': getter('min_score')}},
+        projection=['name', 'address.zipcode'])
+    benchmark(lambda: _consume(query.tap(borough='Queens', min_score=20)))
@@ -16,7 +16,10 @@ if sys.version_info.major < 3 or sys.version_info.minor < 4:
 
 
 INSTALL_REQUIRES = ['pymongo>=3.4', 'strct']
-TEST_REQUIRES = ['pytest', 'coverage', 'pytest-cov']
+TEST_REQUIRES = ['pytest', 'coverage', 'pytest-cov', 'mongomock']
+BENCH_REQUIRES = ['pytest', 'pytest-benchmark', 'mongomock']
+COLUMNAR_REQUIRES = ['numpy', 'pandas']
+ARROW_REQUIRES = ['pyarrow', 'pymongoarrow']
 
 with open('README.rst') as f:
     README = f.read()
@@ -41,6 +44,9 @@ setuptools.setup(
     ],
     extras_require={
         'test': TEST_REQUIRES + INSTALL_REQUIRES,
+        'bench': BENCH_REQUIRES + INSTALL_REQUIRES,
+        'columnar': COLUMNAR_REQUIRES + INSTALL_REQUIRES,
+        'arrow': ARROW_REQUIRES + INSTALL_REQUIRES,
     },
     classifiers=[
         # Trove classifiers
@@ -0,0 +1,148 @@
+"""Fixtures providing an in-process MongoDB stand-in with synthetic data.
+
+MongoDB data taps are tested against a mongomock client, registered as the
+connection of a local server, so no credentials file or running server is
+needed. Only the smoke tests of test_mongo_sources use the remote server
+named in the credentials file.
+"""
+
+import random
+
+import pytest
+
+import shleem.mongodb
+from shleem.mongodb.connection import CONNECTIONS
+
+
+LOCAL_SERVER_NAME = 'shleem_local_server'
+LOCAL_DB_NAME = 'shleem_test'
+LOCAL_COLLECTION_NAME = 'example_data_collection'
+LOCAL_COLLECTION_SIZE = 2000
+BOROUGHS = ['Queens', 'Brooklyn', 'Manhattan', 'Bronx', 'Missing']
+
+
+def synthetic_restaurants(size, seed=0):
+    rnd = random.Random(seed)
+    for i in range(size):
+        yield {
+            'restaurant_id': str(30000000 + i),
+            'name': 'restaurant {}'.format(i),
+            'borough': BOROUGHS[i % len(BOROUGHS)],
+            'address': {
+                'zipcode': str(rnd.randint(10000, 12000)),
+                'street': 'street {}'.format(i % 7),
+            },
+            'grades': [{'score': rnd.randint(0, 30)} for _ in range(3)],
+        }
+
+
+@pytest.fixture(scope='session')
+def mongo_server():
+    """A MongoDBServer data source backed by a mongomock client, holding a
+    synthetic restaurants collection."""
+    mongomock = pytest.importorskip('mongomock')
+    client = mongomock.MongoClient()
+    client[LOCAL_DB_NAME][LOCAL_COLLECTION_NAME].insert_many(
+        synthetic_restaurants(LOCAL_COLLECTION_SIZE))
+    # register the client as the connection of the local server, so no
+    # credentials file is needed
+    CONNECTIONS.client(LOCAL_SERVER_NAME, lambda: client)
+    yield shleem.mongodb.server(LOCAL_SERVER_NAME)
+    CONNECTIONS.close(LOCAL_SERVER_NAME)
+
+
+@pytest.fixture
+def examp(mongo_server, monkeypatch):
+    """The synthetic restaurants collection of the local server.
+
+    mongomock has no asyncio client, so asynchronous taps of it run on an
+    executor, unless the async_collections fixture is used too.
+    """
+    from shleem.mongodb import aio
+    monkeypatch.setattr(aio, 'has_async_client', lambda: False)
+    return mongo_server[LOCAL_DB_NAME][LOCAL_COLLECTION_NAME]
+
+
+class _AsyncCursor(object):
+    def __init__(self, cursor):
+        self._cursor = iter(cursor)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return next(self._cursor)
+        except StopIteration:
+            raise StopAsyncIteration
+
+    async def close(self):
+        pass
+
+
+class _AsyncCollection(object):
+    def __init__(self, col_obj):
+        self._col_obj = col_obj
+
+    def find(self, **kwargs):
+        return _AsyncCursor(self._col_obj.find(**kwargs))
+
+    async def aggregate(self, pipeline):
+        return _AsyncCursor(self._col_obj.aggregate(pipeline))
+
+
+@pytest.fixture
+def async_collections(examp, monkeypatch):
+    """Serves asynchronous taps of MongoDB collections through asyncio
+    wrappers of their mongomock collections, as pymongo's asyncio client
+    would."""
+    from shleem.mongodb import aio
+
+    def _get_async_connection(self, read_preference=None):
+        return _AsyncCollection(self._get_connection(read_preference))
+
+    monkeypatch.setattr(aio, 'has_async_client', lambda: True)
+    monkeypatch.setattr(
+        type(examp), '_get_async_connection', _get_async_connection)
+
+
+def _raw_batches(documents, batch_size):
+    from bson import encode
+    batch = []
+    for doc in documents:
+        batch.append(encode(doc))
+        if len(batch) == batch_size:
+            yield b''.join(batch)
+            batch = []
+    if batch:
+        yield b''.join(batch)
+
+
+class _RawBatchCursor(object):
+    def __init__(self, documents, batch_size=0):
+        self._batches = _raw_batches(documents, batch_size or 101)
+
+    def __iter__(self):
+        return self._batches
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def raw_batches(examp, monkeypatch):
+    """Serves raw BSON batches from mongomock collections, which do not
+    implement find_raw_batches and aggregate_raw_batches."""
+    from mongomock.collection import Collection
+
+    def find_raw_batches(self, batch_size=0, **kwargs):
+        return _RawBatchCursor(self.find(**kwargs), batch_size)
+
+    def aggregate_raw_batches(self, pipeline, batchSize=0):
+        return _RawBatchCursor(self.aggregate(pipeline), batchSize)
+
+    monkeypatch.setattr(
+        Collection, 'find_raw_batches', find_raw_batches, raising=False)
+    monkeypatch.setattr(
+        Collection, 'aggregate_raw_batches', aggregate_raw_batches,
+        raising=False)
@@ -0,0 +1,45 @@
+"""Testing the coalescing of MongoDB queries of the shleem package."""
+
+import pytest
+
+from shleem.mongodb.batching import (
+    merge_queries,
+    find_many,
+)
+from shleem.mongodb.documents import demux_projection
+
+
+def test_merge_queries():
+    assert merge_queries([{'a': 1}]) == {'a': 1}
+    assert merge_queries([{'a': 1}, {'a': 2}]) == {'a': {'$in': [1, 2]}}
+    assert merge_queries([{'a': 1}, {'b': 2}]) == {
+        '$or': [{'a': 1}, {'b': 2}]}
+
+
+def testdemux_projection():
+    assert demux_projection(None, {'a'}) == (None, set())
+    assert demux_projection(['a'], {'a', 'b.c'}) == (
+        {'a': True, '_id': True, 'b.c': True}, {'b'})
+    assert demux_projection(['x.z', 'name'], {'x.y'}) == (
+        {'x.z': True, 'name': True, '_id': True, 'x.y': True}, {'x.y'})
+    assert demux_projection({'x.z': 1, '_id': 0}, {'x.y', 'x.w.v'}) == (
+        {'x.z': True, '_id': 0, 'x.y': True, 'x.w.v': True}, {'x.y', 'x.w'})
+    # a filtered field holding a projected path cannot be projected with it
+    assert demux_projection(['x.z'], {'x.y', 'x'}) == (None, None)
+    assert demux_projection({'a': 0}, {'a.b'}) == (None, None)
+    assert demux_projection({'a': 0}, {'b'}) == ({'a': 0}, set())
+
+
+def test_find_many_nested_projection():
+    mongomock = pytest.importorskip('mongomock')
+    col_obj = mongomock.MongoClient()['shleem_test']['batching']
+    col_obj.insert_many([
+        {'_id': i, 'name': str(i), 'x': {'y': i % 3, 'z': i}}
+        for i in range(12)])
+    queries = [{'x.y': 0}, {'x.y': 1}, {'x.y': 0}]
+    for projection in (['x.z', 'name'], {'x.z': 1, '_id': 0}):
+        results = find_many(col_obj, queries, projection=projection)
+        for query, docs in zip(queries, results):
+            assert docs == list(col_obj.find(query, projection=projection))
+            assert all(doc['x'] == {'z': doc_z} for doc, doc_z in zip(
+                docs, range(query['x.y'], 12, 3)))
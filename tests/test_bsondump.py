@@ -0,0 +1,75 @@
+"""Testing the BSON dump data sources of the shleem package."""
+
+import pytest
+
+import shleem
+from shleem.docfile import write_documents
+from shleem.exceptions import UnsupportedQueryException
+from shleem.bsondump.bsondump import compile_projection
+
+
+DOCS = [
+    {'_id': i, 'borough': ['Queens', 'Bronx', 'Brooklyn'][i % 3],
+     'address': {'zipcode': str(10000 + i), 'street': 's{}'.format(i)},
+     'grades': [{'score': i, 'grade': 'A'}, {'score': i + 1, 'grade': 'B'}]}
+    for i in range(30)
+]
+
+
+def _min_score(**kwargs):
+    return kwargs['min_score']
+
+
+@pytest.fixture
+def restaurants(tmpdir):
+    fpath = str(tmpdir.mkdir('shleem_test').join('restaurants.bson'))
+    write_documents(fpath, DOCS)
+    return shleem.bsondump.dump(fpath)
+
+
+def test_bsondump_query(restaurants):
+    assert restaurants.identifier == 'shleem_test.restaurants'
+    assert list(restaurants.query({}).tap()) == DOCS
+    queens = restaurants.query(
+        {'borough': 'Queens', 'grades.score': {'$gte': _min_score}},
+        identifier='queens', projection=['address.zipcode'], skip=2,
+        limit=3)
+    assert queens.identifier == 'shleem_test.restaurants.queens'
+    assert list(queens.tap(min_score=10)) == [
+        {'_id': i, 'address': {'zipcode': str(10000 + i)}}
+        for i in (15, 18, 21)]
+    assert queens.tap_key(min_score=10) == {
+        'filter': {'borough': 'Queens', 'grades.score': {'$gte': 10}},
+        'projection': ['address.zipcode'], 'skip': 2, 'limit': 3}
+    assert queens.projected_fields() == ['_id', 'address.zipcode']
+    # unfiltered skips walk document boundaries only
+    assert [doc['_id'] for doc in restaurants.query(
+        {}, skip=25, limit=10).tap()] == [25, 26, 27, 28, 29]
+    with pytest.raises(UnsupportedQueryException):
+        restaurants.query({'$where': 'this.a'}).tap()
+
+
+def test_compile_projection():
+    doc = DOCS[1]
+    assert compile_projection(None) is None
+    assert compile_projection({'grades.score': 1, '_id': 0})(doc) == {
+        'grades': [{'score': 1}, {'score': 2}]}
+    assert compile_projection({'grades.grade': 0, 'address': 0})(doc) == {
+        '_id': 1, 'borough': 'Bronx',
+        'grades': [{'score': 1}, {'score': 2}]}
+    assert compile_projection({'_id': False})(doc) == {
+        key: value for key, value in doc.items() if key != '_id'}
+    assert compile_projection(['address', 'address.street'])(doc) == {
+        '_id': 1, 'address': doc['address']}
+
+
+def test_bsondump_corrupt(tmpdir):
+    fpath = tmpdir.join('empty.bson')
+    fpath.write_binary(b'')
+    assert list(shleem.bsondump.dump(str(fpath)).query({}).tap()) == []
+    write_documents(str(fpath), DOCS[:2])
+    fpath.write_binary(fpath.read_binary()[:-3])
+    tap = shleem.bsondump.dump(str(fpath)).query({}).tap()
+    assert next(tap) == DOCS[0]
+    with pytest.raises(ValueError):
+        next(tap)
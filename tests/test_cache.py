@@ -0,0 +1,66 @@
+"""Testing the on-disk materialization cache of the shleem package."""
+
+import os
+import time
+
+from shleem import (
+    DataTap,
+    TapCache,
+)
+
+
+class CountingTap(DataTap):
+    def __init__(self):
+        super().__init__(
+            identifier="ShleemDB.counting", source_type="ShleemDB")
+        self.num_taps = 0
+
+    def tap(self, **kwargs):
+        self.num_taps += 1
+        return [{'i': i, 'n': kwargs.get('n')} for i in range(kwargs['n'])]
+
+
+def test_tap_cache(tmpdir):
+    cache = TapCache(cache_dir=str(tmpdir))
+    assert repr(cache) == "TapCache: {}".format(str(tmpdir))
+    counting = CountingTap()
+    assert not cache.contains(counting, n=3)
+    docs = list(cache.tap(counting, n=3))
+    assert docs == [{'i': 0, 'n': 3}, {'i': 1, 'n': 3}, {'i': 2, 'n': 3}]
+    assert counting.num_taps == 1
+    assert cache.contains(counting, n=3)
+    assert list(cache.tap(counting, n=3)) == docs
+    assert counting.num_taps == 1
+    # different kwargs are cached separately
+    assert len(list(cache.tap(counting, n=5))) == 5
+    assert counting.num_taps == 2
+    cache.clear(counting.identifier)
+    assert not cache.contains(counting, n=3)
+    list(cache.tap(counting, n=3))
+    assert counting.num_taps == 3
+    cache.clear()
+    assert not os.path.exists(str(tmpdir))
+
+
+def test_tap_cache_eviction(tmpdir):
+    counting = CountingTap()
+    cache = TapCache(cache_dir=str(tmpdir), max_age=60)
+    list(cache.tap(counting, n=2))
+    fpath = cache._entry_path(counting.identifier, counting.tap_hash(n=2))
+    old = time.time() - 120
+    os.utime(fpath, (old, old))
+    assert not cache.contains(counting, n=2)
+    cache.evict()
+    assert not os.path.exists(fpath)
+
+    cache = TapCache(cache_dir=str(tmpdir))
+    list(cache.tap(counting, n=10))
+    fpath = cache._entry_path(counting.identifier, counting.tap_hash(n=10))
+    size_of_one = os.path.getsize(fpath)
+    old = time.time() - 10
+    os.utime(fpath, (old, old))
+    cache = TapCache(cache_dir=str(tmpdir), max_size=size_of_one + 10)
+    list(cache.tap(counting, n=11))
+    # the least recently used dataset was evicted to make room
+    assert not cache.contains(counting, n=10)
+    assert cache.contains(counting, n=11)
@@ -0,0 +1,62 @@
+"""Testing columnar output of taps in the shleem package."""
+
+import datetime
+
+import pytest
+
+from shleem import DataTap
+
+np = pytest.importorskip('numpy')
+
+
+class ListTap(DataTap):
+    def __init__(self, documents):
+        super().__init__(identifier="ShleemDB.list")
+        self.documents = documents
+
+    def tap(self, **kwargs):
+        return iter(self.documents)
+
+
+DOCS = [
+    {'_id': 0, 'name': 'a', 'score': 1, 'address': {'zipcode': '11249'}},
+    {'_id': 1, 'name': 'b', 'score': 2.5, 'address': {'zipcode': '11300'}},
+    {'_id': 2, 'name': 'c', 'address': {'zipcode': '11301'},
+     'opened': datetime.datetime(2017, 1, 1)},
+    {'_id': 3, 'name': 'd', 'score': 4, 'address': {}},
+]
+
+
+def test_to_columns_inferred():
+    columns = ListTap(DOCS).to_columns(batch_size=3)
+    assert list(columns) == [
+        '_id', 'name', 'score', 'address.zipcode', 'opened', 'address']
+    assert columns['_id'].dtype == np.int64
+    assert list(columns['_id']) == [0, 1, 2, 3]
+    assert columns['name'].dtype == object
+    assert columns['score'].dtype == np.float64
+    assert np.isnan(columns['score'][2])
+    assert columns['score'][1] == 2.5
+    assert list(columns['address.zipcode'][:3]) == [
+        '11249', '11300', '11301']
+    assert columns['address.zipcode'][3] is None
+    assert columns['opened'].dtype.kind == 'M'
+    assert np.isnat(columns['opened'][0])
+
+
+def test_to_columns_given():
+    tap = ListTap(DOCS * 700)
+    columns = tap.to_columns(columns=['_id', 'address.zipcode'])
+    assert list(columns) == ['_id', 'address.zipcode']
+    assert len(columns['_id']) == len(DOCS) * 700
+    assert columns['_id'].dtype == np.int64
+    empty = ListTap([]).to_columns(columns=['a'])
+    assert len(empty['a']) == 0
+
+
+def test_to_frame():
+    pd = pytest.importorskip('pandas')
+    frame = ListTap(DOCS).to_frame(columns=['name', 'score'])
+    assert isinstance(frame, pd.DataFrame)
+    assert list(frame.columns) == ['name', 'score']
+    assert frame['score'].sum() == 7.5
@@ -0,0 +1,88 @@
+"""Testing process-safe connection management of the shleem package."""
+
+import os
+import asyncio
+
+import pytest
+
+from shleem.mongodb import aio
+from shleem.mongodb.mongodb import MongoDBServer
+from shleem.mongodb.connection import ConnectionManager
+
+
+class FakeClient(object):
+
+    def __init__(self):
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class FakeAsyncClient(object):
+
+    def __init__(self, host, **kwargs):
+        self.closed = False
+
+    async def close(self):
+        self.closed = True
+
+
+def test_connection_manager():
+    manager = ConnectionManager()
+    client = manager.client('a', FakeClient)
+    assert manager.client('a', FakeClient) is client
+    assert manager.client('b', FakeClient) is not client
+    assert len(manager) == 2
+    manager.close('a')
+    assert client.closed
+    assert len(manager) == 1
+    assert manager.client('a', FakeClient) is not client
+    manager.close()
+    assert len(manager) == 0
+
+
+def test_connection_manager_after_fork(monkeypatch):
+    manager = ConnectionManager()
+    client = manager.client('a', FakeClient)
+    parent_pid = os.getpid()
+    monkeypatch.setattr(os, 'getpid', lambda: parent_pid + 1)
+    child_client = manager.client('a', FakeClient)
+    assert child_client is not client
+    # clients inherited from the parent process are dropped, not closed
+    assert not client.closed
+    assert len(manager) == 1
+
+
+def test_server_async_clients(monkeypatch):
+    monkeypatch.setattr(aio, 'AsyncMongoClient', FakeAsyncClient)
+    server = MongoDBServer('async_test_server')
+    monkeypatch.setattr(server, '_client_args', lambda: ([], {}))
+
+    async def _connect():
+        return server._get_async_connection()
+
+    # a client is kept per event loop, and closed on its loop
+    loop = asyncio.new_event_loop()
+    client = loop.run_until_complete(_connect())
+    assert loop.run_until_complete(_connect()) is client
+    other_client = asyncio.run(_connect())
+    assert other_client is not client
+    server.close()
+    assert client.closed
+    assert not other_client.closed  # its loop is closed
+    assert len(server._async_clients) == 0
+    assert loop.run_until_complete(_connect()) is not client
+    loop.close()
+
+    async def _connect_and_close():
+        client = server._get_async_connection()
+        server.close()
+        assert not client.closed  # bound to the running loop
+        await server.aclose()
+        return client
+
+    assert asyncio.run(_connect_and_close()).closed
+    # asyncio clients are only built from a running event loop
+    with pytest.raises(RuntimeError):
+        server._get_async_connection()
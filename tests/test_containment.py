@@ -0,0 +1,77 @@
+"""Testing query containment of the shleem package."""
+
+import datetime
+
+import numpy as np
+import pytest
+
+from shleem.mongodb.containment import (
+    predicates,
+    contains,
+    filter_mask,
+    FilterColumn,
+)
+
+
+def test_predicates():
+    assert predicates({'a': 1, 'b': {'$in': [1, 2]}}) == [
+        ('a', 'eq', 1), ('b', 'in', [1, 2])]
+    (field, kind, field_range), = predicates({'a': {'$gt': 1, '$lte': 5}})
+    assert (field, kind) == ('a', 'range')
+    assert (field_range.lower, field_range.lower_strict) == (1, True)
+    assert (field_range.upper, field_range.upper_strict) == (5, False)
+    assert len(predicates({'$and': [{'a': 1}, {'b': {'$eq': 2}}]})) == 2
+    assert predicates({'$or': [{'a': 1}]}) is None
+    assert predicates({'a': {'$regex': 'x'}}) is None
+    assert predicates({'a': {'b': 1}}) is None
+    assert predicates({'a': None}) is None
+
+
+@pytest.mark.parametrize('outer, inner, expected', [
+    ({'a': {'$gte': 1, '$lte': 10}}, {'a': {'$gte': 2, '$lte': 10}}, True),
+    ({'a': {'$gte': 1, '$lte': 10}}, {'a': {'$gte': 0, '$lte': 10}}, False),
+    ({'a': {'$gt': 1}}, {'a': {'$gte': 1}}, False),
+    ({'a': {'$gt': 1}}, {'a': {'$gt': 1, '$lt': 3}}, True),
+    ({'a': {'$gte': 1}}, {'a': {'$gt': 1}}, True),
+    ({'a': {'$lt': 5}}, {'a': {'$lte': 5}}, False),
+    ({'a': {'$gte': '1'}}, {'a': {'$gte': 2}}, False),
+    ({'a': {'$gte': 1}}, {'a': {'$in': [1, 4]}}, True),
+    ({'a': {'$gte': 1}}, {'a': 3, 'b': 'x'}, True),
+    ({'a': {'$gte': 1}}, {'b': 'x'}, False),
+    ({'a': {'$in': [1, 2, 3]}}, {'a': {'$in': [3, 1]}}, True),
+    ({'a': {'$in': [1, 2, 3]}}, {'a': {'$in': [3, 4]}}, False),
+    ({'a': {'$in': [1, 2, 3]}}, {'a': {'$gte': 1, '$lte': 3}}, False),
+    ({'a': 1}, {'a': {'$in': [1]}}, True),
+    ({'a': 1}, {'a': True}, False),
+    ({'a': 1, 'b': {'$lt': 3}}, {'$and': [{'a': 1}, {'b': 0}]}, True),
+    ({'a': {'$ne': 1}}, {'a': 2}, False),
+])
+def test_contains(outer, inner, expected):
+    assert contains(outer, inner) is expected
+
+
+def test_filter_mask():
+    columns = {
+        'n': np.array([1.0, 2.0, np.nan, 4.0]),
+        'z': np.array(['10001', None, '10003', '10004'], dtype=object),
+        'd': np.array(['2020-01-01', '2021-01-01', 'NaT', '2022-01-01'],
+                      dtype='datetime64[us]'),
+        'mixed': np.array([1, 'a', None, 2.5], dtype=object),
+    }
+
+    def filter_column(field):
+        return FilterColumn(columns[field])
+
+    def rows(query):
+        return list(np.flatnonzero(filter_mask(filter_column, query, 4)))
+
+    assert rows({'n': {'$gte': 2}}) == [1, 3]
+    assert rows({'n': {'$in': [1, 4]}}) == [0, 3]
+    assert rows({'n': '2'}) == []
+    assert rows({'z': {'$gt': '10001', '$lte': '10004'}}) == [2, 3]
+    assert rows({'z': '10003', 'n': {'$lt': 10}}) == []
+    assert rows({'d': {'$gte': datetime.datetime(2021, 1, 1)}}) == [1, 3]
+    with pytest.raises(TypeError):
+        rows({'mixed': 1})
+    with pytest.raises(TypeError):
+        rows({'missing': 1})
@@ -1,5 +1,9 @@
 """Testing core functionalities of the shleem package."""
 
+import sys
+import asyncio
+import subprocess
+
 from shleem import (
     DataSource,
     DataTap,
@@ -31,3 +35,48 @@ def test_data_tap():
     assert shuq.source_type == "ShleemDB"
     assert shuq.__repr__() == "DataTap: ShleemDB.{'a': 4}"
     assert shuq.tap() == []
+
+
+def test_data_tap_atap():
+    class ShleemDBRange(DataTap):
+        def __init__(self):
+            super().__init__(identifier="ShleemDB.range")
+
+        def tap(self, **kwargs):
+            return iter(range(kwargs['n']))
+
+    async def collect(data_tap, **kwargs):
+        return [item async for item in data_tap.atap(**kwargs)]
+
+    shur = ShleemDBRange()
+    loop = asyncio.new_event_loop()
+    try:
+        assert loop.run_until_complete(collect(shur, n=250)) == list(
+            range(250))
+    finally:
+        loop.close()
+
+
+def test_import_is_lightweight():
+    code = (
+        "import sys, shleem, shleem.mongodb;"
+        "print('pymongo' in sys.modules or 'bson' in sys.modules)"
+    )
+    output = subprocess.check_output([sys.executable, '-c', code])
+    assert output.strip() == b'False'
+
+
+def test_missing_credentials_attribute_lookup(tmpdir, monkeypatch, capsys):
+    import importlib
+    import shleem.mongodb
+    mongodb_module = importlib.import_module('shleem.mongodb.mongodb')
+    monkeypatch.setattr(
+        mongodb_module, 'SHLEEM_MONGODB_CRED_FPATH',
+        str(tmpdir.join('missing.json')))
+    monkeypatch.setattr(mongodb_module, '_MISSING_CRED_REPORTED', False)
+    assert not hasattr(shleem.mongodb, '__wrapped__')
+    assert not hasattr(shleem.mongodb, '_private')
+    assert capsys.readouterr().out == ''
+    for _ in range(3):
+        assert not hasattr(shleem.mongodb, 'no_such_server')
+    assert capsys.readouterr().out.count('should be named') == 1
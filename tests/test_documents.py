@@ -0,0 +1,61 @@
+"""Testing the client-side handling of MongoDB documents of the shleem
+package."""
+
+import datetime
+
+from bson import ObjectId
+
+from shleem.mongodb.documents import (
+    path_values,
+    get_field,
+    bracket,
+    sort_key,
+    strip_path,
+)
+
+
+DOC = {
+    'a': {'b': 1},
+    'grades': [{'score': 2}, {'score': 14}],
+    'tags': ['x', 'y'],
+}
+
+
+def test_path_values():
+    assert path_values(DOC, ['a', 'b']) == [1]
+    assert path_values(DOC, ['grades', 'score']) == [2, 14]
+    assert path_values(DOC, ['grades', '1', 'score']) == [14]
+    assert path_values(DOC, ['a', 'c']) == []
+
+
+def test_get_field():
+    assert get_field(DOC, 'a.b') == 1
+    assert get_field(DOC, 'grades.score') == 2
+    assert get_field(DOC, 'tags') == ['x', 'y']
+    assert get_field(DOC, 'a.b.c') is None
+    assert get_field(DOC, 'nope') is None
+
+
+def test_bracket():
+    assert bracket(True) == 'bool'
+    assert bracket(1) == bracket(2.5) == 'number'
+    assert bracket('a') == 'string'
+    assert bracket(None) == 'null'
+    assert bracket(ObjectId()) == 'objectid'
+    assert bracket(datetime.datetime(2020, 1, 1)) == 'date'
+
+
+def test_sort_key():
+    values = [True, 'a', None, ObjectId(), 3, {'a': 1}, 1.5]
+    ordered = sorted(values, key=sort_key)
+    assert ordered[0] is None
+    assert ordered[1:3] == [1.5, 3]
+    assert ordered[3] == 'a'
+    assert ordered[-1] is True
+
+
+def test_strip_path():
+    doc = {'a': {'b': 1, 'c': 2}, 'grades': [{'score': 2, 'x': 1}]}
+    strip_path(doc, 'a.b')
+    strip_path(doc, 'grades.score')
+    assert doc == {'a': {'c': 2}, 'grades': [{'x': 1}]}
@@ -0,0 +1,81 @@
+"""Testing single-flight deduplication of taps in the shleem package."""
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from shleem import DataTap
+from shleem.flight import SingleFlight
+
+
+class BlockingTap(DataTap):
+
+    def __init__(self, identifier):
+        super().__init__(identifier=identifier)
+        self.release = threading.Event()
+        self.num_taps = 0
+        self.fail = False
+
+    def tap(self, **kwargs):
+        self.num_taps += 1
+        self.release.wait()
+        if self.fail:
+            raise RuntimeError("tap failed")
+        return iter([{'i': i, 'n': kwargs.get('n')} for i in range(3)])
+
+
+def _wait_in_flight(flight, data_tap, num_callers=1, **kwargs):
+    key = (data_tap.identifier, data_tap.tap_hash(**kwargs))
+    for _ in range(1000):
+        call = flight._calls.get(key)
+        if call is not None and call.num_callers >= num_callers:
+            return
+        threading.Event().wait(0.001)
+    raise AssertionError("tap never started")  # pragma: no cover
+
+
+def test_single_flight():
+    flight = SingleFlight()
+    data_tap = BlockingTap('blocking')
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        first = executor.submit(lambda: list(flight.tap(data_tap, n=1)))
+        _wait_in_flight(flight, data_tap, n=1)
+        others = [
+            executor.submit(lambda: list(flight.tap(data_tap, n=1)))
+            for _ in range(2)
+        ]
+        _wait_in_flight(flight, data_tap, num_callers=3, n=1)
+        data_tap.release.set()
+        results = [first.result()] + [other.result() for other in others]
+    assert data_tap.num_taps == 1
+    assert all(result == results[0] for result in results)
+    assert not flight.in_flight(data_tap, n=1)
+    # completed taps are not cached
+    list(flight.tap(data_tap, n=1))
+    assert data_tap.num_taps == 2
+    # different resolved requests are not shared
+    list(flight.tap(data_tap, n=2))
+    assert data_tap.num_taps == 3
+
+
+def test_single_flight_error():
+    flight = SingleFlight()
+    data_tap = BlockingTap('failing')
+    data_tap.fail = True
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        first = executor.submit(lambda: list(flight.tap(data_tap)))
+        _wait_in_flight(flight, data_tap)
+        second = executor.submit(lambda: list(flight.tap(data_tap)))
+        _wait_in_flight(flight, data_tap, num_callers=2)
+        data_tap.release.set()
+        for future in (first, second):
+            with pytest.raises(RuntimeError):
+                future.result()
+    assert not flight.in_flight(data_tap)
+
+
+def test_tap_shared():
+    data_tap = BlockingTap('shared')
+    data_tap.release.set()
+    assert len(list(data_tap.tap_shared(n=3))) == 3
@@ -0,0 +1,204 @@
+"""Testing tap instrumentation of the shleem package."""
+
+import json
+import asyncio
+
+import pytest
+
+from shleem import (
+    DataTap,
+    MetricsCollector,
+)
+from shleem.instrument import (
+    add_hook,
+    remove_hook,
+    is_metering,
+    record_fetch,
+    InstrumentedIterator,
+    InstrumentedAsyncIterator,
+)
+
+
+class RangeTap(DataTap):
+
+    def tap(self, n, fail_at=None):
+        if n < 0:
+            raise ValueError("negative n")
+        return self._run(n, fail_at)
+
+    def _run(self, n, fail_at):
+        for i in range(n):
+            if i == fail_at:
+                raise RuntimeError("failed at {}".format(i))
+            yield {'i': i}
+
+
+@pytest.fixture
+def events():
+    recorded = []
+
+    def hook(event, identifier, info):
+        recorded.append((event, identifier, info))
+
+    add_hook(hook)
+    yield recorded
+    remove_hook(hook)
+
+
+def test_no_hooks():
+    assert not isinstance(RangeTap('range').tap(n=3), InstrumentedIterator)
+
+
+def test_events(events):
+    data_tap = RangeTap('range')
+    assert len(list(data_tap.tap(n=2500))) == 2500
+    names = [event for event, _, _ in events]
+    assert names == ['pre_resolve', 'post_resolve', 'first_batch', 'chunk',
+                     'chunk', 'chunk', 'exhausted']
+    assert all(identifier == 'range' for _, identifier, _ in events)
+    assert all(info['method'] == 'tap' for _, _, info in events)
+    assert [info['num_items'] for event, _, info in events
+            if event == 'chunk'] == [1000, 1000, 500]
+    assert events[-1][2]['num_items'] == 2500
+
+
+def test_all_tap_methods_emit_events(events):
+    data_tap = RangeTap('range')
+
+    def methods():
+        return [(event, info['method']) for event, _, info in events]
+
+    # taps made by a tap method are not instrumented separately
+    assert len(list(data_tap.tap_prefetched(n=5))) == 5
+    assert methods() == [
+        ('pre_resolve', 'tap_prefetched'), ('post_resolve', 'tap_prefetched'),
+        ('first_batch', 'tap_prefetched'), ('chunk', 'tap_prefetched'),
+        ('exhausted', 'tap_prefetched')]
+    del events[:]
+
+    # fully computed results are exhausted on return
+    with data_tap.tap_buffered(n=5) as buffer:
+        assert len(buffer) == 5
+    assert methods() == [
+        ('pre_resolve', 'tap_buffered'), ('post_resolve', 'tap_buffered'),
+        ('exhausted', 'tap_buffered')]
+    assert events[-1][2]['num_items'] is None
+    del events[:]
+
+    async def consume():
+        iterator = data_tap.atap(n=5)
+        assert isinstance(iterator, InstrumentedAsyncIterator)
+        return [item async for item in iterator]
+
+    loop = asyncio.new_event_loop()
+    try:
+        assert len(loop.run_until_complete(consume())) == 5
+    finally:
+        loop.close()
+    assert methods() == [
+        ('pre_resolve', 'atap'), ('post_resolve', 'atap'),
+        ('first_batch', 'atap'), ('chunk', 'atap'), ('exhausted', 'atap')]
+    del events[:]
+
+    # tap_key and tap_hash are not tap methods
+    data_tap.tap_hash(n=5)
+    assert events == []
+
+
+def test_error_events(events):
+    data_tap = RangeTap('range')
+    with pytest.raises(RuntimeError):
+        list(data_tap.tap(n=10, fail_at=5))
+    assert events[-1][0] == 'error'
+    assert isinstance(events[-1][2]['error'], RuntimeError)
+    del events[:]
+    with pytest.raises(ValueError):
+        data_tap.tap(n=-1)
+    assert [event for event, _, _ in events] == ['pre_resolve', 'error']
+
+
+def test_metrics_collector(tmpdir):
+    data_tap = RangeTap('range "quoted"')
+    with MetricsCollector() as collector:
+        list(data_tap.tap(n=1500))
+        list(data_tap.tap(n=10))
+        with pytest.raises(RuntimeError):
+            list(data_tap.tap(n=10, fail_at=3))
+    list(data_tap.tap(n=10))  # not collected
+    metrics = collector.to_dict()['range "quoted"']
+    assert metrics['total'] == 3
+    assert metrics['errors_total'] == 1
+    assert metrics['items_total'] == 1510
+    assert metrics['chunks_total'] == 3
+    assert metrics['seconds']['count'] == 2
+    assert metrics['first_batch_seconds']['count'] == 3
+    assert metrics['resolve_seconds']['buckets']['+Inf'] == 3
+
+    json_fpath = str(tmpdir.join('metrics.json'))
+    collector.to_json(json_fpath)
+    with open(json_fpath) as json_file:
+        assert json.load(json_file) == collector.to_dict()
+
+    prom_fpath = str(tmpdir.join('metrics.prom'))
+    text = collector.to_prometheus(prom_fpath)
+    with open(prom_fpath) as prom_file:
+        assert prom_file.read() == text
+    assert '# TYPE valve_tap_seconds histogram' in text
+    assert (
+        'valve_tap_seconds_bucket{identifier="range \\"quoted\\"",le="+Inf"}'
+        ' 2') in text
+    assert 'valve_tap_items_total{identifier="range \\"quoted\\""} 1510' in (
+        text)
+
+    collector.reset()
+    assert collector.to_dict() == {}
+
+
+class FetchingTap(DataTap):
+
+    def tap(self, n):
+        for i in range(n):
+            record_fetch(num_bytes=10, fetch_seconds=0.5, decode_seconds=0.25)
+            yield {'i': i}
+
+
+def test_fetch_metering(events):
+    assert not is_metering()
+    assert len(list(FetchingTap('fetching').tap(n=4))) == 4
+    info = events[-1][2]
+    assert events[-1][0] == 'exhausted'
+    assert info['num_bytes'] == 40
+    assert info['fetch_seconds'] == 2.0
+    assert info['decode_seconds'] == 1.0
+    # taps not reporting fetches are not metered
+    list(RangeTap('range').tap(n=4))
+    assert events[-1][2]['num_bytes'] is None
+    assert events[-1][2]['fetch_seconds'] is None
+
+    with MetricsCollector() as collector:
+        list(FetchingTap('fetching').tap(n=3))
+        list(RangeTap('range').tap(n=3))
+    metrics = collector.to_dict()
+    assert metrics['fetching']['bytes_total'] == 30
+    assert metrics['fetching']['fetch_seconds']['sum'] == 1.5
+    assert metrics['fetching']['decode_seconds']['count'] == 1
+    assert metrics['range']['bytes_total'] == 0
+    assert metrics['range']['fetch_seconds']['count'] == 0
+
+
+def test_metered_cursor(events):
+    bson = pytest.importorskip('bson')
+    metering = pytest.importorskip('shleem.mongodb.metering')
+    from bson.raw_bson import RawBSONDocument
+    raw_documents = [
+        RawBSONDocument(bson.encode({'i': i})) for i in range(3)]
+
+    class MeteredTap(DataTap):
+        def tap(self):
+            return metering.MeteredCursor(
+                iter(raw_documents), bson.codec_options.DEFAULT_CODEC_OPTIONS)
+
+    assert list(MeteredTap('metered').tap()) == [{'i': i} for i in range(3)]
+    assert events[-1][2]['num_bytes'] == sum(
+        len(raw_document.raw) for raw_document in raw_documents)
+    assert metering.raw_collection(object()) is None
@@ -0,0 +1,184 @@
+"""Testing live datasets of the shleem package."""
+
+import pytest
+from pymongo.errors import OperationFailure
+
+import shleem
+from shleem.mongodb.matcher import match
+from shleem.mongodb.live import change_stream_pipeline
+
+
+class FakeChangeStream(object):
+
+    def __init__(self, collection, pipeline, resume_after):
+        self.collection = collection
+        self.pipeline = pipeline
+        self.num_reads = 0
+        if resume_after is None:
+            self.position = len(collection.events)
+        else:
+            self.position = resume_after['_data']
+            if self.position < collection.oldest_event:
+                raise OperationFailure('history lost', code=286)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    @property
+    def resume_token(self):
+        if self.collection.token_on_read and not self.num_reads:
+            return None
+        return {'_data': self.position}
+
+    def try_next(self):
+        self.num_reads += 1
+        events = self.collection.events
+        while self.position < len(events):
+            event = events[self.position]
+            self.position += 1
+            if match(event, self.pipeline[0]['$match']):
+                return {'operationType': event['operationType'],
+                        'documentKey': event['documentKey']}
+        return None
+
+
+class FakeCollection(object):
+
+    def __init__(self, documents):
+        self.documents = {doc['_id']: doc for doc in documents}
+        self.events = []
+        self.oldest_event = 0
+        self.num_finds = 0
+        # as servers older than MongoDB 4.0.7, report no resume token before
+        # the change stream is first read
+        self.token_on_read = False
+
+    def find(self, filter=None, projection=None, skip=0, limit=0):
+        self.num_finds += 1
+        for doc in list(self.documents.values()):
+            if match(doc, filter or {}):
+                if projection:
+                    yield {field: value for field, value in doc.items()
+                           if field in projection or field == '_id'}
+                else:
+                    yield dict(doc)
+
+    def watch(self, pipeline, resume_after=None, max_await_time_ms=None):
+        return FakeChangeStream(self, pipeline, resume_after)
+
+    def _event(self, operation, _id, full_document=None):
+        event = {'operationType': operation, 'documentKey': {'_id': _id}}
+        if full_document is not None:
+            event['fullDocument'] = dict(full_document)
+        self.events.append(event)
+
+    def insert(self, doc):
+        self.documents[doc['_id']] = doc
+        self._event('insert', doc['_id'], doc)
+
+    def update(self, _id, changes):
+        self.documents[_id].update(changes)
+        self._event('update', _id)
+
+    def delete(self, _id):
+        del self.documents[_id]
+        self._event('delete', _id)
+
+
+@pytest.fixture
+def fake_collection(monkeypatch):
+    fake = FakeCollection([
+        {'_id': i, 'borough': ['Queens', 'Bronx'][i % 2], 'n': i}
+        for i in range(10)])
+    collection = shleem.mongodb.server(
+        'live_test_server').live_test_db.live_test_collection
+    monkeypatch.setattr(
+        collection, '_get_connection', lambda *args: fake)
+    return collection, fake
+
+
+def _borough(**kwargs):
+    return kwargs['borough']
+
+
+def _id_of(doc):
+    return doc['_id']
+
+
+def test_change_stream_pipeline():
+    pipeline = change_stream_pipeline({'$or': [{'a': 1}, {'b.c': 2}]})
+    assert pipeline[0]['$match']['$or'][0] == {
+        'operationType': 'insert',
+        '$or': [{'fullDocument.a': 1}, {'fullDocument.b.c': 2}]}
+    # unsupported predicates do not filter inserts
+    pipeline = change_stream_pipeline({'$expr': {'$gt': ['$a', 1]}})
+    assert pipeline[0]['$match']['$or'][0] == {'operationType': 'insert'}
+
+
+def test_live_dataset(fake_collection, tmpdir):
+    collection, fake = fake_collection
+    live = collection.live(
+        {'borough': _borough}, projection=['n'], live_dir=str(tmpdir),
+        borough='Queens')
+    assert sorted(doc['n'] for doc in live.tap()) == [0, 2, 4, 6, 8]
+    assert live.tap_key() == collection.query(
+        {'borough': _borough}, projection=['n']).tap_key(borough='Queens')
+
+    fake.insert({'_id': 10, 'borough': 'Queens', 'n': 10})
+    fake.insert({'_id': 11, 'borough': 'Bronx', 'n': 11})
+    fake.update(2, {'n': 20})
+    fake.update(4, {'borough': 'Bronx'})
+    fake.update(1, {'borough': 'Queens'})
+    fake.delete(6)
+    # the insert out of the predicate is filtered out
+    assert live.sync() == 5
+    expected = [{'_id': 0, 'n': 0}, {'_id': 1, 'n': 1}, {'_id': 2, 'n': 20},
+                {'_id': 8, 'n': 8}, {'_id': 10, 'n': 10}]
+    assert sorted(live.tap(sync=False), key=_id_of) == expected
+
+    # a restarted live dataset continues from its persisted resume token
+    fake.delete(0)
+    num_finds = fake.num_finds
+    restarted = collection.live(
+        {'borough': _borough}, projection=['n'], live_dir=str(tmpdir),
+        borough='Queens')
+    assert sorted(restarted.tap(sync=False), key=_id_of) == expected
+    assert restarted.sync() == 1
+    assert len(restarted) == 4
+    assert fake.num_finds == num_finds
+
+    # a change stream that cannot be resumed rebuilds the dataset
+    fake.oldest_event = len(fake.events) + 1
+    fake.insert({'_id': 12, 'borough': 'Queens', 'n': 12})
+    assert restarted.sync() == -1
+    assert len(restarted) == 5
+    restarted.clear()
+    assert restarted.resume_token is None
+
+
+def test_live_dataset_token_on_read(fake_collection, tmpdir):
+    collection, fake = fake_collection
+    fake.token_on_read = True
+    live = collection.query({'borough': 'Bronx'}).live(live_dir=str(tmpdir))
+    assert live.sync() == -1
+    assert live.resume_token is not None
+    fake.update(3, {'n': 30})
+    # the dataset is synced instead of rebuilt
+    assert live.sync() == 1
+    assert {doc['_id']: doc['n'] for doc in live.tap(sync=False)}[3] == 30
+
+
+def test_live_dataset_invalidated(fake_collection, tmpdir):
+    collection, fake = fake_collection
+    live = collection.query({'borough': 'Bronx'}).live(live_dir=str(tmpdir))
+    assert live.sync() == -1
+    fake.update(3, {'n': 30})
+    fake.documents.clear()
+    fake._event('drop', None)
+    assert live.sync() == -1
+    assert len(live) == 0
+    with pytest.raises(ValueError):
+        collection.query({}, limit=5).live()
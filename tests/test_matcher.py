@@ -0,0 +1,65 @@
+"""Testing the client-side MongoDB query matcher of the shleem package."""
+
+import re
+
+import pytest
+
+from shleem.exceptions import UnsupportedQueryException
+from shleem.mongodb.matcher import (
+    match,
+    query_fields,
+)
+
+
+DOC = {
+    '_id': 1,
+    'name': 'Morris Park Bake Shop',
+    'borough': 'Bronx',
+    'address': {'zipcode': '10462', 'coord': [-73.85, 40.84]},
+    'grades': [{'grade': 'A', 'score': 2}, {'grade': 'B', 'score': 14}],
+    'tags': ['bakery', 'cafe'],
+    'open': True,
+}
+
+
+@pytest.mark.parametrize('query, expected', [
+    ({}, True),
+    ({'borough': 'Bronx'}, True),
+    ({'borough': 'Queens'}, False),
+    ({'address.zipcode': {'$gte': '10400', '$lte': '10500'}}, True),
+    ({'address.zipcode': {'$gt': 10400}}, False),
+    ({'tags': 'cafe'}, True),
+    ({'tags': ['bakery', 'cafe']}, True),
+    ({'grades.score': {'$gt': 10}}, True),
+    ({'grades.score': {'$gt': 20}}, False),
+    ({'grades.0.grade': 'A'}, True),
+    ({'grades': {'$elemMatch': {'grade': 'B', 'score': {'$lt': 5}}}}, False),
+    ({'grades': {'$elemMatch': {'grade': 'B', 'score': {'$gt': 5}}}}, True),
+    ({'borough': {'$in': ['Queens', 'Bronx']}}, True),
+    ({'borough': {'$nin': ['Queens', 'Bronx']}}, False),
+    ({'tags': {'$all': ['cafe', 'bakery']}}, True),
+    ({'tags': {'$size': 2}}, True),
+    ({'missing': None}, True),
+    ({'missing': {'$exists': True}}, False),
+    ({'name': {'$regex': '^morris', '$options': 'i'}}, True),
+    ({'name': re.compile('Bake')}, True),
+    ({'borough': {'$ne': 'Bronx'}}, False),
+    ({'borough': {'$not': {'$in': ['Queens']}}}, True),
+    ({'open': 1}, False),
+    ({'_id': {'$mod': [2, 1]}}, True),
+    ({'$or': [{'borough': 'Queens'}, {'tags': 'bakery'}]}, True),
+    ({'$and': [{'borough': 'Bronx'}, {'tags': 'pizza'}]}, False),
+    ({'$nor': [{'borough': 'Queens'}]}, True),
+])
+def test_match(query, expected):
+    assert match(DOC, query) == expected
+
+
+def test_unsupported_queries():
+    with pytest.raises(UnsupportedQueryException):
+        match(DOC, {'$where': 'this.a > 1'})
+    with pytest.raises(UnsupportedQueryException):
+        query_fields({'a': {'$near': [1, 2]}})
+    assert query_fields({
+        '$or': [{'a.b': 1}, {'c': {'$gt': 2}}], 'd': {'$in': [1]},
+    }) == {'a.b', 'c', 'd'}
@@ -0,0 +1,42 @@
+"""Testing concurrent merging of iterators in the shleem package."""
+
+import time
+
+import pytest
+
+from shleem.merge import merge_iterators
+
+
+def test_merge_iterators():
+    factories = [lambda i=i: iter(range(i * 100, (i + 1) * 100))
+                 for i in range(4)]
+    merged = list(merge_iterators(factories, max_workers=2, max_buffered=3))
+    assert sorted(merged) == list(range(400))
+    assert list(merge_iterators([])) == []
+
+
+def test_merge_iterators_failure_and_close():
+    def failing():
+        yield 1
+        raise KeyError('boom')
+
+    with pytest.raises(KeyError):
+        list(merge_iterators([failing, lambda: iter(range(10))]))
+
+    closed = []
+
+    class Cursor(object):
+        def __iter__(self):
+            return iter(range(10000))
+
+        def close(self):
+            closed.append(True)
+
+    merged = merge_iterators([Cursor], max_buffered=2)
+    assert next(merged) == 0
+    merged.close()
+    for _ in range(50):
+        if closed:
+            break
+        time.sleep(0.1)
+    assert closed
@@ -1,5 +1,8 @@
 """Testing MongoDB data sources for the shleem python package."""
 
+import pickle
+import asyncio
+
 import pytest
 from strct.hash import stable_hash
 
@@ -171,3 +174,643 @@ def test_missing_server():
     with pytest.raises(ValueError):
         client = missing_server._get_connection()
         assert not client.database_names
+
+
+def _min_val(**kwargs):
+    return kwargs['min_val']
+
+
+def test_pickling(examp):
+    param_query = examp.query(
+        {"address.zipcode": {"$gte": _min_val}}, identifier="zipcode_min",
+        projection=['name'], limit=5)
+    unpickled = pickle.loads(pickle.dumps(param_query))
+    assert unpickled.identifier == param_query.identifier
+    assert unpickled.tap_key(min_val="11249") == param_query.tap_key(
+        min_val="11249")
+    # servers are unpickled through the per-process server registry
+    assert unpickled.mongodb_collection.mongodb_db.mongodb_server is (
+        param_query.mongodb_collection.mongodb_db.mongodb_server)
+    assert [doc['_id'] for doc in unpickled.tap(min_val="11249")] == [
+        doc['_id'] for doc in param_query.tap(min_val="11249")]
+
+    param_agg = examp.aggregation(
+        [{"$match": {"address.zipcode": {"$gte": _min_val}}}])
+    unpickled = pickle.loads(pickle.dumps(param_agg))
+    assert unpickled.identifier == param_agg.identifier
+    assert unpickled.tap_key(min_val="1") == param_agg.tap_key(min_val="1")
+
+
+def test_tap_key(examp):
+    param_query = examp.query(
+        {"address.zipcode": {"$gte": lambda **kwargs: kwargs["min_val"]}},
+        identifier="zipcode_min", limit=5)
+    assert param_query.tap_key(min_val="11249") == {
+        'filter': {"address.zipcode": {"$gte": "11249"}},
+        'projection': None,
+        'skip': 0,
+        'limit': 5,
+    }
+    assert param_query.tap_hash(min_val="11249") == param_query.tap_hash(
+        min_val="11249")
+    assert param_query.tap_hash(min_val="11249") != param_query.tap_hash(
+        min_val="11300")
+    param_agg = examp.aggregation([
+        {"$match": {"borough": lambda **kwargs: kwargs["borough"]}},
+        {"$limit": 3},
+    ])
+    assert param_agg.tap_key(borough="Queens") == [
+        {"$match": {"borough": "Queens"}}, {"$limit": 3}]
+
+
+def test_parallel_tap(examp):
+    param_query_dict = {"address.zipcode": {
+        "$gte": lambda **kwargs: kwargs["min_val"],
+    }}
+    zipcode_min = examp.query(param_query_dict, identifier="zipcode_min")
+    serial_ids = set(
+        doc['_id'] for doc in zipcode_min.tap(min_val="11249"))
+    parallel_ids = [
+        doc['_id'] for doc in zipcode_min.tap_parallel(
+            num_partitions=5, min_val="11249")]
+    assert len(parallel_ids) == len(serial_ids)
+    assert set(parallel_ids) == serial_ids
+    # a full collection scan, partitioned by a user-chosen key
+    all_docs = examp.query({}, projection=['restaurant_id'])
+    parallel_ids = [
+        doc['restaurant_id'] for doc in all_docs.tap_parallel(
+            num_partitions=3, partition_key='restaurant_id', max_workers=2)]
+    assert sorted(parallel_ids) == sorted(
+        doc['restaurant_id'] for doc in all_docs.tap())
+
+
+@pytest.mark.usefixtures('async_collections')
+def test_atap(examp):
+    queens_people = examp.query({"borough": "Queens"}, limit=30)
+    borough_counts = examp.aggregation([
+        {'$group': {'_id': '$borough', 'count': {'$sum': 1}}}])
+
+    async def collect(data_tap, **kwargs):
+        return [doc async for doc in data_tap.atap(**kwargs)]
+
+    loop = asyncio.new_event_loop()
+    try:
+        docs = loop.run_until_complete(collect(queens_people))
+        assert [doc['_id'] for doc in docs] == [
+            doc['_id'] for doc in queens_people.tap()]
+        counts = loop.run_until_complete(collect(borough_counts))
+        assert sorted(doc['_id'] for doc in counts) == sorted(
+            doc['_id'] for doc in borough_counts.tap())
+    finally:
+        loop.close()
+
+
+def test_to_columns(examp):
+    np = pytest.importorskip('numpy')
+    queens_people = examp.query(
+        {"borough": "Queens"}, projection=['name', 'address.zipcode'],
+        limit=50)
+    assert queens_people.projected_fields() == [
+        '_id', 'name', 'address.zipcode']
+    columns = queens_people.to_columns()
+    docs = list(queens_people.tap())
+    assert list(columns) == ['_id', 'name', 'address.zipcode']
+    assert list(columns['address.zipcode']) == [
+        doc['address']['zipcode'] for doc in docs]
+    assert isinstance(columns['name'], np.ndarray)
+    no_id = examp.query({}, projection={'_id': 0, 'name': 1})
+    assert no_id.projected_fields() == ['name']
+    assert examp.query({}, projection={'grades': 0}).projected_fields() is None
+
+
+@pytest.mark.usefixtures('raw_batches')
+def test_tap_arrow(examp, monkeypatch):
+    pa = pytest.importorskip('pyarrow')
+    queens_people = examp.query(
+        {"borough": "Queens"}, projection={'_id': 0, 'name': 1, 'borough': 1})
+    batches = list(queens_people.tap_arrow())
+    assert all(isinstance(batch, pa.RecordBatch) for batch in batches)
+    table = pa.Table.from_batches(batches)
+    assert table.num_rows == len(list(queens_people.tap()))
+    assert set(table.column('borough').to_pylist()) == {'Queens'}
+
+    schema = {'name': pa.string()}
+    table = pa.Table.from_batches(
+        examp.query({"borough": "Queens"}).tap_arrow(schema=schema))
+    assert table.column_names == ['name']
+
+    borough_counts = examp.aggregation([
+        {'$group': {'_id': '$borough', 'count': {'$sum': 1}}}])
+    table = pa.Table.from_batches(borough_counts.tap_arrow())
+    assert sorted(table.column('_id').to_pylist()) == sorted(
+        doc['_id'] for doc in borough_counts.tap())
+
+    # ObjectIds are strings, decoded natively or not, in batches of the
+    # requested size
+    from shleem.mongodb import arrow
+    for native in (True, False):
+        if not native:
+            monkeypatch.setattr(arrow, 'has_native_decoder', lambda: False)
+        batches = list(examp.query({"borough": "Queens"}).tap_arrow(
+            batch_size=50))
+        assert [batch.num_rows for batch in batches[:-1]] == [50] * (
+            len(batches) - 1)
+        assert batches[0].schema.field('_id').type == pa.string()
+        assert batches[0].column('_id').to_pylist()[:3] == [
+            str(doc['_id']) for doc in examp.query(
+                {"borough": "Queens"}, limit=3).tap()]
+        table = pa.Table.from_batches(examp.query(
+            {"borough": "Queens"}).tap_arrow(schema={'_id': pa.string()}))
+        assert table.num_rows == len(list(queens_people.tap()))
+        assert table.column('_id').null_count == 0
+        table = pa.Table.from_batches(borough_counts.tap_arrow(batch_size=2))
+        assert table.num_rows == len(list(borough_counts.tap()))
+
+
+def test_watermark_and_between(examp):
+    queens_people = examp.query({"borough": "Queens"})
+    all_ids = sorted(doc['_id'] for doc in queens_people.tap())
+    assert queens_people.watermark('_id') == all_ids[-1]
+    assert examp.query({"borough": "Atlantis"}).watermark('_id') is None
+    middle = all_ids[len(all_ids) // 2]
+    upper_half = queens_people.between('_id', lower=middle)
+    assert upper_half.identifier == queens_people.identifier
+    assert sorted(doc['_id'] for doc in upper_half.tap()) == [
+        _id for _id in all_ids if _id > middle]
+    lower_half = queens_people.between('_id', upper=middle)
+    assert len(list(lower_half.tap())) + len(list(upper_half.tap())) == len(
+        all_ids)
+    with pytest.raises(ValueError):
+        examp.query({}, limit=3).between('_id', lower=middle)
+
+
+def test_tap_many(examp):
+
+    def getter(field_name):
+        return lambda **kwargs: kwargs[field_name]
+
+    zipcode_range = examp.query({"address.zipcode": {
+        "$gte": getter("min_val"), "$lte": getter("max_val")
+    }}, projection=['name'])
+    kwargs_list = [
+        {'min_val': str(min_val), 'max_val': str(min_val + 20)}
+        for min_val in range(11200, 11400, 10)
+    ]
+    kwargs_list.append(kwargs_list[0])
+    results = zipcode_range.tap_many(kwargs_list, max_batch_size=7)
+    assert len(results) == len(kwargs_list)
+    for kwargs, docs in zip(kwargs_list, results):
+        expected = list(zipcode_range.tap(**kwargs))
+        assert sorted(doc['_id'] for doc in docs) == sorted(
+            doc['_id'] for doc in expected)
+        # fields needed only for matching are stripped
+        assert all(set(doc) == {'_id', 'name'} for doc in docs)
+
+    by_borough = examp.query({"borough": getter("borough")})
+    boroughs = ['Queens', 'Bronx', 'Atlantis']
+    results = by_borough.tap_many([{'borough': b} for b in boroughs])
+    for borough, docs in zip(boroughs, results):
+        assert len(docs) == len(list(by_borough.tap(borough=borough)))
+        assert all(doc['borough'] == borough for doc in docs)
+
+    some_ids = [doc['_id'] for doc in examp.query({}, limit=3).tap()]
+    for projection in (['name'], {'name': 1}, {'name': 1, '_id': 0}):
+        by_id = examp.query({"_id": getter("_id")}, projection=projection)
+        results = by_id.tap_many([{'_id': _id} for _id in some_ids])
+        for _id, docs in zip(some_ids, results):
+            assert docs == list(by_id.tap(_id=_id))
+
+    # paths filtered on only are stripped from nested projected documents
+    zipcodes = [doc['address']['zipcode'] for doc in examp.query(
+        {}, limit=4).tap()]
+    for projection in (['address.street', 'name'], {'address.street': 1}):
+        by_zipcode = examp.query(
+            {"address.zipcode": getter("zipcode")}, projection=projection)
+        results = by_zipcode.tap_many([{'zipcode': z} for z in zipcodes])
+        for zipcode, docs in zip(zipcodes, results):
+            expected = list(by_zipcode.tap(zipcode=zipcode))
+            assert sorted(docs, key=lambda doc: doc['_id']) == sorted(
+                expected, key=lambda doc: doc['_id'])
+            assert all(set(doc['address']) == {'street'} for doc in docs)
+
+
+def test_instrumented_tap(examp):
+    queens = examp.query({"borough": "Queens"}, identifier="queens")
+    with shleem.MetricsCollector() as collector:
+        cursor = queens.tap()
+        first = cursor.next()
+        num_docs = 1 + len(list(cursor))
+        num_groups = len(list(examp.aggregation(
+            [{"$group": {"_id": "$borough"}}], identifier="boroughs").tap()))
+    metrics = collector.to_dict()
+    assert metrics[queens.identifier]['items_total'] == num_docs
+    assert first['borough'] == 'Queens'
+    assert metrics[examp.identifier + '.boroughs']['items_total'] == (
+        num_groups)
+
+    events = []
+
+    def hook(event, identifier, info):
+        events.append((event, info['method']))
+
+    shleem.instrument.add_hook(hook)
+    try:
+        pages = list(queens.tap_pages(page_size=100))
+        queens.tap_many([{}, {}])
+        list(queens.tap_parallel(num_partitions=2))
+    finally:
+        shleem.instrument.remove_hook(hook)
+    assert events.count(('pre_resolve', 'tap_pages')) == 1
+    assert ('exhausted', 'tap_pages') in events
+    # pages fetched by tap_pages are not instrumented separately
+    assert ('pre_resolve', 'tap_page') not in events
+    assert ('exhausted', 'tap_many') in events
+    assert ('exhausted', 'tap_parallel') in events
+    assert len(pages) > 1
+
+
+def test_tap_pages(examp):
+    queens = examp.query({"borough": "Queens"}, projection={"name": 1})
+    all_ids = sorted(doc['_id'] for doc in queens.tap())
+    pages = list(queens.tap_pages(page_size=7))
+    assert [doc['_id'] for page in pages for doc in page.documents] == all_ids
+    assert all(len(page.documents) == 7 for page in pages[:-1])
+    assert pages[-1].next_token is None
+    assert all(set(doc) == {'_id', 'name'} for doc in pages[0].documents)
+
+    # resuming from a page token
+    resumed = queens.tap_page(page_size=7, page_token=pages[2].next_token)
+    assert resumed.documents == pages[3].documents
+
+    # sorted by a non-unique key, with a projection stripping it
+    by_street = examp.query(
+        {"borough": "Queens"}, projection={"_id": 0, "name": 1}, skip=2,
+        limit=30)
+    pages = list(by_street.tap_pages(
+        page_size=4, sort_key='address.street', descending=True))
+    names = [doc['name'] for page in pages for doc in page.documents]
+    expected = sorted(
+        examp.query({"borough": "Queens"}).tap(),
+        key=lambda doc: (doc['address']['street'], doc['_id']),
+        reverse=True)[2:32]
+    assert names == [doc['name'] for doc in expected]
+    assert all(set(doc) == {'name'} for doc in pages[0].documents)
+
+    with pytest.raises(ValueError):
+        queens.tap_page(page_token=pages[0].next_token)
+    with pytest.raises(ValueError):
+        examp.query({"borough": "Bronx"}).tap_page(
+            page_token=queens.tap_page(page_size=2).next_token)
+    with pytest.raises(ValueError):
+        queens.tap_page(page_token='not a token')
+
+
+class FlakyCollection(object):
+    """Wraps a collection so its cursors fail after a few documents."""
+
+    def __init__(self, col_obj, num_failures, fail_after, error_cls):
+        self.col_obj = col_obj
+        self.num_failures = num_failures
+        self.fail_after = fail_after
+        self.error_cls = error_cls
+        self.num_finds = 0
+
+    def find(self, **kwargs):
+        self.num_finds += 1
+        cursor = self.col_obj.find(**kwargs)
+        if self.num_failures <= 0:
+            return cursor
+        self.num_failures -= 1
+        return FlakyCursor(cursor, self.fail_after, self.error_cls)
+
+
+class FlakyCursor(object):
+
+    def __init__(self, cursor, fail_after, error_cls):
+        self.cursor = cursor
+        self.fail_after = fail_after
+        self.error_cls = error_cls
+
+    def __iter__(self):
+        for i, document in enumerate(self.cursor):
+            if i == self.fail_after:
+                raise self.error_cls("connection lost")
+            yield document
+
+    def close(self):
+        self.cursor.close()
+
+
+def test_tap_resumable(examp, monkeypatch, tmpdir):
+    from pymongo.errors import AutoReconnect
+    queens = examp.query(
+        {"borough": lambda **kwargs: kwargs['borough']}, projection=['name'])
+    all_ids = sorted(doc['_id'] for doc in queens.tap(borough='Queens'))
+    checkpoint_dir = str(tmpdir)
+
+    flaky = FlakyCollection(
+        examp._get_connection(), num_failures=2, fail_after=50,
+        error_cls=AutoReconnect)
+    monkeypatch.setattr(examp, '_get_connection', lambda *args: flaky)
+    docs = list(queens.tap_resumable(
+        retry_delay=0, checkpoint_dir=checkpoint_dir, borough='Queens'))
+    assert [doc['_id'] for doc in docs] == all_ids
+    assert all(set(doc) == {'_id', 'name'} for doc in docs)
+    assert flaky.num_finds == 3
+    assert not list(tmpdir.visit(fil='*.bson'))
+
+    # too many consecutive transient errors
+    flaky.num_failures = 3
+    flaky.fail_after = 0
+    with pytest.raises(AutoReconnect):
+        list(queens.tap_resumable(
+            retry_delay=0, max_retries=2, checkpoint_dir=checkpoint_dir,
+            borough='Queens'))
+
+    # interrupted, then resumed from the last checkpoint
+    queens.clear_checkpoint(checkpoint_dir=checkpoint_dir, borough='Queens')
+    iterator = queens.tap_resumable(
+        sort_key='address.zipcode', checkpoint_every=10,
+        checkpoint_dir=checkpoint_dir, borough='Queens')
+    first_docs = [next(iterator) for _ in range(25)]
+    iterator.close()
+    assert len(list(tmpdir.visit(fil='*.bson'))) == 1
+    rest = list(queens.tap_resumable(
+        sort_key='address.zipcode', checkpoint_dir=checkpoint_dir,
+        borough='Queens'))
+    # the last document yielded before the interruption is delivered again
+    assert rest[0] == first_docs[-1]
+    assert sorted(doc['_id'] for doc in first_docs[:-1] + rest) == all_ids
+    with pytest.raises(ValueError):
+        examp.query({}, limit=3).tap_resumable()
+
+
+def test_containment_cache(examp):
+    from shleem.mongodb.containment import ContainmentCache
+    zipcode_range = examp.query({"address.zipcode": {
+        "$gte": lambda **kwargs: kwargs["min_val"],
+        "$lte": lambda **kwargs: kwargs["max_val"],
+    }}, projection=["name"])
+    cache = ContainmentCache()
+
+    def expected(**kwargs):
+        return sorted(str(doc['_id']) for doc in zipcode_range.tap(**kwargs))
+
+    def result(columns):
+        assert set(columns) == {'_id', 'name'}
+        return sorted(str(_id) for _id in columns['_id'])
+
+    wide = cache.to_columns(zipcode_range, min_val="10500", max_val="11500")
+    assert result(wide) == expected(min_val="10500", max_val="11500")
+    assert (cache.hits, cache.misses) == (0, 1)
+    assert cache.contains(zipcode_range, min_val="10600", max_val="11000")
+    narrow = cache.to_columns(zipcode_range, min_val="10600", max_val="11000")
+    assert result(narrow) == expected(min_val="10600", max_val="11000")
+    assert (cache.hits, cache.misses) == (1, 1)
+    # not contained
+    assert not cache.contains(zipcode_range, min_val="10000", max_val="11000")
+    cache.to_columns(zipcode_range, min_val="10000", max_val="11000")
+    assert (cache.hits, cache.misses) == (1, 2)
+
+    by_borough = examp.query(
+        {"borough": {"$in": lambda **kwargs: kwargs["boroughs"]}})
+    cache.to_columns(by_borough, boroughs=["Queens", "Bronx", "Manhattan"])
+    bronx = cache.to_columns(
+        by_borough, columns=['name', 'borough'], boroughs=["Bronx"])
+    assert set(bronx['borough']) == {'Bronx'}
+    assert len(bronx['name']) == len(list(by_borough.tap(
+        boroughs=["Bronx"])))
+    assert (cache.hits, cache.misses) == (2, 3)
+
+    # _id is returned even when it is both filtered on and not projected
+    by_id = examp.query(
+        {"_id": {"$in": lambda **kwargs: kwargs["ids"]}}, projection=["name"])
+    ids = [doc['_id'] for doc in examp.query({}, limit=3).tap()]
+    assert result(cache.to_columns(by_id, ids=ids)) == sorted(
+        str(_id) for _id in ids)
+    assert result(cache.to_columns(by_id, ids=ids[:1])) == [str(ids[0])]
+    assert (cache.hits, cache.misses) == (3, 4)
+
+    # nested paths filtered on only are not returned
+    by_zipcode = examp.query(
+        {"address.zipcode": {"$in": lambda **kwargs: kwargs["zipcodes"]}},
+        projection=["address.street"])
+    zipcodes = [doc['address']['zipcode'] for doc in examp.query(
+        {}, limit=3).tap()]
+    columns = cache.to_columns(by_zipcode, zipcodes=zipcodes)
+    assert set(columns) == {'_id', 'address.street'}
+    columns = cache.to_columns(by_zipcode, zipcodes=zipcodes[:1])
+    assert set(columns) == {'_id', 'address.street'}
+    assert len(columns['_id']) == len(list(by_zipcode.tap(
+        zipcodes=zipcodes[:1])))
+    assert (cache.hits, cache.misses) == (4, 5)
+
+
+def test_aggregation_tap_parallel(examp):
+    from shleem.exceptions import UnsupportedQueryException
+    scores = examp.aggregation([
+        {"$match": {"borough": {"$ne": lambda **kwargs: kwargs["excluded"]}}},
+        {"$unwind": "$grades"},
+        {"$group": {
+            "_id": "$borough",
+            "total": {"$sum": "$grades.score"},
+            "num_grades": {"$sum": 1},
+            "min_score": {"$min": "$grades.score"},
+            "max_score": {"$max": "$grades.score"},
+            "avg_score": {"$avg": "$grades.score"},
+        }},
+        {"$match": {"num_grades": {"$gt": 10}}},
+        {"$sort": {"_id": 1}},
+    ])
+    expected = list(scores.tap(excluded="Bronx"))
+    result = list(scores.tap_parallel(
+        num_partitions=3, max_workers=2, excluded="Bronx"))
+    assert [doc['_id'] for doc in result] == [doc['_id'] for doc in expected]
+    for doc, expected_doc in zip(result, expected):
+        assert doc['avg_score'] == pytest.approx(expected_doc['avg_score'])
+        doc.pop('avg_score')
+        expected_doc.pop('avg_score')
+        assert doc == expected_doc
+
+    counted = examp.aggregation([
+        {"$match": {"borough": "Queens"}}, {"$count": "num_queens"}])
+    assert list(counted.tap_parallel(num_partitions=4)) == list(counted.tap())
+
+    # non-decomposable pipelines fall back to a regular tap, unless strict
+    names = examp.aggregation([
+        {"$group": {"_id": "$borough", "names": {"$push": "$name"}}}])
+    assert len(list(names.tap_parallel())) == len(list(names.tap()))
+    with pytest.raises(UnsupportedQueryException):
+        names.tap_parallel(strict=True)
+
+
+def test_optimized_aggregation(examp):
+    pipeline = [
+        {"$sort": {"name": 1}},
+        {"$addFields": {"num_grades": {"$size": "$grades"}}},
+        {"$project": {"name": 1, "borough": 1, "_id": 0}},
+        {"$match": {"borough": lambda **kwargs: kwargs["borough"]}},
+        {"$limit": 20},
+    ]
+    agg = examp.aggregation(pipeline)
+    optimized = examp.aggregation(pipeline, optimize=True)
+    assert optimized.identifier == agg.identifier
+    assert optimized.optimization_report.changed
+    assert optimized.aggregation_pipeline[0]["$match"] is pipeline[3]["$match"]
+    assert list(optimized.tap(borough="Queens")) == list(
+        agg.tap(borough="Queens"))
+    unpickled = pickle.loads(pickle.dumps(examp.aggregation(
+        [{"$sort": {"name": 1}}, {"$match": {"borough": "Queens"}}],
+        optimize=True)))
+    assert unpickled.optimization_report.changed
+
+
+def test_tap_read_preference(examp):
+    from pymongo.read_preferences import SecondaryPreferred
+    assert examp._get_connection(
+        "secondaryPreferred").read_preference == SecondaryPreferred()
+    queens = examp.query({"borough": "Queens"}, projection=["name"])
+    assert list(queens.tap(read_preference="secondaryPreferred")) == list(
+        queens.tap())
+    assert len(list(queens.tap_parallel(
+        num_partitions=2, read_preference="nearest"))) == len(
+            list(queens.tap()))
+    counted = examp.aggregation([
+        {"$match": {"borough": "Queens"}}, {"$count": "num_queens"}])
+    assert list(counted.tap(read_preference={
+        "mode": "secondary", "max_staleness": 90})) == list(counted.tap())
+    with pytest.raises(ValueError):
+        queens.tap(read_preference="fastest")
+
+
+@pytest.mark.usefixtures('async_collections')
+def test_atap_read_preference(examp, monkeypatch):
+    queens = examp.query({"borough": "Queens"}, projection=["name"])
+    counted = examp.aggregation([
+        {"$match": {"borough": "Queens"}}, {"$count": "num_queens"}])
+    collection_class = type(examp)
+    get_async_connection = collection_class._get_async_connection
+    used = []
+
+    def recording(self, read_preference=None):
+        used.append(read_preference)
+        return get_async_connection(self, read_preference)
+
+    monkeypatch.setattr(
+        collection_class, '_get_async_connection', recording)
+
+    async def collect(data_tap, **kwargs):
+        return [doc async for doc in data_tap.atap(**kwargs)]
+
+    loop = asyncio.new_event_loop()
+    try:
+        assert loop.run_until_complete(collect(
+            queens, read_preference="secondaryPreferred")) == list(
+                queens.tap())
+        assert loop.run_until_complete(collect(
+            counted, read_preference="nearest")) == list(counted.tap())
+    finally:
+        loop.close()
+    assert used == ["secondaryPreferred", "nearest"]
+
+
+def test_replay_mongo_tap(examp, tmpdir, monkeypatch):
+    queens = examp.query(
+        {"borough": lambda **kwargs: kwargs["borough"]}, projection=["name"])
+    with shleem.replay_mode(replay_dir=str(tmpdir)):
+        recorded = list(queens.tap(borough="Queens"))
+
+    def _no_connection(*args):
+        raise AssertionError("Replayed taps must not connect.")
+
+    monkeypatch.setattr(examp, "_get_connection", _no_connection)
+    with shleem.replay_mode("replay", replay_dir=str(tmpdir)):
+        assert list(queens.tap(borough="Queens")) == recorded
+        assert list(queens.tap_prefetched(borough="Queens")) == recorded
+
+
+def _no_connection(*args, **kwargs):
+    raise AssertionError("Replayed taps must not connect.")
+
+
+def test_replay_mongo_tap_methods(examp, tmpdir, monkeypatch):
+    from shleem.exceptions import MissingRecordingException
+    by_borough = examp.query(
+        {"borough": lambda **kwargs: kwargs["borough"]}, projection=["name"])
+    counts = examp.aggregation([
+        {"$match": {"borough": {"$ne": "Missing"}}},
+        {"$group": {"_id": "$borough", "n": {"$sum": 1}}}])
+
+    async def collect(data_tap, **kwargs):
+        return [doc async for doc in data_tap.atap(**kwargs)]
+
+    def run_all():
+        loop = asyncio.new_event_loop()
+        try:
+            return [
+                list(by_borough.tap_parallel(
+                    num_partitions=2, borough="Queens")),
+                by_borough.tap_many([{"borough": "Queens"}, {
+                    "borough": "Bronx"}]),
+                loop.run_until_complete(collect(by_borough, borough="Bronx")),
+                sorted(counts.tap_parallel(num_partitions=2),
+                       key=lambda doc: doc['_id']),
+                loop.run_until_complete(collect(counts)),
+            ]
+        finally:
+            loop.close()
+
+    with shleem.replay_mode("record", replay_dir=str(tmpdir)):
+        recorded = run_all()
+
+    collection_class = type(examp)
+    monkeypatch.setattr(collection_class, "_get_connection", _no_connection)
+    monkeypatch.setattr(
+        collection_class, "_get_async_connection", _no_connection)
+    with shleem.replay_mode("replay", replay_dir=str(tmpdir)):
+        assert run_all() == recorded
+        # methods that cannot be replayed fail instead of connecting
+        for call in [
+                lambda: by_borough.tap_page(borough="Queens"),
+                lambda: by_borough.tap_pages(borough="Queens"),
+                lambda: by_borough.tap_resumable(borough="Queens"),
+                lambda: by_borough.watermark("name", borough="Queens"),
+                lambda: by_borough.live(borough="Queens"),
+                lambda: examp.live({"borough": "Queens"}),
+                counts.explain_costs,
+        ]:
+            with pytest.raises(MissingRecordingException):
+                call()
+    live = examp.query({"borough": "Queens"}).live(
+        live_dir=str(tmpdir.join("live")))
+    with shleem.replay_mode("replay", replay_dir=str(tmpdir)):
+        with pytest.raises(MissingRecordingException):
+            live.sync()
+
+
+def test_replay_mongo_tap_arrow(examp, tmpdir, monkeypatch):
+    pytest.importorskip('pyarrow')
+    queens = examp.query({"borough": "Queens"}, projection=["name"])
+    with shleem.replay_mode("record", replay_dir=str(tmpdir)):
+        recorded = [batch.to_pylist() for batch in queens.tap_arrow()]
+    monkeypatch.setattr(type(examp), "_get_connection", _no_connection)
+    with shleem.replay_mode("replay", replay_dir=str(tmpdir)):
+        assert [batch.to_pylist() for batch in queens.tap_arrow()] == (
+            recorded)
+
+
+def test_replay_containment_cache(examp, tmpdir, monkeypatch):
+    pytest.importorskip('numpy')
+    from shleem.mongodb.containment import ContainmentCache
+    by_boroughs = examp.query(
+        {"borough": {"$in": lambda **kwargs: kwargs["boroughs"]}},
+        projection=["name"])
+    with shleem.replay_mode("record", replay_dir=str(tmpdir)):
+        recorded = ContainmentCache().to_columns(
+            by_boroughs, boroughs=["Queens", "Bronx"])
+    monkeypatch.setattr(type(examp), "_get_connection", _no_connection)
+    with shleem.replay_mode("replay", replay_dir=str(tmpdir)):
+        replayed = ContainmentCache().to_columns(
+            by_boroughs, boroughs=["Queens", "Bronx"])
+    assert set(replayed) == set(recorded) == {'_id', 'name'}
+    assert list(replayed['name']) == list(recorded['name'])
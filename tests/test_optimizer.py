@@ -0,0 +1,123 @@
+"""Testing the aggregation pipeline optimizer of the shleem package."""
+
+from shleem.mongodb.optimizer import (
+    optimize_pipeline,
+    explain_cost,
+    _find_stats,
+)
+
+
+def _min_score(**kwargs):
+    return kwargs['min_score']
+
+
+def test_pushdown():
+    report = optimize_pipeline([
+        {'$sort': {'a': 1}},
+        {'$addFields': {'c': {'$add': ['$a', 1]}}},
+        {'$match': {'a': {'$gt': 1}}},
+        {'$match': {'b': _min_score}},
+    ])
+    assert report.optimized == [
+        {'$match': {'$and': [{'a': {'$gt': 1}}, {'b': _min_score}]}},
+        {'$sort': {'a': 1}},
+        {'$addFields': {'c': {'$add': ['$a', 1]}}},
+    ]
+    assert report.changed
+    # the original pipeline is left as is
+    assert report.original[2] == {'$match': {'a': {'$gt': 1}}}
+
+
+def test_no_pushdown():
+    pipelines = [
+        # the filtered field is computed by the preceding stage
+        [{'$addFields': {'a': 1}}, {'$match': {'a': 1}}],
+        [{'$project': {'b': 1}}, {'$match': {'a.x': 1}}],
+        [{'$unset': 'a'}, {'$match': {'a': None}}],
+        [{'$project': {'a': {'$toInt': '$b'}}}, {'$match': {'a': 1}}],
+        # a $match stage never commutes with a $limit or $group stage
+        [{'$limit': 5}, {'$match': {'a': 1}}],
+        [{'$group': {'_id': '$a'}}, {'$match': {'_id': 1}}],
+        [{'$project': {'a': 1}}, {'$match': {'$expr': {'$gt': ['$a', 1]}}}],
+    ]
+    for pipeline in pipelines:
+        assert optimize_pipeline(pipeline).optimized == pipeline
+
+
+def test_prune_projections():
+    report = optimize_pipeline([
+        {'$addFields': {'c': 1, 'd.x': '$b', 'e': 2}},
+        {'$project': {'a': 1, 'd': 1, '_id': 0}},
+        {'$project': {'d.x': 1}},
+    ])
+    assert report.optimized == [
+        {'$addFields': {'d.x': '$b'}},
+        {'$project': {'d.x': 1, '_id': 0}},
+    ]
+    # a subfield of a projected field cannot be widened
+    pipeline = [{'$project': {'a.x': 1}}, {'$project': {'a': 1}}]
+    assert optimize_pipeline(pipeline).optimized == pipeline
+
+
+def test_coalesce_limits():
+    report = optimize_pipeline([
+        {'$sort': {'a': -1}},
+        {'$project': {'a': 1}},
+        {'$skip': 2},
+        {'$skip': 3},
+        {'$limit': 10},
+        {'$limit': 20},
+    ])
+    assert report.optimized == [
+        {'$sort': {'a': -1}},
+        {'$skip': 5},
+        {'$limit': 10},
+        {'$project': {'a': 1}},
+    ]
+    assert not report.warnings
+    # without a preceding $sort, the $limit stage is not moved
+    pipeline = [{'$project': {'a': 1}}, {'$limit': 10}]
+    assert optimize_pipeline(pipeline).optimized == pipeline
+
+
+def test_unbounded_sort_warning():
+    report = optimize_pipeline([{'$sort': {'a': 1}}, {'$project': {'a': 1}}])
+    assert not report.changed
+    assert len(report.warnings) == 1
+    assert 'OptimizationReport' in repr(report)
+
+
+class _FakeDatabase(object):
+
+    def __init__(self):
+        self.commands = []
+
+    def command(self, name, value, **kwargs):
+        self.commands.append((name, value, kwargs))
+        return {'stages': [
+            {'$cursor': {'executionStats': {
+                'executionTimeMillis': 3, 'totalKeysExamined': 10,
+                'totalDocsExamined': 10, 'nReturned': 5,
+                'executionStages': {}}}},
+            {'$limit': 5},
+        ]}
+
+
+class _FakeCollection(object):
+    name = 'restaurants'
+
+    def __init__(self):
+        self.database = _FakeDatabase()
+
+
+def test_explain_cost():
+    col_obj = _FakeCollection()
+    cost = explain_cost(col_obj, [{'$match': {'a': 1}}])
+    assert cost == {
+        'executionTimeMillis': 3, 'totalKeysExamined': 10,
+        'totalDocsExamined': 10, 'nReturned': 5}
+    name, value, kwargs = col_obj.database.commands[0]
+    assert name == 'explain'
+    assert value['aggregate'] == 'restaurants'
+    assert kwargs == {'verbosity': 'executionStats'}
+    assert _find_stats({'queryPlanner': {}}) == {}
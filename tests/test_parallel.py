@@ -0,0 +1,67 @@
+"""Testing range-partitioned parallel queries of the shleem package."""
+
+import pytest
+
+from shleem.mongodb.parallel import (
+    sample_bounds,
+    partition_queries,
+    parallel_find,
+)
+
+mongomock = pytest.importorskip('mongomock')
+
+
+@pytest.fixture
+def col_obj():
+    col_obj = mongomock.MongoClient()['shleem_test']['parallel']
+    col_obj.insert_many([{'i': i, 'k': i} for i in range(200)])
+    col_obj.insert_many([{'i': 200 + i} for i in range(4)])
+    col_obj.insert_many([{'i': 204 + i, 'k': None} for i in range(4)])
+    col_obj.insert_many([{'i': 208 + i, 'k': str(i)} for i in range(3)])
+    return col_obj
+
+
+def test_partition_queries():
+    assert partition_queries({'a': 1}, 'k', []) == [{'a': 1}]
+    assert partition_queries({}, 'k', [3, 7]) == [
+        {'k': {'$lt': 3}},
+        {'k': {'$gte': 3, '$lt': 7}},
+        {'k': {'$gte': 7}},
+        {'k': {'$not': {'$type': 'number'}}},
+    ]
+    queries = partition_queries({'a': 1}, 'k', ['c'])
+    assert queries[0] == {'$and': [{'a': 1}, {'k': {'$lt': 'c'}}]}
+    assert queries[-1] == {
+        '$and': [{'a': 1}, {'k': {'$not': {'$type': 'string'}}}]}
+
+
+def test_sample_bounds(col_obj):
+    bounds = sample_bounds(col_obj, 'k', 4)
+    assert 1 <= len(bounds) <= 3
+    assert all(isinstance(bound, int) for bound in bounds)
+    assert bounds == sorted(bounds)
+    assert sample_bounds(col_obj, 'k', 1) == []
+    assert sample_bounds(col_obj, 'no_such_field', 4) == []
+
+
+@pytest.mark.parametrize('partition_key', ['k', '_id', 'no_such_field'])
+def test_parallel_find_mixed_keys(col_obj, partition_key):
+    docs = list(parallel_find(
+        col_obj, {}, partition_key=partition_key, num_partitions=4))
+    assert sorted(doc['i'] for doc in docs) == list(range(211))
+    docs = list(parallel_find(
+        col_obj, {'i': {'$gte': 150}}, projection={'_id': 0, 'i': 1},
+        partition_key=partition_key, num_partitions=3))
+    assert sorted(doc['i'] for doc in docs) == list(range(150, 211))
+
+
+@pytest.mark.parametrize('partition_key', ['k', 'no_such_field'])
+def test_parallel_aggregate_mixed_keys(col_obj, partition_key):
+    from shleem.mongodb.partial import parallel_aggregate
+    pipeline = [
+        {'$match': {'i': {'$gte': 100}}},
+        {'$group': {'_id': None, 'n': {'$sum': 1}, 'top': {'$max': '$i'}}},
+    ]
+    assert parallel_aggregate(
+        col_obj, pipeline, partition_key=partition_key,
+        num_partitions=4) == [{'_id': None, 'n': 111, 'top': 210}]
@@ -0,0 +1,124 @@
+"""Testing partial aggregation of the shleem package."""
+
+import pytest
+
+from shleem.exceptions import UnsupportedQueryException
+from shleem.mongodb.partial import (
+    split_pipeline,
+    partial_group,
+    combine_partials,
+    apply_stages,
+)
+
+
+def test_split_pipeline():
+    prefix, group, suffix = split_pipeline([
+        {'$match': {'a': 1}},
+        {'$unwind': '$b'},
+        {'$group': {'_id': '$c', 'n': {'$sum': 1}}},
+        {'$sort': {'n': -1}},
+        {'$limit': 3},
+    ])
+    assert prefix == [{'$match': {'a': 1}}, {'$unwind': '$b'}]
+    assert group == {'_id': '$c', 'n': {'$sum': 1}}
+    assert suffix == [{'$sort': {'n': -1}}, {'$limit': 3}]
+    _, group, suffix = split_pipeline([{'$count': 'total'}])
+    assert group == {'_id': None, 'total': {'$sum': 1}}
+    assert suffix == [{'$project': {'_id': 0}}]
+
+
+@pytest.mark.parametrize('pipeline', [
+    [{'$match': {'a': 1}}],
+    [{'$sort': {'a': 1}}, {'$group': {'_id': '$c'}}],
+    [{'$group': {'_id': '$c'}}, {'$project': {'c': 1}}],
+    [{'$group': {'_id': '$c'}}, {'$match': {'_id': {'$where': 'x'}}}],
+    [{'$match': {'$text': {'$search': 'x'}}}, {'$group': {'_id': '$c'}}],
+])
+def test_split_unsupported(pipeline):
+    with pytest.raises(UnsupportedQueryException):
+        split_pipeline(pipeline)
+
+
+def test_partial_group():
+    partial, combiners = partial_group({
+        '_id': '$c', 'n': {'$count': {}}, 'avg': {'$avg': '$x'},
+        'top': {'$max': '$x'}})
+    assert partial['_id'] == '$c'
+    assert partial['__partial_n'] == {'$sum': 1}
+    assert partial['__partial_avg_sum'] == {'$sum': '$x'}
+    assert partial['__partial_top'] == {'$max': '$x'}
+    assert combiners == [('n', '$count'), ('avg', '$avg'), ('top', '$max')]
+    with pytest.raises(UnsupportedQueryException):
+        partial_group({'_id': '$c', 'all': {'$push': '$x'}})
+
+
+def test_combine_partials():
+    combiners = [('n', '$sum'), ('avg', '$avg'), ('low', '$min'),
+                 ('high', '$max')]
+    partial_docs = [
+        {'_id': {'k': 1}, '__partial_n': 2, '__partial_avg_sum': 3,
+         '__partial_avg_count': 2, '__partial_low': 1, '__partial_high': 2},
+        {'_id': 'other', '__partial_n': 1, '__partial_avg_sum': 0,
+         '__partial_avg_count': 0, '__partial_low': None,
+         '__partial_high': None},
+        {'_id': {'k': 1}, '__partial_n': 1, '__partial_avg_sum': 6,
+         '__partial_avg_count': 1, '__partial_low': 'a',
+         '__partial_high': 'a'},
+    ]
+    assert combine_partials(partial_docs, combiners) == [
+        {'_id': {'k': 1}, 'n': 3, 'avg': 3.0, 'low': 1, 'high': 'a'},
+        {'_id': 'other', 'n': 1, 'avg': None, 'low': None, 'high': None},
+    ]
+
+
+def test_combine_partials_equal_numbers():
+    from bson import (
+        Int64,
+        Decimal128,
+    )
+    combiners = [('n', '$sum')]
+    partial_docs = [
+        {'_id': group_id, '__partial_n': 1} for group_id in [
+            1, Int64(1), 1.0, Decimal128('1.00'), True, 0.5,
+            Decimal128('0.50'), {'k': [2, {'j': 3}]},
+            {'k': [2.0, {'j': Int64(3)}]}, {'k': [2, {'j': 3.5}]},
+        ]
+    ]
+    assert combine_partials(partial_docs, combiners) == [
+        {'_id': 1, 'n': 4},
+        {'_id': True, 'n': 1},
+        {'_id': 0.5, 'n': 2},
+        {'_id': {'k': [2, {'j': 3}]}, 'n': 2},
+        {'_id': {'k': [2, {'j': 3.5}]}, 'n': 1},
+    ]
+
+
+def test_apply_stages():
+    docs = [{'_id': i, 'n': i % 3} for i in range(6)]
+    assert apply_stages(docs, [
+        {'$match': {'n': {'$gt': 0}}},
+        {'$sort': {'n': -1, '_id': 1}},
+        {'$skip': 1},
+        {'$limit': 2},
+    ]) == [{'_id': 5, 'n': 2}, {'_id': 1, 'n': 1}]
+
+
+def test_combine_partials_decimals():
+    from bson import Decimal128
+    combiners = [('n', '$sum'), ('avg', '$avg'), ('low', '$min')]
+    partial_docs = [
+        {'_id': 1, '__partial_n': Decimal128('1.1'), '__partial_avg_sum': 2,
+         '__partial_avg_count': 1, '__partial_low': Decimal128('0.5')},
+        {'_id': 1, '__partial_n': 2, '__partial_avg_sum': Decimal128('2.5'),
+         '__partial_avg_count': 2, '__partial_low': 1},
+        {'_id': 1, '__partial_n': 0.5, '__partial_avg_sum': 0,
+         '__partial_avg_count': 0, '__partial_low': Decimal128('NaN')},
+    ]
+    result = combine_partials(partial_docs, combiners)[0]
+    assert result['n'] == Decimal128('3.6')
+    assert result['avg'] == Decimal128('1.5')
+    assert str(result['low'].to_decimal()) == 'NaN'
+    assert apply_stages(
+        [{'n': Decimal128('2.5')}, {'n': 3}, {'n': 1.5}, {'n': 'a'}],
+        [{'$sort': {'n': 1}}]) == [
+            {'n': 1.5}, {'n': Decimal128('2.5')}, {'n': 3}, {'n': 'a'}]
@@ -0,0 +1,81 @@
+"""Testing background prefetching of the shleem package."""
+
+import time
+import threading
+
+import pytest
+
+from shleem import (
+    DataTap,
+    PrefetchingIterator,
+)
+
+
+class SlowCursor(object):
+
+    def __init__(self, num_items, fail_at=None):
+        self.num_items = num_items
+        self.fail_at = fail_at
+        self.num_fetched = 0
+        self.closed = threading.Event()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.num_fetched == self.fail_at:
+            raise ValueError("cursor failed")
+        if self.num_fetched >= self.num_items:
+            raise StopIteration
+        self.num_fetched += 1
+        return {'i': self.num_fetched - 1}
+
+    def close(self):
+        self.closed.set()
+
+
+class SlowTap(DataTap):
+    def __init__(self, cursor):
+        super().__init__(identifier="ShleemDB.slow", source_type="ShleemDB")
+        self.cursor = cursor
+
+    def tap(self, **kwargs):
+        return self.cursor
+
+
+def _wait_for(condition):
+    deadline = time.time() + 5
+    while not condition() and time.time() < deadline:
+        time.sleep(0.01)
+
+
+def test_prefetching_iterator():
+    cursor = SlowCursor(105)
+    docs = list(SlowTap(cursor).tap_prefetched(depth=3, batch_size=10))
+    assert docs == [{'i': i} for i in range(105)]
+    assert cursor.closed.wait(5)
+
+
+def test_prefetching_backpressure():
+    cursor = SlowCursor(1000)
+    prefetching = PrefetchingIterator(cursor, depth=2, batch_size=10)
+    assert next(prefetching) == {'i': 0}
+    # the consumed batch, two queued batches and one batch blocked on them
+    _wait_for(lambda: cursor.num_fetched >= 40)
+    time.sleep(0.2)
+    assert cursor.num_fetched == 40
+    with prefetching:
+        assert next(prefetching) == {'i': 1}
+    assert cursor.closed.is_set()
+    with pytest.raises(StopIteration):
+        next(prefetching)
+
+
+def test_prefetching_errors():
+    cursor = SlowCursor(100, fail_at=25)
+    prefetching = PrefetchingIterator(cursor, batch_size=10)
+    assert [next(prefetching) for _ in range(20)] == [
+        {'i': i} for i in range(20)]
+    with pytest.raises(ValueError):
+        next(prefetching)
+    assert cursor.closed.wait(5)
@@ -0,0 +1,72 @@
+"""Testing the recording and replaying of taps of the shleem package."""
+
+import os
+
+import pytest
+
+from shleem import (
+    DataTap,
+    replay_mode,
+)
+from shleem.replay import (
+    replayable,
+    recording_path,
+    REPLAY_MODE_ENV_VAR,
+    REPLAY_DIR_ENV_VAR,
+)
+from shleem.exceptions import MissingRecordingException
+
+
+class CountingTap(DataTap):
+    def __init__(self):
+        super().__init__(
+            identifier="ShleemDB.replayed", source_type="ShleemDB")
+        self.num_taps = 0
+
+    @replayable
+    def tap(self, **kwargs):
+        self.num_taps += 1
+        return iter([{'i': i} for i in range(kwargs['n'])])
+
+
+def test_replay_mode(tmpdir):
+    counting = CountingTap()
+    replay_dir = str(tmpdir)
+    # no replay mode is set by default
+    assert len(list(counting.tap(n=3))) == 3
+    assert not os.listdir(replay_dir)
+    with replay_mode('auto', replay_dir=replay_dir):
+        assert list(counting.tap(n=3)) == [{'i': 0}, {'i': 1}, {'i': 2}]
+        assert counting.num_taps == 2
+        assert os.path.isfile(recording_path(counting, n=3))
+        assert list(counting.tap(n=3)) == [{'i': 0}, {'i': 1}, {'i': 2}]
+        assert counting.num_taps == 2
+        # partially consumed taps are not recorded
+        tap = counting.tap(n=5)
+        next(tap)
+        tap.close()
+        assert not os.path.isfile(recording_path(counting, n=5))
+        with replay_mode('replay', replay_dir=replay_dir):
+            assert len(list(counting.tap(n=3))) == 3
+            with pytest.raises(MissingRecordingException):
+                counting.tap(n=5)
+        with replay_mode('record', replay_dir=replay_dir):
+            assert len(list(counting.tap(n=3))) == 3
+        assert counting.num_taps == 4
+    with pytest.raises(ValueError):
+        with replay_mode('rewind'):
+            pass  # pragma: no cover
+
+
+def test_replay_env_vars(tmpdir, monkeypatch):
+    counting = CountingTap()
+    monkeypatch.setenv(REPLAY_MODE_ENV_VAR, 'auto')
+    monkeypatch.setenv(REPLAY_DIR_ENV_VAR, str(tmpdir))
+    assert len(list(counting.tap(n=2))) == 2
+    assert len(list(counting.tap(n=2))) == 2
+    assert counting.num_taps == 1
+    assert recording_path(counting, n=2).startswith(str(tmpdir))
+    # the context manager takes precedence
+    with replay_mode('off'):
+        list(counting.tap(n=2))
+    assert counting.num_taps == 2
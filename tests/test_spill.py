@@ -0,0 +1,64 @@
+"""Testing the spilling document buffer of the shleem package."""
+
+import os
+import random
+
+from shleem import (
+    DataTap,
+    SpillBuffer,
+)
+
+
+class RandomTap(DataTap):
+    def __init__(self):
+        super().__init__(identifier="ShleemDB.random", source_type="ShleemDB")
+
+    def tap(self, **kwargs):
+        rng = random.Random(kwargs['seed'])
+        for i in range(kwargs['n']):
+            yield {'i': i, 'x': rng.randint(0, 100), 'nested': {'y': -i}}
+
+
+def _files(dpath):
+    return [fname for _, _, fnames in os.walk(dpath) for fname in fnames]
+
+
+def test_spill_buffer(tmpdir):
+    rand_tap = RandomTap()
+    expected = list(rand_tap.tap(n=500, seed=0))
+    buffer = rand_tap.tap_buffered(
+        memory_budget=2000, spill_dir=str(tmpdir), n=500, seed=0)
+    assert len(buffer) == 500
+    assert buffer.num_spilled_chunks > 5
+    assert 'spilled chunks' in repr(buffer)
+    # the buffer can be iterated over more than once
+    assert list(buffer) == expected
+    assert list(buffer) == expected
+
+    by_x = sorted(expected, key=lambda doc: doc['x'])
+    assert list(buffer.sorted(key=lambda doc: doc['x'])) == by_x
+    assert list(buffer.sorted(key='x')) == by_x
+    assert list(buffer.sorted(key='nested.y', reverse=True)) == expected
+    # sorted runs are removed once merged
+    assert len(_files(str(tmpdir))) == buffer.num_spilled_chunks
+
+    shuffled = list(buffer.shuffled(seed=1))
+    assert shuffled != expected
+    assert sorted(shuffled, key=lambda doc: doc['i']) == expected
+    assert list(buffer.shuffled(seed=1)) == shuffled
+    assert len(_files(str(tmpdir))) == buffer.num_spilled_chunks
+
+    buffer.close()
+    assert len(buffer) == 0
+    assert not _files(str(tmpdir))
+
+
+def test_spill_buffer_in_memory(tmpdir):
+    with SpillBuffer(spill_dir=str(tmpdir)) as buffer:
+        buffer.extend({'i': i} for i in range(10))
+        assert buffer.num_spilled_chunks == 0
+        assert [doc['i'] for doc in buffer.sorted(key='i', reverse=True)] == (
+            list(range(9, -1, -1)))
+        assert sorted(doc['i'] for doc in buffer.shuffled()) == list(
+            range(10))
+    assert not os.listdir(str(tmpdir))
@@ -0,0 +1,111 @@
+"""Testing the versioned Parquet dataset store of the shleem package."""
+
+import pytest
+
+from shleem import DataTap
+
+pa = pytest.importorskip('pyarrow')
+store_module = pytest.importorskip('shleem.store')
+
+
+class RangeTap(DataTap):
+    def __init__(self):
+        super().__init__(identifier="ShleemDB.range/docs")
+
+    def tap(self, **kwargs):
+        return ({'i': i, 'parity': i % 2, 'name': 'n{}'.format(i)}
+                for i in range(kwargs['n']))
+
+
+def test_dataset_store(tmpdir):
+    store = store_module.DatasetStore(
+        store_dir=str(tmpdir), max_rows_per_file=40)
+    assert repr(store) == "DatasetStore: {}".format(str(tmpdir))
+    range_tap = RangeTap()
+    assert store.versions(range_tap) == []
+    assert store.find_version(range_tap, n=100) is None
+    with pytest.raises(KeyError):
+        store.load(range_tap)
+
+    entry = store.write(range_tap, n=100)
+    assert entry['version'] == 1
+    assert entry['num_rows'] == 100
+    assert entry['tap_key'] == {'n': 100}
+    assert entry['tap_hash'] == range_tap.tap_hash(n=100)
+    table = store.load(range_tap)
+    assert table.num_rows == 100
+    assert sorted(table.column('i').to_pylist()) == list(range(100))
+
+    entry2 = store.write(range_tap, partition_cols=['parity'], n=10)
+    assert entry2['version'] == 2
+    assert store.find_version(range_tap, n=100)['version'] == 1
+    assert store.find_version(range_tap, n=10)['version'] == 2
+    table = store.load(range_tap.identifier, columns=['i', 'parity'])
+    assert table.num_rows == 10
+    assert set(table.column('parity').to_pylist()) == {0, 1}
+    # pinned versions stay loadable
+    assert store.load(range_tap, version=1).num_rows == 100
+
+    empty = store.write(range_tap, n=0)
+    assert empty['num_rows'] == 0
+    assert store.load(range_tap).num_rows == 0
+
+    store.remove(range_tap, version=1)
+    assert [ver['version'] for ver in store.versions(range_tap)] == [2, 3]
+    with pytest.raises(KeyError):
+        store.load(range_tap, version=1)
+    # removed version numbers are never reissued
+    store.remove(range_tap, version=3)
+    assert store.write(range_tap, n=5)['version'] == 4
+    assert store.load(range_tap, version=2).num_rows == 10
+    with pytest.raises(KeyError):
+        store.load(range_tap, version=3)
+    store.remove(range_tap)
+    assert store.versions(range_tap) == []
+    assert store.write(range_tap, n=5)['version'] == 5
+
+
+class GrowingTap(RangeTap):
+    def __init__(self, size):
+        super().__init__()
+        self.size = size
+
+    def tap(self, **kwargs):
+        return self.between('i').tap()
+
+    def watermark(self, field, **kwargs):
+        return self.size - 1 if self.size else None
+
+    def between(self, field, lower=None, upper=None):
+        parent = self
+
+        class Delta(RangeTap):
+            def tap(self, **kwargs):
+                for i in range(parent.size):
+                    if lower is not None and i <= lower:
+                        continue
+                    if upper is not None and i > upper:
+                        continue
+                    yield {'i': i, 'parity': i % 2}
+        return Delta()
+
+
+def test_incremental_store(tmpdir):
+    store = store_module.DatasetStore(store_dir=str(tmpdir))
+    with pytest.raises(TypeError):
+        store.write_incremental(RangeTap(), watermark_field='i', n=3)
+    growing = GrowingTap(size=50)
+    entry = store.write_incremental(growing, watermark_field='i')
+    assert entry['version'] == 1
+    assert entry['num_rows'] == 50
+    assert entry['base_version'] is None
+    # nothing new
+    assert store.write_incremental(growing, watermark_field='i') == entry
+    growing.size = 60
+    entry = store.write_incremental(growing, watermark_field='i')
+    assert entry['version'] == 2
+    assert entry['base_version'] == 1
+    assert entry['num_rows'] == 60
+    table = store.load(growing)
+    assert sorted(table.column('i').to_pylist()) == list(range(60))
+    assert store.load(growing, version=1).num_rows == 50
@@ -0,0 +1,53 @@
+"""Testing compiled MongoDB query templates of the shleem package."""
+
+from shleem.mongodb.template import QueryTemplate
+
+
+def getter(field_name):
+    return lambda **kwargs: kwargs[field_name]
+
+
+PARAM_AGG = [
+    {"$match": {"address.zipcode": {"$in": [str(i) for i in range(100)]}}},
+    {"$unwind": "$grades"},
+    {"$group": {
+        "_id": {"name": "$name", "address": "$address"},
+        "sum_score": {"$sum": "$grades.score"}
+    }},
+    {"$project": {
+        "_id": 1,
+        "avg_score": {"$divide": ["$sum_score", getter("normalizer")]}
+    }},
+    {"$match": {"avg_score": {"$gt": getter("avg_score_threshold")}}},
+]
+
+
+def test_query_template():
+    template = QueryTemplate(PARAM_AGG)
+    assert not template.is_static
+    assert template.paths == [
+        (3, '$project', 'avg_score', '$divide', 1),
+        (4, '$match', 'avg_score', '$gt'),
+    ]
+    kwargs = {'normalizer': 4, 'avg_score_threshold': 13.5}
+    resolved = template.resolve(**kwargs)
+    assert resolved == PARAM_AGG[:3] + [
+        {"$project": {
+            "_id": 1, "avg_score": {"$divide": ["$sum_score", 4]}}},
+        {"$match": {"avg_score": {"$gt": 13.5}}},
+    ]
+    # untouched branches are shared, touched ones are rebuilt
+    assert resolved[0] is PARAM_AGG[0]
+    assert resolved[3] is not PARAM_AGG[3]
+    assert callable(PARAM_AGG[4]['$match']['avg_score']['$gt'])
+    assert "2 parameter(s)" in repr(template)
+
+    static = QueryTemplate({"borough": "Queens"})
+    assert static.is_static
+    assert static.resolve() == {"borough": "Queens"}
+    # static templates return their query itself
+    assert static.resolve() is static.query
+
+    # callables returning structures with callables are resolved as well
+    nested = QueryTemplate({"a": lambda **kwargs: {"$gte": getter("x")}})
+    assert nested.resolve(x=3) == {"a": {"$gte": 3}}
@@ -1,6 +1,8 @@
 """Automate and version datasets generation from data sources."""
 # pylint: disable=C0413,C0411
 
+import importlib
+
 from ._version import get_versions
 __version__ = get_versions()['version']
 del get_versions
@@ -12,9 +14,36 @@ from .core import ( # noqa
     DataTap,
 )
 
-import shleem.mongodb  # noqa: E402, F401
+# heavier members are only imported when first accessed
+_LAZY_MEMBERS = {
+    'mongodb': ('.mongodb', None),
+    'bsondump': ('.bsondump', None),
+    'TapCache': ('.cache', 'TapCache'),
+    'SingleFlight': ('.flight', 'SingleFlight'),
+    'MetricsCollector': ('.instrument', 'MetricsCollector'),
+    'PrefetchingIterator': ('.prefetch', 'PrefetchingIterator'),
+    'SpillBuffer': ('.spill', 'SpillBuffer'),
+    'replay_mode': ('.replay', 'replay_mode'),
+}
+
+
+def __getattr__(name):
+    try:
+        module_name, member = _LAZY_MEMBERS[name]
+    except KeyError:
+        raise AttributeError(
+            "module {!r} has no attribute {!r}".format(__name__, name))
+    module = importlib.import_module(module_name, __name__)
+    if member is None:
+        return module
+    return getattr(module, member)
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY_MEMBERS))
+
 
-for name in ['shleem', 'core', 'shared']:
+for name in ['core', 'shared']:
     try:
         globals().pop(name)
     except KeyError:
@@ -0,0 +1,56 @@
+"""Asyncio support for valve data taps."""
+
+import asyncio
+import functools
+import itertools
+import contextvars
+
+
+DEFAULT_BATCH_SIZE = 100
+
+
+def _next_batch(iterator, batch_size):
+    return list(itertools.islice(iterator, batch_size))
+
+
+async def aiter_in_executor(iter_factory, batch_size=None, executor=None):
+    """Asynchronously yields the items of a blocking iterator.
+
+    The iterator is created and advanced on an executor, a batch of items at a
+    time, so the event loop is only handed off to a worker thread once per
+    batch rather than once per item, and no thread is held between batches.
+
+    Arguments
+    ---------
+    iter_factory : callable
+        A callable taking no arguments and returning an iterable.
+    batch_size : int, optional
+        The number of items fetched on each executor call. Defaults to 100.
+    executor : concurrent.futures.Executor, optional
+        The executor to use. Defaults to the default executor of the loop.
+
+    Yields
+    ------
+    object
+        The items of the iterator returned by iter_factory.
+    """
+    if batch_size is None:
+        batch_size = DEFAULT_BATCH_SIZE
+    loop = asyncio.get_event_loop()
+    # executor calls run in the context of the consumer, as in
+    # asyncio.to_thread, so tap instrumentation state carries over
+    iterator = await loop.run_in_executor(executor, functools.partial(
+        contextvars.copy_context().run, lambda: iter(iter_factory())))
+    try:
+        while True:
+            batch = await loop.run_in_executor(executor, functools.partial(
+                contextvars.copy_context().run, _next_batch, iterator,
+                batch_size))
+            if not batch:
+                break
+            for item in batch:
+                yield item
+    finally:
+        close = getattr(iterator, 'close', None)
+        if close is not None:
+            close()
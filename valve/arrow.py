@@ -0,0 +1,67 @@
+"""Conversion of tapped documents into Arrow record batches.
+
+Requires pyarrow.
+"""
+
+import itertools
+
+import pyarrow as pa
+from bson import (
+    ObjectId,
+    Decimal128,
+)
+
+
+DEFAULT_BATCH_SIZE = 10000
+
+
+def to_arrow_schema(schema):
+    """Returns the given schema as a pyarrow schema. Schemas can be given as
+    a pyarrow schema or as a dict mapping field names to pyarrow types."""
+    if schema is None or isinstance(schema, pa.Schema):
+        return schema
+    return pa.schema(list(schema.items()))
+
+
+def arrow_compatible(value):
+    """Returns the given BSON value, or structure of values, with BSON types
+    not supported by pyarrow, like ObjectId, converted to strings."""
+    if isinstance(value, (ObjectId, Decimal128)):
+        return str(value)
+    if isinstance(value, dict):
+        return {key: arrow_compatible(val) for key, val in value.items()}
+    if isinstance(value, list):
+        return [arrow_compatible(val) for val in value]
+    return value
+
+
+def documents_to_record_batches(documents, schema=None, batch_size=None):
+    """Converts a stream of documents into a stream of Arrow record batches.
+
+    Arguments
+    ---------
+    documents : iterable of dict
+        The documents to convert.
+    schema : pyarrow.Schema or dict, optional
+        The schema of the record batches. If not given, it is inferred from
+        the first batch, and used for all following ones.
+    batch_size : int, optional
+        The number of documents per record batch. Defaults to 10000.
+
+    Yields
+    ------
+    pyarrow.RecordBatch
+        Record batches of at most batch_size rows.
+    """
+    if batch_size is None:
+        batch_size = DEFAULT_BATCH_SIZE
+    arrow_schema = to_arrow_schema(schema)
+    iterator = iter(documents)
+    while True:
+        batch = [arrow_compatible(doc)
+                 for doc in itertools.islice(iterator, batch_size)]
+        if not batch:
+            return
+        record_batch = pa.RecordBatch.from_pylist(batch, schema=arrow_schema)
+        arrow_schema = record_batch.schema
+        yield record_batch
@@ -0,0 +1,19 @@
+"""BSON dump shleem data sources, tapping mongodump files offline."""
+
+from .bsondump import (  # noqa: F401
+    dump,
+    BSONDump,
+    BSONDumpQuery,
+)
+
+for name in [
+        'bsondump',
+]:
+    try:
+        globals().pop(name)
+    except KeyError:
+        pass
+try:
+    del name  # pylint: disable=W0631
+except NameError:
+    pass
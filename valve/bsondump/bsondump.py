@@ -0,0 +1,318 @@
+"""Offline data sources tapping BSON dump files, as written by mongodump.
+
+Dump files are memory-mapped, and document boundaries are walked over the
+mapped file without copying it. Queries are matched client-side, with the
+subset of the MongoDB query language supported by valve.mongodb.matcher, and
+projections are applied client-side. Documents skipped by an unfiltered
+query are not decoded at all. Compressed (--gzip) dumps are not supported.
+"""
+
+import os
+import mmap
+import struct
+
+from valve.core import (
+    DataSource,
+    DataTap,
+)
+from valve.mongodb.template import QueryTemplate
+from valve.mongodb.mongodb import (
+    default_identifier,
+    projected_fields,
+)
+
+
+BSONDUMP_SOURCE_TYPE = 'BSONDump'
+
+
+def _path_tree(paths):
+    tree = {}
+    for path in paths:
+        node = tree
+        parts = path.split('.')
+        for part in parts[:-1]:
+            child = node.setdefault(part, {})
+            if child is True:
+                break
+            node = child
+        else:
+            node[parts[-1]] = True
+    return tree
+
+
+def _include(value, tree):
+    if isinstance(value, list):
+        return [_include(item, tree) for item in value
+                if isinstance(item, (dict, list))]
+    result = {}
+    for key, item in value.items():
+        subtree = tree.get(key)
+        if subtree is True:
+            result[key] = item
+        elif subtree is not None and isinstance(item, (dict, list)):
+            result[key] = _include(item, subtree)
+    return result
+
+
+def _exclude(value, tree):
+    if isinstance(value, list):
+        return [_exclude(item, tree) if isinstance(item, (dict, list))
+                else item for item in value]
+    result = {}
+    for key, item in value.items():
+        subtree = tree.get(key)
+        if subtree is True:
+            continue
+        if subtree is not None and isinstance(item, (dict, list)):
+            item = _exclude(item, subtree)
+        result[key] = item
+    return result
+
+
+def compile_projection(projection):
+    """Returns a function applying the given projection to a document, or
+    None if the projection includes all fields.
+
+    Arguments
+    ---------
+    projection : list or dict
+        A list of field names to include, or a dict specifying the fields to
+        include or exclude, as given to pymongo. Dotted paths are supported,
+        and traverse arrays as MongoDB does.
+    """
+    if not projection:
+        return None
+    included = projected_fields(projection)
+    if included is not None:
+        tree = _path_tree(included)
+        return lambda document: _include(document, tree)
+    tree = _path_tree(
+        [field for field, include in projection.items() if not include])
+    return lambda document: _exclude(document, tree)
+
+
+def iter_raw_documents(buffer):
+    """Yields the (offset, size) boundaries of the BSON documents stored
+    back-to-back in the given buffer.
+
+    Raises
+    ------
+    ValueError
+        If the buffer ends with a truncated or corrupt document.
+    """
+    offset = 0
+    end = len(buffer)
+    while offset < end:
+        if end - offset < 5:
+            raise ValueError(
+                "Truncated BSON document at offset {}.".format(offset))
+        size = struct.unpack_from('<i', buffer, offset)[0]
+        if size < 5 or offset + size > end:
+            raise ValueError(
+                "Corrupt BSON document at offset {}.".format(offset))
+        yield offset, size
+        offset += size
+
+
+def _iter_dump(fpath, query, project, skip, limit):
+    from bson import decode
+    from valve.mongodb.matcher import match
+    num_skipped = 0
+    num_yielded = 0
+    with open(fpath, 'rb') as dump_file:
+        if os.fstat(dump_file.fileno()).st_size == 0:
+            return
+        with mmap.mmap(
+                dump_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            view = memoryview(mapped)
+            try:
+                for offset, size in iter_raw_documents(view):
+                    if limit and num_yielded >= limit:
+                        return
+                    if not query and num_skipped < skip:
+                        num_skipped += 1
+                        continue
+                    with view[offset:offset + size] as doc_view:
+                        document = decode(doc_view)
+                    if query and not match(document, query):
+                        continue
+                    if num_skipped < skip:
+                        num_skipped += 1
+                        continue
+                    if project is not None:
+                        document = project(document)
+                    num_yielded += 1
+                    yield document
+            finally:
+                view.release()
+
+
+def iter_dump(fpath, query=None, projection=None, skip=0, limit=0):
+    """Returns an iterator over the documents of the given BSON dump file
+    matching the given query, memory-mapping the file.
+
+    Arguments
+    ---------
+    fpath : str
+        The path of the BSON dump file.
+    query : dict, optional
+        A resolved pymongo-compliant MongoDB query, supported by
+        valve.mongodb.matcher. All documents are matched if not given.
+    projection : list or dict, optional
+        A projection to apply to the matching documents.
+    skip : int, optional
+        The number of matching documents to omit.
+    limit : int, optional
+        The maximal number of documents to yield. Unlimited if 0.
+
+    Raises
+    ------
+    UnsupportedQueryException
+        If the query uses an operator not supported by the matcher.
+    """
+    from valve.mongodb.matcher import query_fields
+    if query:
+        query_fields(query)
+    return _iter_dump(
+        fpath, query, compile_projection(projection), skip, limit)
+
+
+class BSONDump(DataSource):
+    """A BSON dump file data source, as written by mongodump for a single
+    collection.
+
+    Arguments
+    ---------
+    fpath : str
+        The path of the BSON dump file.
+    identifier : str, optional
+        A string identifier unique to this dump. Defaults to the name of the
+        folder of the dump file, usually the name of the dumped database,
+        and the name of the dumped collection, joined by a dot.
+    """
+
+    def __init__(self, fpath, identifier=None):
+        if identifier is None:
+            dirname = os.path.basename(os.path.dirname(os.path.abspath(
+                fpath)))
+            collection_name = os.path.basename(fpath).split('.bson')[0]
+            identifier = dirname + '.' + collection_name
+        super().__init__(
+            identifier=identifier, source_type=BSONDUMP_SOURCE_TYPE)
+        self.fpath = fpath
+
+    def __repr__(self):
+        return "BSON dump DataSource: {}".format(self.identifier)
+
+    def query(self, query_dict, identifier=None, projection=None, skip=None,
+              limit=None):
+        """Returns a BSONDumpQuery source object representing a query ran
+        against this dump.
+
+        Arguments
+        ---------
+        query_dict : dict
+            A pymongo-compliant MongoDB query, supported by
+            valve.mongodb.matcher.
+        identifier : str, optional
+            A string identifier unique to this query. If none is given, a
+            stable hash function is used to compute a good candidate.
+        projection : list or dict, optional
+            A list of field names that should be returned in the result set or
+            a dict specifying the fields to include or exclude.
+        skip : int, optional
+            the number of documents to omit (from the start of the result set)
+            when returning the results.
+        limit : int, optional
+            the maximum number of results to return.
+        """
+        return BSONDumpQuery(
+            self, query=query_dict, identifier=identifier,
+            projection=projection, skip=skip, limit=limit)
+
+
+class BSONDumpQuery(DataTap):
+    """A specific query ran against a BSON dump file.
+
+    Taps the same documents, with the same tap key, as a MongoDBQuery with
+    the same query, projection, skip and limit would on the dumped
+    collection, but without any connection. Documents are tapped in dump
+    order.
+
+    Arguments
+    ---------
+    bson_dump : BSONDump
+        The BSON dump this query will be ran against.
+    query : dict
+        A pymongo-compliant MongoDB query, supported by valve.mongodb.matcher.
+    identifier : str, optional
+        A string identifier unique to this query. If none is given, a stable
+        hash function is used to compute a good candidate.
+    projection : list or dict, optional
+        A list of field names that should be returned in the result set or a
+        dict specifying the fields to include or exclude.
+    skip : int, optional
+        the number of documents to omit (from the start of the result set)
+        when returning the results.
+    limit : int, optional
+        the maximum number of results to return.
+    """
+
+    def __init__(self, bson_dump, query, identifier=None, projection=None,
+                 skip=None, limit=None):
+        if identifier is None:
+            identifier = default_identifier(query)
+        super().__init__(
+            identifier=bson_dump.identifier + '.' + identifier,
+            source_type=BSONDUMP_SOURCE_TYPE)
+        self.bson_dump = bson_dump
+        self.query = query
+        self._template = QueryTemplate(query)
+        self.projection = projection
+        self.skip = skip or 0
+        self.limit = limit or 0
+
+    def __repr__(self):
+        return "BSON dump query DataSource: {}".format(self.identifier)
+
+    def _resolve(self, **kwargs):
+        if self._template.query is not self.query:
+            self._template = QueryTemplate(self.query)
+        return self._template.resolve(**kwargs)
+
+    def projected_fields(self):
+        """Returns the names of the fields included by the projection of this
+        query, or None if no inclusion projection was given."""
+        return projected_fields(self.projection)
+
+    def tap_key(self, **kwargs):
+        """Returns the fully resolved find request this query issues when
+        tapped with the given keyword arguments."""
+        return {
+            'filter': self._resolve(**kwargs),
+            'projection': self.projection,
+            'skip': self.skip,
+            'limit': self.limit,
+        }
+
+    def tap(self, **kwargs):
+        """Taps this query, returning an iterator over the matching documents
+        of the dump.
+
+        Arguments
+        ---------
+        **kwargs : extra keyword arguments
+            Used to resolve callables in the query.
+        """
+        return iter_dump(
+            self.bson_dump.fpath,
+            query=self._resolve(**kwargs),
+            projection=self.projection,
+            skip=self.skip,
+            limit=self.limit,
+        )
+
+
+def dump(fpath, identifier=None):
+    """Returns a BSONDump data source of the given BSON dump file."""
+    return BSONDump(fpath, identifier=identifier)
@@ -0,0 +1,164 @@
+"""An on-disk materialization cache for tapped datasets."""
+
+import os
+import time
+import shutil
+import datetime
+import urllib.parse
+
+from .shared import SHLEEM_DIR_PATH
+from .docfile import (
+    DOCFILE_EXT,
+    write_documents,
+    read_documents,
+)
+
+
+SHLEEM_CACHE_DIR_NAME = 'cache'
+SHLEEM_CACHE_DIR_PATH = os.path.join(SHLEEM_DIR_PATH, SHLEEM_CACHE_DIR_NAME)
+
+
+def safe_dirname(identifier):
+    """Returns the given data tap identifier quoted into a string safe to use
+    as a directory name."""
+    return urllib.parse.quote(identifier, safe='.-_')
+
+
+def _remove(fpath):
+    try:
+        os.remove(fpath)
+    except FileNotFoundError:  # pragma: no cover
+        pass  # already evicted by a concurrent process
+
+
+class TapCache(object):
+    """An on-disk materialization cache for DataTap results.
+
+    Tapped datasets are stored as BSON files, keyed by the identifier of the
+    tapped DataTap and a stable hash of the resolved request (see
+    DataTap.tap_key), so parameterized taps are cached per set of parameters.
+
+    Arguments
+    ---------
+    cache_dir : str, optional
+        The directory in which cached datasets are stored. Defaults to a
+        'cache' folder inside the .valve folder in your home folder.
+    max_size : int, optional
+        The maximal total size, in bytes, of all cached datasets. When it is
+        exceeded, the least recently used datasets are evicted. Unbounded by
+        default.
+    max_age : int, float or datetime.timedelta, optional
+        The maximal age, in seconds, of a cached dataset. Older datasets are
+        considered stale and are evicted. Unbounded by default.
+    """
+
+    def __init__(self, cache_dir=None, max_size=None, max_age=None):
+        if cache_dir is None:
+            cache_dir = SHLEEM_CACHE_DIR_PATH
+        if isinstance(max_age, datetime.timedelta):
+            max_age = max_age.total_seconds()
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.max_age = max_age
+
+    def __repr__(self):
+        return "TapCache: {}".format(self.cache_dir)
+
+    def _entry_path(self, identifier, tap_hash):
+        return os.path.join(
+            self.cache_dir, safe_dirname(identifier), tap_hash + DOCFILE_EXT)
+
+    def _is_fresh(self, fpath):
+        try:
+            mtime = os.path.getmtime(fpath)
+        except FileNotFoundError:
+            return False
+        if self.max_age is None:
+            return True
+        return time.time() - mtime <= self.max_age
+
+    def _entries(self):
+        entries = []
+        for dirpath, _, fnames in os.walk(self.cache_dir):
+            for fname in fnames:
+                if not fname.endswith(DOCFILE_EXT):
+                    continue
+                fpath = os.path.join(dirpath, fname)
+                try:
+                    stat = os.stat(fpath)
+                except FileNotFoundError:  # pragma: no cover
+                    continue
+                entries.append((stat.st_atime, stat.st_mtime, stat.st_size,
+                                fpath))
+        return entries
+
+    def contains(self, data_tap, **kwargs):
+        """Returns True if a fresh materialization of the given tap, with the
+        given keyword arguments, is cached."""
+        fpath = self._entry_path(
+            data_tap.identifier, data_tap.tap_hash(**kwargs))
+        return self._is_fresh(fpath)
+
+    def tap(self, data_tap, **kwargs):
+        """Taps the given DataTap through this cache.
+
+        If a fresh materialization of the dataset produced by tapping the
+        given DataTap with the given keyword arguments is cached, it is read
+        from disk. Otherwise, the DataTap is tapped, its output is fully
+        materialized into the cache and then read from it.
+
+        Arguments
+        ---------
+        data_tap : valve.DataTap
+            The DataTap to tap.
+        **kwargs : extra keyword arguments
+            Keyword arguments are forwarded to the tap method of data_tap.
+
+        Returns
+        -------
+        iterator of dict
+            An iterator over the tapped documents.
+        """
+        fpath = self._entry_path(
+            data_tap.identifier, data_tap.tap_hash(**kwargs))
+        if self._is_fresh(fpath):
+            now = time.time()
+            os.utime(fpath, (now, os.path.getmtime(fpath)))
+            return read_documents(fpath)
+        write_documents(fpath, data_tap.tap(**kwargs))
+        self._evict(keep=fpath)
+        return read_documents(fpath)
+
+    def _evict(self, keep=None):
+        entries = self._entries()
+        now = time.time()
+        kept = []
+        for atime, mtime, size, fpath in entries:
+            if self.max_age is not None and now - mtime > self.max_age:
+                _remove(fpath)
+            else:
+                kept.append((atime, mtime, size, fpath))
+        if self.max_size is None:
+            return
+        total_size = sum(entry[2] for entry in kept)
+        for atime, mtime, size, fpath in sorted(kept):
+            if total_size <= self.max_size:
+                break
+            if fpath == keep:
+                continue
+            _remove(fpath)
+            total_size -= size
+
+    def evict(self):
+        """Evicts stale datasets, and then least recently used datasets until
+        the total size of the cache is no greater than max_size."""
+        self._evict()
+
+    def clear(self, identifier=None):
+        """Removes all cached datasets, or only those of the DataTap with the
+        given identifier."""
+        if identifier is None:
+            dpath = self.cache_dir
+        else:
+            dpath = os.path.join(self.cache_dir, safe_dirname(identifier))
+        shutil.rmtree(dpath, ignore_errors=True)
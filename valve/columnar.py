@@ -0,0 +1,258 @@
+"""Columnar NumPy output of tapped datasets.
+
+Requires numpy, and pandas for DataFrame output.
+"""
+
+import datetime
+
+import numpy as np
+
+
+DEFAULT_BATCH_SIZE = 1000
+DEFAULT_CAPACITY = 1024
+
+_MISSING = object()
+
+_KIND_DTYPES = {
+    'bool': np.dtype(bool),
+    'int': np.dtype(np.int64),
+    'float': np.dtype(np.float64),
+    'datetime': np.dtype('datetime64[us]'),
+    'object': np.dtype(object),
+}
+
+_KIND_FILLERS = {
+    'bool': False,
+    'int': 0,
+    'float': np.nan,
+    'datetime': np.datetime64('NaT'),
+    'object': None,
+}
+
+
+def _kind_of(value):
+    if isinstance(value, bool):
+        return 'bool'
+    if isinstance(value, int):
+        return 'int'
+    if isinstance(value, float):
+        return 'float'
+    if isinstance(value, datetime.datetime):
+        return 'datetime'
+    return 'object'
+
+
+def _promote(kind1, kind2):
+    if kind1 is None or kind1 == kind2:
+        return kind2
+    if kind2 is None:
+        return kind1
+    if {kind1, kind2} == {'int', 'float'}:
+        return 'float'
+    return 'object'
+
+
+def get_path(document, path):
+    """Returns the value at the given dotted path of a document, or a
+    sentinel if it is missing."""
+    value = document
+    for key in path.split('.'):
+        try:
+            value = value[key]
+        except (KeyError, TypeError, IndexError):
+            return _MISSING
+    return value
+
+
+def _flatten(document, prefix=''):
+    for key, value in document.items():
+        path = prefix + key
+        if isinstance(value, dict) and value:
+            yield from _flatten(value, path + '.')
+        else:
+            yield path, value
+
+
+class ColumnBuffer(object):
+    """A growable, typed NumPy buffer of the values of a single column.
+
+    The dtype of the buffer is inferred from the values appended to it, and
+    is promoted as needed: mixed ints and floats are stored as floats, and any
+    other mix of types as Python objects. Missing values are tracked in a
+    separate mask.
+
+    Arguments
+    ---------
+    capacity : int, optional
+        The initial capacity of the buffer. Defaults to 1024.
+    """
+
+    def __init__(self, capacity=None):
+        if capacity is None:
+            capacity = DEFAULT_CAPACITY
+        self.kind = None
+        self.size = 0
+        self.values = np.empty(capacity, dtype=object)
+        self.missing = np.zeros(capacity, dtype=bool)
+
+    def _reserve(self, size):
+        capacity = len(self.values)
+        if size <= capacity:
+            return
+        while capacity < size:
+            capacity *= 2
+        values = np.empty(capacity, dtype=self.values.dtype)
+        values[:self.size] = self.values[:self.size]
+        self.values = values
+        missing = np.zeros(capacity, dtype=bool)
+        missing[:self.size] = self.missing[:self.size]
+        self.missing = missing
+
+    def _convert(self, kind):
+        values = np.empty(len(self.values), dtype=_KIND_DTYPES[kind])
+        if self.kind is None:
+            # all values so far are missing
+            values[:self.size] = _KIND_FILLERS[kind]
+        else:
+            values[:self.size] = self.values[:self.size].astype(values.dtype)
+        self.values = values
+        self.kind = kind
+
+    def extend(self, values):
+        """Appends a batch of values to this buffer. Both None and the
+        module-level missing-value sentinel are treated as missing values."""
+        batch_kind = None
+        missing = np.fromiter(
+            (value is _MISSING or value is None for value in values),
+            dtype=bool, count=len(values))
+        for value, is_missing in zip(values, missing):
+            if not is_missing:
+                batch_kind = _promote(batch_kind, _kind_of(value))
+                if batch_kind == 'object':
+                    break
+        kind = _promote(self.kind, batch_kind)
+        if kind != self.kind:
+            self._convert(kind)
+        filler = _KIND_FILLERS.get(kind)
+        if missing.any():
+            values = [filler if is_missing else value
+                      for value, is_missing in zip(values, missing)]
+        start = self.size
+        self._reserve(start + len(values))
+        try:
+            self.values[start:start + len(values)] = values
+        except (OverflowError, TypeError, ValueError):
+            self._convert('object')
+            self.values[start:start + len(values)] = values
+        self.missing[start:start + len(values)] = missing
+        self.size += len(values)
+
+    def extend_missing(self, count):
+        """Appends the given number of missing values to this buffer."""
+        self.extend([_MISSING] * count)
+
+    def to_array(self):
+        """Returns the values of this buffer as a NumPy array.
+
+        Missing values are represented as NaN in float columns, as NaT in
+        datetime columns and as None in object columns. Int columns with
+        missing values are returned as floats, and bool columns with missing
+        values as objects.
+        """
+        values = self.values[:self.size]
+        missing = self.missing[:self.size]
+        if self.kind is None:
+            return np.full(self.size, None, dtype=object)
+        if not missing.any():
+            return values.copy()
+        if self.kind == 'int':
+            values = values.astype(np.float64)
+            filler = np.nan
+        elif self.kind == 'bool':
+            values = values.astype(object)
+            filler = None
+        else:
+            values = values.copy()
+            filler = _KIND_FILLERS[self.kind]
+        values[missing] = filler
+        return values
+
+
+def documents_to_columns(documents, columns=None, batch_size=None):
+    """Streams documents into typed NumPy columns.
+
+    Documents are consumed in batches; for each batch, the values of each
+    column are gathered and written into a growable column buffer, so no list
+    of documents is ever built.
+
+    Arguments
+    ---------
+    documents : iterable of dict
+        The documents to convert, e.g. a pymongo cursor.
+    columns : list of str, optional
+        The columns to extract, given as field names or dotted paths into
+        nested documents, like 'address.zipcode'. If not given, columns are
+        inferred from the documents themselves, flattening nested documents
+        into dotted paths, and columns first seen mid-stream are back-filled
+        with missing values.
+    batch_size : int, optional
+        The number of documents per batch. Defaults to 1000.
+
+    Returns
+    -------
+    dict
+        A dict mapping column names to NumPy arrays, in column order.
+    """
+    if batch_size is None:
+        batch_size = DEFAULT_BATCH_SIZE
+    infer = columns is None
+    buffers = {}
+    if not infer:
+        for column in columns:
+            buffers[column] = ColumnBuffer()
+    num_rows = 0
+    iterator = iter(documents)
+    while True:
+        if infer:
+            batch = {}
+            count = 0
+            for document in iterator:
+                for path, value in _flatten(document):
+                    if path not in batch:
+                        batch[path] = [_MISSING] * count
+                    batch[path].append(value)
+                count += 1
+                for values in batch.values():
+                    if len(values) < count:
+                        values.append(_MISSING)
+                if count == batch_size:
+                    break
+            for path, values in batch.items():
+                if path not in buffers:
+                    buffers[path] = ColumnBuffer()
+                    buffers[path].extend_missing(num_rows)
+                buffers[path].extend(values)
+            for path, buf in buffers.items():
+                if path not in batch:
+                    buf.extend_missing(count)
+        else:
+            batch = {column: [] for column in columns}
+            count = 0
+            for document in iterator:
+                for column in columns:
+                    batch[column].append(get_path(document, column))
+                count += 1
+                if count == batch_size:
+                    break
+            for column in columns:
+                buffers[column].extend(batch[column])
+        num_rows += count
+        if count < batch_size:
+            break
+    return {path: buf.to_array() for path, buf in buffers.items()}
+
+
+def columns_to_frame(columns):
+    """Returns a pandas DataFrame built from a dict of NumPy columns."""
+    import pandas as pd
+    return pd.DataFrame(columns, columns=list(columns))
@@ -2,8 +2,28 @@
 
 import abc
 
+from .shared import key_hash
+from .instrument import traced
+
 
 DEFAULT_SOURCE_TYPE = 'unspecified'
+# methods named like tap methods which do not tap
+NON_TAP_METHODS = ('tap_key', 'tap_hash')
+
+
+def _is_tap_method(name, value):
+    return callable(value) and (
+        name in ('tap', 'atap') or name.startswith('tap_')) and (
+            name not in NON_TAP_METHODS) and not getattr(
+                value, '__isabstractmethod__', False)
+
+
+def _trace_tap_methods(cls):
+    """Instruments all tap methods defined by the given DataTap class. See
+    valve.instrument."""
+    for name, value in list(vars(cls).items()):
+        if _is_tap_method(name, value):
+            setattr(cls, name, traced(value))
 
 
 class DataSource(object):
@@ -31,6 +51,10 @@ class DataSource(object):
 class DataTap(DataSource, metaclass=abc.ABCMeta):
     """An abstract base class for tappable valve data sources.
 
+    All tap methods, namely tap, atap and all methods named tap_*, except
+    tap_key and tap_hash, of DataTap and of all its subclasses, emit
+    instrumentation events to installed hooks. See valve.instrument.
+
     Arguments
     ---------
     identifier : str
@@ -40,10 +64,196 @@ class DataTap(DataSource, metaclass=abc.ABCMeta):
         default value is used.
     """
 
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        _trace_tap_methods(cls)
+
     @abc.abstractmethod
     def tap(self, **kwargs):
         """Taps this DataTap to produce a raw dataset."""
         pass  # pragma: no cover
 
+    def atap(self, **kwargs):
+        """Taps this DataTap asynchronously, returning an async iterator over
+        the raw dataset.
+
+        The default implementation runs the blocking tap method on the
+        default executor of the running event loop, advancing it a batch of
+        items at a time. Subclasses with a native asyncio driver should
+        override this.
+        """
+        from .aio import aiter_in_executor
+        return aiter_in_executor(lambda: self.tap(**kwargs))
+
+    def projected_fields(self):
+        """Returns the names of the fields of the documents this DataTap
+        produces, or None if they are not known in advance."""
+        return None
+
+    def to_columns(self, columns=None, batch_size=None, **kwargs):
+        """Taps this DataTap into typed NumPy columns.
+
+        Tapped documents are streamed, in batches, straight into growable
+        NumPy column buffers, without building an intermediate list of
+        documents. Requires numpy.
+
+        Arguments
+        ---------
+        columns : list of str, optional
+            The columns to extract, given as field names or dotted paths into
+            nested documents, like 'address.zipcode'. Defaults to the fields
+            returned by projected_fields(), if known, and otherwise to all
+            fields found in tapped documents, with nested documents flattened
+            into dotted paths.
+        batch_size : int, optional
+            The number of documents per batch. Defaults to 1000.
+        **kwargs : extra keyword arguments
+            Keyword arguments are forwarded to the tap method.
+
+        Returns
+        -------
+        dict
+            A dict mapping column names to NumPy arrays, in column order.
+        """
+        from .columnar import documents_to_columns
+        if columns is None:
+            columns = self.projected_fields()
+        return documents_to_columns(
+            self.tap(**kwargs), columns=columns, batch_size=batch_size)
+
+    def to_frame(self, columns=None, batch_size=None, **kwargs):
+        """Taps this DataTap into a pandas DataFrame, built from the typed
+        NumPy columns returned by to_columns(). Requires numpy and pandas."""
+        from .columnar import columns_to_frame
+        return columns_to_frame(self.to_columns(
+            columns=columns, batch_size=batch_size, **kwargs))
+
+    def tap_arrow(self, schema=None, batch_size=None, **kwargs):
+        """Taps this DataTap into a stream of Arrow record batches. Requires
+        pyarrow.
+
+        Arguments
+        ---------
+        schema : pyarrow.Schema or dict, optional
+            The schema of the record batches, given either as a pyarrow schema
+            or as a dict mapping field names to pyarrow types. If not given,
+            it is inferred from the first batch.
+        batch_size : int, optional
+            The number of documents per record batch. Defaults to 10000.
+        **kwargs : extra keyword arguments
+            Keyword arguments are forwarded to the tap method.
+
+        Returns
+        -------
+        iterator of pyarrow.RecordBatch
+            An iterator over record batches of tapped documents.
+        """
+        from .arrow import documents_to_record_batches
+        return documents_to_record_batches(
+            self.tap(**kwargs), schema=schema, batch_size=batch_size)
+
+    def tap_prefetched(self, depth=None, batch_size=None, **kwargs):
+        """Taps this DataTap, fetching documents ahead of the consumer on a
+        background thread.
+
+        The next batches of documents are fetched while the consumer works on
+        the current one, overlapping the latency of fetching them with the
+        work of the consumer. Prefetching is bounded, so memory use stays
+        flat when the consumer falls behind.
+
+        Arguments
+        ---------
+        depth : int, optional
+            The maximal number of batches fetched ahead of the consumer.
+            Defaults to 2.
+        batch_size : int, optional
+            The number of documents per batch. Defaults to 1000.
+        **kwargs : extra keyword arguments
+            Keyword arguments are forwarded to the tap method.
+
+        Returns
+        -------
+        valve.prefetch.PrefetchingIterator
+            An iterator over the tapped documents. Closing it stops
+            prefetching and closes the underlying tap iterator.
+        """
+        from .prefetch import PrefetchingIterator
+        return PrefetchingIterator(
+            self.tap(**kwargs), depth=depth, batch_size=batch_size)
+
+    def tap_buffered(self, memory_budget=None, spill_dir=None, **kwargs):
+        """Taps this DataTap into a memory-bounded buffer, spilling documents
+        to disk once a memory budget is hit.
+
+        The returned buffer can be iterated over any number of times, and
+        sorted or shuffled without holding all documents in memory, so
+        datasets larger than memory can be processed.
+
+        Arguments
+        ---------
+        memory_budget : int, optional
+            The maximal total size, in bytes, of the BSON-encoded documents
+            kept in memory. Defaults to 256 MiB.
+        spill_dir : str, optional
+            The directory in which spilled chunks are stored. Defaults to a
+            'spill' folder inside the .valve folder in your home folder.
+        **kwargs : extra keyword arguments
+            Keyword arguments are forwarded to the tap method.
+
+        Returns
+        -------
+        valve.spill.SpillBuffer
+            A buffer holding the tapped documents. Closing it removes its
+            spilled chunks.
+        """
+        from .spill import SpillBuffer
+        buffer = SpillBuffer(memory_budget=memory_budget, spill_dir=spill_dir)
+        try:
+            buffer.extend(self.tap(**kwargs))
+        except BaseException:
+            buffer.close()
+            raise
+        return buffer
+
+    def tap_shared(self, **kwargs):
+        """Taps this DataTap, sharing a single execution and its buffered
+        results with all identical taps currently in flight in other threads.
+
+        Concurrent taps are identical if they tap DataTaps with the same
+        identifier and the same resolved request (see tap_key). Shared
+        documents are the same objects for all callers, and so should not be
+        mutated.
+
+        Arguments
+        ---------
+        **kwargs : extra keyword arguments
+            Keyword arguments are forwarded to the tap method.
+
+        Returns
+        -------
+        iterator
+            An iterator over the raw dataset.
+        """
+        from .flight import SINGLE_FLIGHT
+        return SINGLE_FLIGHT.tap(self, **kwargs)
+
+    def tap_key(self, **kwargs):
+        """Returns an object describing the raw dataset produced by tapping
+        this DataTap with the given keyword arguments.
+
+        The default implementation returns the keyword arguments themselves.
+        Subclasses resolving parameterized requests should override this to
+        return the fully resolved request instead.
+        """
+        return kwargs
+
+    def tap_hash(self, **kwargs):
+        """Returns a stable hex digest of the key of the raw dataset produced
+        by tapping this DataTap with the given keyword arguments."""
+        return key_hash(self.tap_key(**kwargs))
+
     def __repr__(self):
         return "DataTap: {}".format(self.identifier)
+
+
+_trace_tap_methods(DataTap)
@@ -0,0 +1,87 @@
+"""Reading and writing of document files used to persist tapped datasets."""
+
+import os
+import uuid
+
+from bson import BSON, decode_file_iter
+
+
+DOCFILE_EXT = '.bson'
+
+
+def write_documents(fpath, documents):
+    """Writes the given documents into a BSON file, atomically.
+
+    Documents are first streamed into a temporary file next to the target
+    path, which is then moved into place, so that readers never see a partial
+    file.
+
+    Arguments
+    ---------
+    fpath : str
+        The path of the file to write.
+    documents : iterable of dict
+        The documents to write.
+
+    Returns
+    -------
+    int
+        The number of documents written.
+    """
+    os.makedirs(os.path.dirname(fpath), exist_ok=True)
+    tmp_fpath = '{}.{}.tmp'.format(fpath, uuid.uuid4().hex)
+    count = 0
+    try:
+        with open(tmp_fpath, 'wb') as docfile:
+            for doc in documents:
+                docfile.write(BSON.encode(doc))
+                count += 1
+        os.replace(tmp_fpath, fpath)
+    except BaseException:
+        try:
+            os.remove(tmp_fpath)
+        except FileNotFoundError:  # pragma: no cover
+            pass
+        raise
+    return count
+
+
+def read_documents(fpath):
+    """Yields the documents stored in the given BSON file, one by one."""
+    with open(fpath, 'rb') as docfile:
+        for doc in decode_file_iter(docfile):
+            yield doc
+
+
+def record_documents(fpath, documents):
+    """Yields the given documents, streaming them into a BSON file as they
+    are consumed.
+
+    Documents are written into a temporary file next to the target path,
+    which is moved into place once all documents are consumed. If the
+    documents are not all consumed, the temporary file is removed, so that no
+    partial file is left behind.
+
+    Arguments
+    ---------
+    fpath : str
+        The path of the file to write.
+    documents : iterable of dict
+        The documents to yield and write.
+    """
+    os.makedirs(os.path.dirname(fpath), exist_ok=True)
+    tmp_fpath = '{}.{}.tmp'.format(fpath, uuid.uuid4().hex)
+    completed = False
+    try:
+        with open(tmp_fpath, 'wb') as docfile:
+            for doc in documents:
+                docfile.write(BSON.encode(doc))
+                yield doc
+        os.replace(tmp_fpath, fpath)
+        completed = True
+    finally:
+        if not completed:
+            try:
+                os.remove(tmp_fpath)
+            except FileNotFoundError:  # pragma: no cover
+                pass
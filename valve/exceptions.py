@@ -5,3 +5,15 @@ class ConfigurationException(Exception):  # pragma: no cover
     """An exception thrown when a problem is found in a configuration mapping
     used to configure valve."""
     pass
+
+
+class UnsupportedQueryException(Exception):
+    """An exception thrown when a MongoDB query or pipeline uses operators or
+    stages not supported by valve's client-side query processing."""
+    pass
+
+
+class MissingRecordingException(Exception):
+    """An exception thrown when a tap is replayed, but no recording of its
+    output was made."""
+    pass
@@ -0,0 +1,93 @@
+"""Single-flight deduplication of concurrent identical taps."""
+
+import threading
+
+
+class _Call(object):
+    """An in-flight tap, shared by all its concurrent callers."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.results = None
+        self.error = None
+        self.num_callers = 1
+
+
+class SingleFlight(object):
+    """Deduplicates concurrent identical taps.
+
+    Taps are keyed by the identifier of the tapped DataTap and a stable hash
+    of the resolved request (see DataTap.tap_key). While a tap is in flight,
+    identical taps from other threads do not query the data source again, but
+    wait for the in-flight tap to complete and share its buffered results.
+    Results are not kept once the in-flight tap completes: taps issued after
+    that query the data source anew.
+
+    Shared results are the same document objects for all callers, and so
+    should not be mutated.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def __repr__(self):
+        return "SingleFlight: {} in flight".format(len(self._calls))
+
+    def in_flight(self, data_tap, **kwargs):
+        """Returns True if a tap of the given DataTap, with the given keyword
+        arguments, is currently in flight."""
+        key = (data_tap.identifier, data_tap.tap_hash(**kwargs))
+        with self._lock:
+            return key in self._calls
+
+    def tap(self, data_tap, **kwargs):
+        """Taps the given DataTap, sharing a single execution between all
+        concurrent identical taps.
+
+        Arguments
+        ---------
+        data_tap : valve.DataTap
+            The DataTap to tap.
+        **kwargs : extra keyword arguments
+            Keyword arguments are forwarded to the tap method of data_tap.
+
+        Returns
+        -------
+        iterator of dict
+            An iterator over the tapped documents.
+
+        Raises
+        ------
+        Exception
+            Any error raised while tapping is raised to all concurrent
+            callers of the failed tap.
+        """
+        key = (data_tap.identifier, data_tap.tap_hash(**kwargs))
+        with self._lock:
+            try:
+                call = self._calls[key]
+                call.num_callers += 1
+                leader = False
+            except KeyError:
+                call = _Call()
+                self._calls[key] = call
+                leader = True
+        if leader:
+            try:
+                call.results = list(data_tap.tap(**kwargs))
+            except BaseException as error:
+                call.error = error
+                raise
+            finally:
+                with self._lock:
+                    del self._calls[key]
+                call.done.set()
+        else:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+        return iter(call.results)
+
+
+SINGLE_FLIGHT = SingleFlight()
@@ -0,0 +1,549 @@
+"""Instrumentation hooks for taps, and a built-in latency metrics collector.
+
+Every tap method of every DataTap, i.e. its tap and atap methods and all its
+methods named tap_*, like tap_arrow, tap_parallel or tap_many, is
+instrumented, and emits the following events, in order, to all installed
+hooks:
+
+- pre_resolve: when the tap method is called.
+- post_resolve: when the tap method returns, with the time spent resolving
+  and issuing its request. For tap methods returning fully computed results,
+  like lists, this includes the time spent computing them.
+- first_batch: when the first item is produced, with the time elapsed since
+  the tap started, including server time.
+- chunk: after every chunk of consumed items, of a fixed size, and after the
+  last partial chunk, with the number of items in the chunk and the time
+  spent producing them, including fetching and decoding. Chunks are counted
+  client-side, and do not match the batches returned by the server.
+- exhausted: when the tapped iterator is exhausted, or when a tap method
+  returning a fully computed result returns, with the total number of items
+  produced, if known, and the total time elapsed since the tap started. For
+  taps of data sources reporting their fetches, like MongoDB queries and
+  aggregations, also with the number of bytes returned by the server, the
+  time spent waiting for them, and the time spent decoding them.
+- error: if the tap method or iterating its result raises an error, with
+  the error.
+
+All events are given the name of the tap method. Taps made by a tap method
+while it runs or while its result is consumed on the same thread, like the
+taps made by tap_arrow, are not instrumented separately.
+
+Data sources report fetches by calling record_fetch while an instrumented
+tap runs or its result is advanced, which they can check with is_metering.
+
+A hook is a callable taking the event name, the identifier of the tapped
+DataTap and a dict of event-specific information. Hooks are called on the
+thread consuming the tap, so they should be fast. When no hook is installed,
+taps are not instrumented at all.
+"""
+
+import os
+import json
+import time
+import functools
+import threading
+import contextvars
+
+
+PRE_RESOLVE = 'pre_resolve'
+POST_RESOLVE = 'post_resolve'
+FIRST_BATCH = 'first_batch'
+CHUNK = 'chunk'
+EXHAUSTED = 'exhausted'
+ERROR = 'error'
+EVENTS = (PRE_RESOLVE, POST_RESOLVE, FIRST_BATCH, CHUNK, EXHAUSTED, ERROR)
+
+DEFAULT_CHUNK_SIZE = 1000
+
+_HOOKS = []
+
+# the tracer of the instrumented tap method running or whose result is
+# advanced, so that the taps it makes are not instrumented separately, and
+# their fetches are recorded by it
+_CURRENT_TRACER = contextvars.ContextVar('valve_tracer', default=None)
+
+
+def add_hook(hook):
+    """Installs the given hook, called on every event of every tap."""
+    _HOOKS.append(hook)
+
+
+def remove_hook(hook):
+    """Uninstalls the given hook."""
+    _HOOKS.remove(hook)
+
+
+def emit(event, identifier, **info):
+    """Calls all installed hooks with the given event."""
+    for hook in list(_HOOKS):
+        hook(event, identifier, info)
+
+
+class _Tracer(object):
+    """Tracks the consumption of the items produced by a tap, emitting chunk,
+    exhaustion and error events."""
+
+    def __init__(self, identifier, method, start, chunk_size=None):
+        if chunk_size is None:
+            chunk_size = DEFAULT_CHUNK_SIZE
+        self.identifier = identifier
+        self.method = method
+        self.start = start
+        self.chunk_size = chunk_size
+        self.count = 0
+        self.chunk_count = 0
+        self.chunk_seconds = 0.0
+        self.done = False
+
+        self.num_bytes = None
+        self.fetch_seconds = 0.0
+        self.decode_seconds = 0.0
+
+    def _emit(self, event, **info):
+        emit(event, self.identifier, method=self.method, **info)
+
+    def fetched(self, num_bytes, fetch_seconds, decode_seconds):
+        self.num_bytes = (self.num_bytes or 0) + num_bytes
+        self.fetch_seconds += fetch_seconds
+        self.decode_seconds += decode_seconds
+
+    def emit_exhausted(self, num_items, seconds):
+        metered = self.num_bytes is not None
+        self._emit(
+            EXHAUSTED, num_items=num_items, seconds=seconds,
+            num_bytes=self.num_bytes,
+            fetch_seconds=self.fetch_seconds if metered else None,
+            decode_seconds=self.decode_seconds if metered else None)
+
+    def _end_chunk(self):
+        if self.chunk_count:
+            self._emit(CHUNK, num_items=self.chunk_count,
+                       seconds=self.chunk_seconds)
+        self.chunk_count = 0
+        self.chunk_seconds = 0.0
+
+    def item(self, before):
+        after = time.perf_counter()
+        if not self.count:
+            self._emit(FIRST_BATCH, seconds=after - self.start)
+        self.count += 1
+        self.chunk_count += 1
+        self.chunk_seconds += after - before
+        if self.chunk_count == self.chunk_size:
+            self._end_chunk()
+
+    def exhausted(self, before):
+        if self.done:
+            return
+        self.done = True
+        self.chunk_seconds += time.perf_counter() - before
+        self._end_chunk()
+        self.emit_exhausted(self.count, time.perf_counter() - self.start)
+
+    def error(self, error):
+        if self.done:
+            return
+        self.done = True
+        self._emit(ERROR, error=error,
+                   seconds=time.perf_counter() - self.start)
+
+
+class InstrumentedIterator(object):
+    """Wraps the iterator produced by a tap, emitting chunk, exhaustion and
+    error events as it is consumed. Other attributes, like the methods of a
+    pymongo cursor, are forwarded to the wrapped iterator, which is also
+    entered and exited when this iterator is used as a context manager."""
+
+    def __init__(self, iterator, tracer):
+        self._iterator = iter(iterator)
+        self._wrapped = iterator
+        self._tracer = tracer
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        before = time.perf_counter()
+        token = _CURRENT_TRACER.set(self._tracer)
+        try:
+            item = next(self._iterator)
+        except StopIteration:
+            self._tracer.exhausted(before)
+            raise
+        except Exception as error:
+            self._tracer.error(error)
+            raise
+        finally:
+            _CURRENT_TRACER.reset(token)
+        self._tracer.item(before)
+        return item
+
+    next = __next__
+
+    def __enter__(self):
+        enter = getattr(self._wrapped, '__enter__', None)
+        if enter is not None:
+            enter()
+        return self
+
+    def __exit__(self, *args):
+        exit_method = getattr(self._wrapped, '__exit__', None)
+        if exit_method is not None:
+            return exit_method(*args)
+        close = getattr(self._wrapped, 'close', None)
+        if close is not None:
+            close()
+        return None
+
+    def __getattr__(self, name):
+        try:
+            wrapped = self.__dict__['_wrapped']
+        except KeyError:
+            raise AttributeError(name)
+        return getattr(wrapped, name)
+
+
+class InstrumentedAsyncIterator(object):
+    """Wraps the async iterator produced by an asynchronous tap, emitting
+    chunk, exhaustion and error events as it is consumed. Other attributes,
+    like aclose, are forwarded to the wrapped async iterator."""
+
+    def __init__(self, iterator, tracer):
+        self._iterator = iterator.__aiter__()
+        self._wrapped = iterator
+        self._tracer = tracer
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        before = time.perf_counter()
+        token = _CURRENT_TRACER.set(self._tracer)
+        try:
+            item = await self._iterator.__anext__()
+        except StopAsyncIteration:
+            self._tracer.exhausted(before)
+            raise
+        except Exception as error:
+            self._tracer.error(error)
+            raise
+        finally:
+            _CURRENT_TRACER.reset(token)
+        self._tracer.item(before)
+        return item
+
+    def __getattr__(self, name):
+        try:
+            wrapped = self.__dict__['_wrapped']
+        except KeyError:
+            raise AttributeError(name)
+        return getattr(wrapped, name)
+
+
+def trace_call(identifier, method, call):
+    """Runs a tap method, emitting instrumentation events if any hook is
+    installed and no instrumented tap method is already running.
+
+    Arguments
+    ---------
+    identifier : str
+        The identifier of the tapped DataTap.
+    method : str
+        The name of the tap method.
+    call : callable
+        Runs the tap method, taking no arguments.
+
+    Returns
+    -------
+    object
+        The result of call. Iterators and async iterators are wrapped by an
+        InstrumentedIterator or an InstrumentedAsyncIterator, respectively,
+        if the tap is instrumented.
+    """
+    if not _HOOKS or _CURRENT_TRACER.get() is not None:
+        return call()
+    start = time.perf_counter()
+    tracer = _Tracer(identifier, method, start)
+    emit(PRE_RESOLVE, identifier, method=method)
+    token = _CURRENT_TRACER.set(tracer)
+    try:
+        result = call()
+    except Exception as error:
+        emit(ERROR, identifier, method=method, error=error,
+             seconds=time.perf_counter() - start)
+        raise
+    finally:
+        _CURRENT_TRACER.reset(token)
+    returned = time.perf_counter()
+    emit(POST_RESOLVE, identifier, method=method, seconds=returned - start)
+    if hasattr(result, '__anext__'):
+        return InstrumentedAsyncIterator(result, tracer)
+    if hasattr(result, '__next__'):
+        return InstrumentedIterator(result, tracer)
+    tracer.emit_exhausted(None, returned - start)
+    return result
+
+
+def is_metering():
+    """Returns True if an instrumented tap method runs, or its result is
+    advanced, on the current thread or task, so data sources should report
+    their fetches with record_fetch."""
+    return _CURRENT_TRACER.get() is not None
+
+
+def record_fetch(num_bytes, fetch_seconds, decode_seconds):
+    """Records a fetch of raw data by a data source, adding it to the totals
+    of the instrumented tap method running, or whose result is advanced, on
+    the current thread or task, if any.
+
+    Arguments
+    ---------
+    num_bytes : int
+        The number of bytes returned by the server.
+    fetch_seconds : float
+        The time spent waiting for them, including network time.
+    decode_seconds : float
+        The time spent decoding them.
+    """
+    tracer = _CURRENT_TRACER.get()
+    if tracer is not None:
+        tracer.fetched(num_bytes, fetch_seconds, decode_seconds)
+
+
+def traced(tap_method):
+    """Decorates a tap method of a DataTap, so that it emits instrumentation
+    events. DataTap applies it to all tap methods of its subclasses."""
+    if getattr(tap_method, '_traced', False):
+        return tap_method
+
+    @functools.wraps(tap_method)
+    def _tap(self, *args, **kwargs):
+        if not _HOOKS:
+            return tap_method(self, *args, **kwargs)
+        return trace_call(
+            self.identifier, tap_method.__name__,
+            lambda: tap_method(self, *args, **kwargs))
+    _tap._traced = True
+    return _tap
+
+
+# === metrics collection
+
+DEFAULT_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+    10.0, 30.0, 60.0,
+)
+
+METRIC_PREFIX = 'valve_tap_'
+
+_HISTOGRAMS = (
+    ('resolve_seconds', 'Time spent resolving tap requests.'),
+    ('first_batch_seconds', 'Time from tap start to the first item.'),
+    ('chunk_seconds', 'Time spent fetching and decoding chunks of items.'),
+    ('seconds', 'Time from tap start to exhaustion.'),
+    ('fetch_seconds', 'Time spent waiting for the server, per tap.'),
+    ('decode_seconds', 'Time spent decoding server replies, per tap.'),
+)
+
+_COUNTERS = (
+    ('total', 'Number of taps started.'),
+    ('items_total', 'Number of items produced by taps.'),
+    ('chunks_total', 'Number of chunks of items produced by taps.'),
+    ('bytes_total', 'Number of bytes returned by the server to taps.'),
+    ('errors_total', 'Number of taps failed with an error.'),
+)
+
+
+class Histogram(object):
+    """A cumulative histogram of observed values.
+
+    Arguments
+    ---------
+    buckets : sequence of float
+        The sorted upper bounds of the histogram buckets. An implicit +Inf
+        bucket is always added.
+    """
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        """Adds the given value to this histogram."""
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative_counts(self):
+        """Returns the cumulative count of every bucket, +Inf included."""
+        counts = []
+        total = 0
+        for count in self.counts:
+            total += count
+            counts.append(total)
+        return counts
+
+    def to_dict(self):
+        """Returns a JSON-serializable dict describing this histogram."""
+        bounds = [str(bound) for bound in self.buckets] + ['+Inf']
+        return {
+            'buckets': dict(zip(bounds, self.cumulative_counts())),
+            'sum': self.sum,
+            'count': self.count,
+        }
+
+
+def _escape_label(value):
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace(
+        '"', '\\"')
+
+
+def _write_atomically(fpath, text):
+    dirpath = os.path.dirname(os.path.abspath(fpath))
+    os.makedirs(dirpath, exist_ok=True)
+    tmp_fpath = '{}.{}.tmp'.format(fpath, os.getpid())
+    with open(tmp_fpath, 'w') as tmp_file:
+        tmp_file.write(text)
+    os.replace(tmp_fpath, fpath)
+
+
+class MetricsCollector(object):
+    """Collects per-identifier latency histograms and counters of taps.
+
+    A collector is a tap hook: install it to start collecting metrics of all
+    instrumented taps, and export them as Prometheus text or JSON.
+
+    Arguments
+    ---------
+    buckets : sequence of float, optional
+        The sorted upper bounds, in seconds, of the buckets of all latency
+        histograms. Defaults to buckets ranging from 1ms to one minute.
+    """
+
+    def __init__(self, buckets=None):
+        if buckets is None:
+            buckets = DEFAULT_BUCKETS
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._metrics = {}
+
+    def __repr__(self):
+        return "MetricsCollector: {} identifiers".format(len(self._metrics))
+
+    def install(self):
+        """Starts collecting the metrics of all instrumented taps."""
+        add_hook(self)
+        return self
+
+    def uninstall(self):
+        """Stops collecting metrics."""
+        remove_hook(self)
+
+    def __enter__(self):
+        return self.install()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.uninstall()
+
+    def reset(self):
+        """Discards all collected metrics."""
+        with self._lock:
+            self._metrics = {}
+
+    def _identifier_metrics(self, identifier):
+        try:
+            return self._metrics[identifier]
+        except KeyError:
+            metrics = {name: Histogram(self.buckets)
+                       for name, _ in _HISTOGRAMS}
+            metrics.update({name: 0 for name, _ in _COUNTERS})
+            self._metrics[identifier] = metrics
+            return metrics
+
+    def __call__(self, event, identifier, info):
+        with self._lock:
+            metrics = self._identifier_metrics(identifier)
+            if event == PRE_RESOLVE:
+                metrics['total'] += 1
+            elif event == POST_RESOLVE:
+                metrics['resolve_seconds'].observe(info['seconds'])
+            elif event == FIRST_BATCH:
+                metrics['first_batch_seconds'].observe(info['seconds'])
+            elif event == CHUNK:
+                metrics['chunk_seconds'].observe(info['seconds'])
+                metrics['chunks_total'] += 1
+                metrics['items_total'] += info['num_items']
+            elif event == EXHAUSTED:
+                metrics['seconds'].observe(info['seconds'])
+                if info.get('num_bytes') is not None:
+                    metrics['fetch_seconds'].observe(info['fetch_seconds'])
+                    metrics['decode_seconds'].observe(
+                        info['decode_seconds'])
+                    metrics['bytes_total'] += info['num_bytes']
+            elif event == ERROR:
+                metrics['errors_total'] += 1
+
+    def to_dict(self):
+        """Returns the collected metrics as a JSON-serializable dict mapping
+        identifiers to their histograms and counters."""
+        with self._lock:
+            return {
+                identifier: {
+                    name: value.to_dict() if isinstance(
+                        value, Histogram) else value
+                    for name, value in metrics.items()
+                }
+                for identifier, metrics in sorted(self._metrics.items())
+            }
+
+    def to_json(self, fpath=None):
+        """Returns the collected metrics as a JSON string, and atomically
+        writes it to the given file path, if one is given."""
+        text = json.dumps(self.to_dict(), indent=2, sort_keys=True)
+        if fpath is not None:
+            _write_atomically(fpath, text)
+        return text
+
+    def to_prometheus(self, fpath=None):
+        """Returns the collected metrics in the Prometheus text exposition
+        format, and atomically writes them to the given file path, if one is
+        given, e.g. for the textfile collector of the node exporter."""
+        with self._lock:
+            items = sorted(self._metrics.items())
+            lines = []
+            for name, doc in _HISTOGRAMS:
+                metric = METRIC_PREFIX + name
+                lines.append('# HELP {} {}'.format(metric, doc))
+                lines.append('# TYPE {} histogram'.format(metric))
+                for identifier, metrics in items:
+                    histogram = metrics[name]
+                    label = 'identifier="{}"'.format(
+                        _escape_label(identifier))
+                    bounds = [repr(float(bound)) for bound in self.buckets]
+                    bounds.append('+Inf')
+                    for bound, count in zip(
+                            bounds, histogram.cumulative_counts()):
+                        lines.append('{}_bucket{{{},le="{}"}} {}'.format(
+                            metric, label, bound, count))
+                    lines.append('{}_sum{{{}}} {!r}'.format(
+                        metric, label, histogram.sum))
+                    lines.append('{}_count{{{}}} {}'.format(
+                        metric, label, histogram.count))
+            for name, doc in _COUNTERS:
+                metric = METRIC_PREFIX + name
+                lines.append('# HELP {} {}'.format(metric, doc))
+                lines.append('# TYPE {} counter'.format(metric))
+                for identifier, metrics in items:
+                    lines.append('{}{{identifier="{}"}} {}'.format(
+                        metric, _escape_label(identifier), metrics[name]))
+        text = '\n'.join(lines) + '\n'
+        if fpath is not None:
+            _write_atomically(fpath, text)
+        return text
@@ -0,0 +1,110 @@
+"""Concurrent merging of document iterators."""
+
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+DEFAULT_MAX_BUFFERED = 1000
+
+# put on a queue by a worker when done
+DONE = object()
+
+
+class Failure(object):
+    """Wraps an exception raised by a worker, to be put on its queue and
+    re-raised by the consumer."""
+
+    def __init__(self, exception):
+        self.exception = exception
+
+
+def put_unless_stopped(out_queue, item, stop_event):
+    """Puts an item on the queue, unless stopped first. Returns False if
+    stopped."""
+    while not stop_event.is_set():
+        try:
+            out_queue.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def _drain(iter_factory, out_queue, stop_event):
+    if stop_event.is_set():
+        return
+    try:
+        iterator = iter_factory()
+        try:
+            for item in iterator:
+                if not put_unless_stopped(out_queue, item, stop_event):
+                    return
+        finally:
+            close = getattr(iterator, 'close', None)
+            if close is not None:
+                close()
+    except Exception as exc:  # pylint: disable=W0703
+        put_unless_stopped(out_queue, Failure(exc), stop_event)
+    finally:
+        put_unless_stopped(out_queue, DONE, stop_event)
+
+
+def merge_iterators(iter_factories, max_workers=None, max_buffered=None):
+    """Yields the items of several iterators, consumed concurrently.
+
+    Each iterator is created and consumed on a worker thread, and its items
+    are handed over through a bounded queue, so workers block when the
+    consumer falls behind. Items are yielded in arrival order. If any of the
+    iterators raises an exception, it is re-raised in the consuming thread.
+    Closing the returned generator (or garbage collecting it) stops all
+    workers and closes their iterators, if they have a close method (as
+    pymongo cursors do).
+
+    Arguments
+    ---------
+    iter_factories : iterable of callables
+        Callables taking no arguments, each returning an iterator.
+    max_workers : int, optional
+        The maximal number of iterators consumed at the same time. Defaults to
+        the number of given factories.
+    max_buffered : int, optional
+        The maximal number of items buffered between the workers and the
+        consumer. Defaults to 1000.
+
+    Yields
+    ------
+    object
+        The items of all given iterators.
+    """
+    iter_factories = list(iter_factories)
+    if not iter_factories:
+        return
+    if max_workers is None:
+        max_workers = len(iter_factories)
+    if max_buffered is None:
+        max_buffered = DEFAULT_MAX_BUFFERED
+    out_queue = queue.Queue(maxsize=max_buffered)
+    stop_event = threading.Event()
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        for iter_factory in iter_factories:
+            executor.submit(_drain, iter_factory, out_queue, stop_event)
+        num_running = len(iter_factories)
+        while num_running:
+            item = out_queue.get()
+            if item is DONE:
+                num_running -= 1
+            elif isinstance(item, Failure):
+                raise item.exception
+            else:
+                yield item
+    finally:
+        stop_event.set()
+        # unblock workers waiting on a full queue
+        while True:
+            try:
+                out_queue.get_nowait()
+            except queue.Empty:
+                break
+        executor.shutdown(wait=False)
@@ -1,16 +1,33 @@
 """MongoDB shleem data sources."""
 
-import sys
-
-from .mongodb import (
+from .mongodb import (  # noqa: F401
     server,
-    _add_servers_attr,
+    _get_cred,
 )
 
-_add_servers_attr(sys.modules[__name__])
+
+def __getattr__(name):
+    """Resolves servers named in valve's MongoDB credentials file as module
+    attributes, lazily, so the file is only read once a server is used."""
+    if name.startswith('_'):
+        # dunder and private probes, e.g. by hasattr, pickle or mock.patch,
+        # never name servers
+        raise AttributeError(
+            "module {!r} has no attribute {!r}".format(__name__, name))
+    cred = _get_cred()
+    if cred and name in cred.get('servers', {}):
+        return server(name)
+    raise AttributeError(
+        "module {!r} has no attribute {!r}".format(__name__, name))
+
+
+def __dir__():
+    cred = _get_cred() or {}
+    return sorted(set(globals()) | set(cred.get('servers', {})))
+
 
 for name in [
-        'sys', 'mongodb', '_add_servers_attr',
+        'mongodb',
 ]:
     try:
         globals().pop(name)
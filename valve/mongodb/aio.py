@@ -0,0 +1,63 @@
+"""Native asyncio execution of MongoDB taps."""
+
+try:
+    from pymongo import AsyncMongoClient
+except ImportError:  # pragma: no cover
+    AsyncMongoClient = None  # pymongo < 4.13 has no native asyncio API
+
+
+def has_async_client():
+    """Returns True if the installed pymongo has a native asyncio client."""
+    return AsyncMongoClient is not None
+
+
+async def async_find(mongodb_collection, query, projection=None, skip=0,
+                     limit=0, read_preference=None):
+    """Asynchronously yields the results of a find query.
+
+    Arguments
+    ---------
+    mongodb_collection : valve.mongodb.MongoDBCollection
+        The collection data source to query.
+    query : dict
+        A resolved pymongo-compliant MongoDB query.
+    projection : list or dict, optional
+        A projection to apply to the results.
+    skip : int, optional
+        The number of documents to omit from the start of the result set.
+    limit : int, optional
+        The maximum number of results to return.
+    read_preference : str, dict or pymongo read preference, optional
+        The read preference of the query, overriding the one of its server.
+    """
+    col_obj = mongodb_collection._get_async_connection(read_preference)
+    cursor = col_obj.find(
+        filter=query, projection=projection, skip=skip, limit=limit)
+    try:
+        async for doc in cursor:
+            yield doc
+    finally:
+        await cursor.close()
+
+
+async def async_aggregate(mongodb_collection, pipeline,
+                          read_preference=None):
+    """Asynchronously yields the results of an aggregation pipeline.
+
+    Arguments
+    ---------
+    mongodb_collection : valve.mongodb.MongoDBCollection
+        The collection data source to run the aggregation against.
+    pipeline : list of dict
+        A resolved pymongo-compliant MongoDB aggregation pipeline.
+    read_preference : str, dict or pymongo read preference, optional
+        The read preference of the aggregation, overriding the one of its
+        server.
+    """
+    col_obj = mongodb_collection._get_async_connection(read_preference)
+    cursor = await col_obj.aggregate(pipeline)
+    try:
+        async for doc in cursor:
+            yield doc
+    finally:
+        await cursor.close()
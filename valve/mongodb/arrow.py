@@ -0,0 +1,195 @@
+"""Direct decoding of raw BSON batches from MongoDB into Arrow record batches.
+
+Requires pyarrow. If pymongoarrow is installed, raw BSON batches are decoded
+straight into Arrow arrays by its native builders; otherwise, each batch is
+decoded with the bson package and converted with pyarrow. Either way, BSON
+types not supported by pyarrow, like ObjectId and Decimal128, are returned as
+strings, as by valve.arrow.documents_to_record_batches.
+"""
+
+import pyarrow as pa
+from bson import decode_all
+
+from valve.arrow import (
+    to_arrow_schema,
+    arrow_compatible,
+)
+
+try:
+    from pymongoarrow.context import PyMongoArrowContext
+    from pymongoarrow.schema import Schema
+except ImportError:  # pragma: no cover
+    PyMongoArrowContext = None
+
+
+def has_native_decoder():
+    """Returns True if pymongoarrow is installed, and raw BSON batches are
+    decoded into Arrow arrays natively."""
+    return PyMongoArrowContext is not None
+
+
+def _decode_with_pyarrow(raw_batch, arrow_schema):
+    documents = [arrow_compatible(doc) for doc in decode_all(raw_batch)]
+    return pa.RecordBatch.from_pylist(documents, schema=arrow_schema)
+
+
+def _compatible_type(arrow_type):
+    """Returns the given Arrow type with the extension types of pymongoarrow,
+    like its ObjectId type, replaced by strings, or None if it has none."""
+    if isinstance(arrow_type, pa.ExtensionType):
+        return pa.string()
+    if pa.types.is_struct(arrow_type):
+        fields = [arrow_type.field(i) for i in range(arrow_type.num_fields)]
+        types = [_compatible_type(field.type) for field in fields]
+        if all(field_type is None for field_type in types):
+            return None
+        return pa.struct([
+            field if field_type is None else field.with_type(field_type)
+            for field, field_type in zip(fields, types)])
+    if pa.types.is_list(arrow_type):
+        value_type = _compatible_type(arrow_type.value_type)
+        if value_type is None:
+            return None
+        return pa.list_(value_type)
+    return None
+
+
+def _compatible_batch(record_batch):
+    columns = []
+    fields = []
+    for field, column in zip(record_batch.schema, record_batch.columns):
+        compatible_type = _compatible_type(field.type)
+        if compatible_type is not None:
+            column = pa.array([
+                arrow_compatible(value) for value in column.to_pylist()
+            ], type=compatible_type)
+            field = field.with_type(compatible_type)
+        columns.append(column)
+        fields.append(field)
+    return pa.RecordBatch.from_arrays(columns, schema=pa.schema(fields))
+
+
+def _decode_with_pymongoarrow(raw_batch, arrow_schema, codec_options):
+    schema = None
+    if arrow_schema is not None:
+        schema = Schema.from_arrow(arrow_schema)
+    context = PyMongoArrowContext(schema, codec_options=codec_options)
+    context.process_bson_stream(raw_batch)
+    return context.finish().combine_chunks().to_batches()
+
+
+def decode_raw_batches(raw_batches, schema=None, codec_options=None):
+    """Decodes a stream of raw BSON batches into Arrow record batches.
+
+    Arguments
+    ---------
+    raw_batches : iterable of bytes
+        Batches of concatenated BSON documents, like the ones yielded by
+        pymongo's find_raw_batches and aggregate_raw_batches.
+    schema : pyarrow.Schema or dict, optional
+        The schema of the record batches, given either as a pyarrow schema or
+        as a dict mapping field names to pyarrow types. Fields missing from
+        the schema are dropped. If not given, the schema is inferred from the
+        first non-empty batch, and used for all following ones. ObjectId and
+        Decimal128 fields should be given as strings.
+    codec_options : bson.codec_options.CodecOptions, optional
+        The codec options used to decode BSON values.
+
+    Yields
+    ------
+    pyarrow.RecordBatch
+        A record batch per non-empty raw BSON batch.
+    """
+    arrow_schema = to_arrow_schema(schema)
+    # the schema given to pymongoarrow keeps its extension types
+    decode_schema = arrow_schema
+    native = has_native_decoder()
+    for raw_batch in raw_batches:
+        if not raw_batch:
+            continue
+        record_batches = None
+        if native:
+            try:
+                decoded = _decode_with_pymongoarrow(
+                    raw_batch, decode_schema, codec_options)
+            except TypeError:
+                # pymongoarrow cannot decode BSON types into other Arrow
+                # types, like ObjectIds into the strings of the schema
+                native = False
+            else:
+                if decode_schema is None and decoded:
+                    decode_schema = decoded[0].schema
+                record_batches = [
+                    _compatible_batch(batch) for batch in decoded]
+        if record_batches is None:
+            record_batches = [_decode_with_pyarrow(raw_batch, arrow_schema)]
+        for record_batch in record_batches:
+            if arrow_schema is None:
+                arrow_schema = record_batch.schema
+            yield record_batch
+
+
+def find_arrow_batches(col_obj, query, projection=None, skip=0, limit=0,
+                       schema=None, batch_size=None):
+    """Yields the results of a find query as Arrow record batches, decoded
+    directly from raw BSON batches.
+
+    Arguments
+    ---------
+    col_obj : pymongo.collection.Collection
+        The collection to query.
+    query : dict
+        A resolved pymongo-compliant MongoDB query.
+    projection : list or dict, optional
+        A projection to apply to the results. If not given, and a schema is,
+        only the fields of the schema are projected.
+    skip : int, optional
+        The number of documents to omit from the start of the result set.
+    limit : int, optional
+        The maximum number of results to return.
+    schema : pyarrow.Schema or dict, optional
+        The schema of the record batches. Inferred if not given.
+    batch_size : int, optional
+        The number of documents per raw BSON batch. Defaults to the batch
+        size of the server.
+    """
+    arrow_schema = to_arrow_schema(schema)
+    if projection is None and arrow_schema is not None:
+        projection = {name: True for name in arrow_schema.names}
+    raw_batches = col_obj.find_raw_batches(
+        filter=query, projection=projection, skip=skip, limit=limit,
+        batch_size=batch_size or 0)
+    try:
+        for record_batch in decode_raw_batches(
+                raw_batches, arrow_schema, col_obj.codec_options):
+            yield record_batch
+    finally:
+        raw_batches.close()
+
+
+def aggregate_arrow_batches(col_obj, pipeline, schema=None, batch_size=None):
+    """Yields the results of an aggregation pipeline as Arrow record batches,
+    decoded directly from raw BSON batches.
+
+    Arguments
+    ---------
+    col_obj : pymongo.collection.Collection
+        The collection to run the aggregation against.
+    pipeline : list of dict
+        A resolved pymongo-compliant MongoDB aggregation pipeline.
+    schema : pyarrow.Schema or dict, optional
+        The schema of the record batches. Inferred if not given.
+    batch_size : int, optional
+        The number of documents per raw BSON batch. Defaults to the batch
+        size of the server.
+    """
+    options = {}
+    if batch_size:
+        options['batchSize'] = batch_size
+    raw_batches = col_obj.aggregate_raw_batches(pipeline, **options)
+    try:
+        for record_batch in decode_raw_batches(
+                raw_batches, schema, col_obj.codec_options):
+            yield record_batch
+    finally:
+        raw_batches.close()
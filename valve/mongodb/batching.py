@@ -0,0 +1,157 @@
+"""Coalescing of many resolved MongoDB queries into few server round trips."""
+
+from bson import BSON
+
+from valve.shared import key_hash
+from valve.exceptions import UnsupportedQueryException
+from .matcher import (
+    match,
+    query_fields,
+)
+from .documents import (
+    demux_projection,
+    strip_path,
+)
+
+
+DEFAULT_MAX_BATCH_SIZE = 100
+DEFAULT_MAX_BATCH_BYTES = 4 * 1024 * 1024
+
+
+def _single_equality_field(queries):
+    """Returns the field name if all given queries are single-field
+    equality queries on the same field, and None otherwise."""
+    field = None
+    for query in queries:
+        if len(query) != 1:
+            return None
+        key, value = next(iter(query.items()))
+        if key.startswith('$') or isinstance(value, (dict, list, tuple)):
+            return None
+        if field is None:
+            field = key
+        elif key != field:
+            return None
+    return field
+
+
+def merge_queries(queries):
+    """Merges the given queries into a single query matching the union of
+    their results, using $in for single-field equality queries on the same
+    field, and $or otherwise."""
+    if len(queries) == 1:
+        return queries[0]
+    field = _single_equality_field(queries)
+    if field is not None:
+        return {field: {'$in': [query[field] for query in queries]}}
+    return {'$or': list(queries)}
+
+
+def batch_queries(queries, max_batch_size=None, max_batch_bytes=None):
+    """Splits the given queries into batches bounded both in the number of
+    queries and in their total encoded BSON size.
+
+    Returns
+    -------
+    list of list of int
+        The indices of the queries in each batch.
+    """
+    if max_batch_size is None:
+        max_batch_size = DEFAULT_MAX_BATCH_SIZE
+    if max_batch_bytes is None:
+        max_batch_bytes = DEFAULT_MAX_BATCH_BYTES
+    batches = []
+    current = []
+    current_bytes = 0
+    for i, query in enumerate(queries):
+        size = len(BSON.encode(query))
+        if current and (len(current) == max_batch_size or
+                        current_bytes + size > max_batch_bytes):
+            batches.append(current)
+            current = []
+            current_bytes = 0
+        current.append(i)
+        current_bytes += size
+    if current:
+        batches.append(current)
+    return batches
+
+
+def find_many(col_obj, queries, projection=None, max_batch_size=None,
+              max_batch_bytes=None):
+    """Runs many find queries in few server round trips.
+
+    Identical queries are run once. The remaining queries are merged, in
+    bounded batches, into $in or $or queries, and each returned document is
+    matched client-side against every query of its batch, to route it back to
+    the queries it matches. Queries not supported by the client-side matcher,
+    or that cannot be matched under the given projection, are run one by
+    one.
+
+    Arguments
+    ---------
+    col_obj : pymongo.collection.Collection
+        The collection to query.
+    queries : list of dict
+        Resolved pymongo-compliant MongoDB queries.
+    projection : list or dict, optional
+        A projection to apply to the results of all queries.
+    max_batch_size : int, optional
+        The maximal number of queries merged into a single query. Defaults to
+        100.
+    max_batch_bytes : int, optional
+        The maximal encoded BSON size of the queries merged into a single
+        query. Defaults to 4MB.
+
+    Returns
+    -------
+    list of list of dict
+        The documents matching each of the given queries, in order. A
+        document matching several queries is shared between their lists.
+    """
+    results = [None] * len(queries)
+    unique = {}
+    for i, query in enumerate(queries):
+        unique.setdefault(key_hash(query), []).append(i)
+    groups = list(unique.values())
+    unique_queries = [queries[group[0]] for group in groups]
+
+    mergeable = []
+    fields = set()
+    for j, query in enumerate(unique_queries):
+        try:
+            fields.update(query_fields(query))
+            mergeable.append(j)
+        except UnsupportedQueryException:
+            pass
+    merged_projection, strip = demux_projection(projection, fields)
+    if merged_projection is None and projection:
+        mergeable = []
+    unique_results = [[] for _ in unique_queries]
+    mergeable_set = set(mergeable)
+    for j, query in enumerate(unique_queries):
+        if j not in mergeable_set:
+            unique_results[j] = list(col_obj.find(
+                filter=query, projection=projection))
+    batches = batch_queries(
+        [unique_queries[j] for j in mergeable],
+        max_batch_size=max_batch_size,
+        max_batch_bytes=max_batch_bytes,
+    )
+    for batch in batches:
+        batch = [mergeable[k] for k in batch]
+        if len(batch) == 1:
+            unique_results[batch[0]] = list(col_obj.find(
+                filter=unique_queries[batch[0]], projection=projection))
+            continue
+        merged = merge_queries([unique_queries[j] for j in batch])
+        for doc in col_obj.find(filter=merged, projection=merged_projection):
+            matched = [j for j in batch if match(doc, unique_queries[j])]
+            for path in strip:
+                strip_path(doc, path)
+            for j in matched:
+                unique_results[j].append(doc)
+    for group, group_results in zip(groups, unique_results):
+        for i in group:
+            results[i] = list(group_results)
+    return results
@@ -0,0 +1,82 @@
+"""Process-safe management of pymongo clients.
+
+pymongo clients are not fork-safe: a client created in a parent process must
+not be used by its forked children. Clients are thus never stored on data
+source objects, but are kept by a connection manager which builds them lazily,
+one pooled client per server per process, and drops all clients inherited
+from a parent process the first time it is used in a child.
+"""
+
+import os
+import threading
+
+
+class ConnectionManager(object):
+    """Keeps a single pooled client per server in the current process.
+
+    Clients are built lazily, on first request, and discarded when the manager
+    detects it is used in a process other than the one that built them, like
+    a forked child. Inherited clients are not closed, as their sockets and
+    background threads belong to the parent process.
+    """
+
+    def __init__(self):
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        self._clients = {}
+
+    def _check_pid(self):
+        pid = os.getpid()
+        if pid != self._pid:
+            # the lock may have been held by another thread at fork time
+            self._lock = threading.Lock()
+            self._clients = {}
+            self._pid = pid
+
+    def client(self, key, client_factory):
+        """Returns the client of the given key in the current process.
+
+        Arguments
+        ---------
+        key : str
+            The key identifying the client, e.g. a server name.
+        client_factory : callable
+            A callable taking no arguments and returning a new client. Only
+            called if no client was built for the given key in the current
+            process.
+        """
+        self._check_pid()
+        try:
+            return self._clients[key]
+        except KeyError:
+            pass
+        with self._lock:
+            try:
+                return self._clients[key]
+            except KeyError:
+                client = client_factory()
+                self._clients[key] = client
+                return client
+
+    def close(self, key=None):
+        """Closes and discards the client of the given key, or all clients
+        of the current process if no key is given."""
+        self._check_pid()
+        with self._lock:
+            if key is None:
+                clients = list(self._clients.values())
+                self._clients = {}
+            else:
+                clients = [
+                    client for client in [self._clients.pop(key, None)]
+                    if client is not None
+                ]
+        for client in clients:
+            client.close()
+
+    def __len__(self):
+        self._check_pid()
+        return len(self._clients)
+
+
+CONNECTIONS = ConnectionManager()
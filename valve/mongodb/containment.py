@@ -0,0 +1,463 @@
+"""A semantic, columnar cache of MongoDB query results.
+
+Cached results are kept as NumPy columns. A newly resolved query is answered
+from the cached result of another query of the same MongoDBQuery data source
+if the cached query contains it, meaning every document matching the new query
+also matches the cached one, by filtering the cached columns client-side.
+
+Containment is decided for conjunctions of equality, $in and range ($gt,
+$gte, $lt, $lte) predicates on fields; queries using any other operator are
+never considered contained. Requires numpy.
+"""
+
+import datetime
+import threading
+import collections
+
+import numpy as np
+
+from valve.columnar import documents_to_columns
+from .documents import (
+    bracket,
+    demux_projection,
+)
+
+
+DEFAULT_MAX_ENTRIES = 16
+
+_RANGE_OPERATORS = ('$gt', '$gte', '$lt', '$lte')
+
+
+class _Range(object):
+
+    def __init__(self):
+        self.lower = None
+        self.lower_strict = False
+        self.has_lower = False
+        self.upper = None
+        self.upper_strict = False
+        self.has_upper = False
+
+    def add(self, op, value):
+        if op in ('$gt', '$gte'):
+            if self.has_lower:
+                raise ValueError("Repeated lower bound.")
+            self.lower, self.lower_strict, self.has_lower = (
+                value, op == '$gt', True)
+        else:
+            if self.has_upper:
+                raise ValueError("Repeated upper bound.")
+            self.upper, self.upper_strict, self.has_upper = (
+                value, op == '$lt', True)
+
+
+def _scalar(value):
+    return not isinstance(value, (dict, list, tuple)) and value is not None
+
+
+def predicates(query):
+    """Returns the given query as a list of (field, kind, argument) predicates
+    whose conjunction is equivalent to it, where kind is 'eq', 'in' or
+    'range', or None if the query cannot be expressed this way."""
+    result = []
+    for field, cond in query.items():
+        if field == '$and':
+            for subquery in cond:
+                sub_predicates = predicates(subquery)
+                if sub_predicates is None:
+                    return None
+                result.extend(sub_predicates)
+            continue
+        if field.startswith('$'):
+            return None
+        if not isinstance(cond, dict):
+            if not _scalar(cond):
+                return None
+            result.append((field, 'eq', cond))
+            continue
+        if not cond or not all(op.startswith('$') for op in cond):
+            return None
+        field_range = None
+        for op, arg in cond.items():
+            if op == '$eq':
+                if not _scalar(arg):
+                    return None
+                result.append((field, 'eq', arg))
+            elif op == '$in':
+                if not all(_scalar(value) for value in arg):
+                    return None
+                result.append((field, 'in', list(arg)))
+            elif op in _RANGE_OPERATORS:
+                if not _scalar(arg):
+                    return None
+                if field_range is None:
+                    field_range = _Range()
+                    result.append((field, 'range', field_range))
+                try:
+                    field_range.add(op, arg)
+                except ValueError:  # pragma: no cover
+                    return None
+            else:
+                return None
+    return result
+
+
+def _equal(value1, value2):
+    return bracket(value1) == bracket(value2) and value1 == value2
+
+
+def _less(value1, value2):
+    """Returns True if value1 < value2, False if not, and raises a TypeError
+    if they are not comparable."""
+    if bracket(value1) != bracket(value2):
+        raise TypeError("Values of different types.")
+    return value1 < value2
+
+
+def _in_range(value, field_range):
+    if field_range.has_lower:
+        if _less(value, field_range.lower):
+            return False
+        if field_range.lower_strict and _equal(value, field_range.lower):
+            return False
+    if field_range.has_upper:
+        if _less(field_range.upper, value):
+            return False
+        if field_range.upper_strict and _equal(value, field_range.upper):
+            return False
+    return True
+
+
+def _range_within(inner, outer):
+    if outer.has_lower:
+        if not inner.has_lower or _less(inner.lower, outer.lower):
+            return False
+        if _equal(inner.lower, outer.lower) and (
+                outer.lower_strict and not inner.lower_strict):
+            return False
+    if outer.has_upper:
+        if not inner.has_upper or _less(outer.upper, inner.upper):
+            return False
+        if _equal(inner.upper, outer.upper) and (
+                outer.upper_strict and not inner.upper_strict):
+            return False
+    return True
+
+
+def _implies(predicate, other):
+    """Returns True if the given predicate, on the same field as the other
+    one, implies it."""
+    _, kind, arg = predicate
+    _, other_kind, other_arg = other
+    values = [arg] if kind == 'eq' else arg if kind == 'in' else None
+    if other_kind == 'eq':
+        return values is not None and all(
+            _equal(value, other_arg) for value in values)
+    if other_kind == 'in':
+        return values is not None and all(
+            any(_equal(value, other_value) for other_value in other_arg)
+            for value in values)
+    if values is not None:
+        return all(_in_range(value, other_arg) for value in values)
+    return _range_within(arg, other_arg)
+
+
+def contains(query, other_query):
+    """Returns True if every document matching other_query is known to also
+    match query, and False if it is not known."""
+    outer = predicates(query)
+    inner = predicates(other_query)
+    if outer is None or inner is None:
+        return False
+    for outer_predicate in outer:
+        try:
+            if not any(
+                    _implies(inner_predicate, outer_predicate)
+                    for inner_predicate in inner
+                    if inner_predicate[0] == outer_predicate[0]):
+                return False
+        except TypeError:
+            return False
+    return True
+
+
+_DTYPE_KIND_BRACKETS = {
+    'b': 'bool',
+    'i': 'number',
+    'u': 'number',
+    'f': 'number',
+    'M': 'date',
+}
+
+
+class FilterColumn(object):
+    """A cached column prepared for vectorized filtering.
+
+    Homogeneous object columns of strings are converted into NumPy unicode
+    arrays once, so that all comparisons are vectorized. Columns holding
+    values of several types, arrays or sub-documents cannot be filtered.
+
+    Arguments
+    ---------
+    column : numpy.ndarray
+        A column, as returned by valve.columnar.documents_to_columns.
+    """
+
+    def __init__(self, column):
+        self.values = column
+        self.present = np.ones(len(column), dtype=bool)
+        self.bracket = _DTYPE_KIND_BRACKETS.get(column.dtype.kind)
+        if column.dtype != object:
+            return
+        self.present = np.fromiter(
+            (value is not None for value in column), dtype=bool,
+            count=len(column))
+        brackets = {
+            'array' if isinstance(value, (list, dict)) else bracket(value)
+            for value in column[self.present]}
+        if brackets == {'string'}:
+            self.values = np.where(self.present, column, '').astype(str)
+            self.bracket = 'string'
+        elif len(brackets) == 1 and 'array' not in brackets:
+            self.bracket = brackets.pop()
+        else:
+            self.bracket = None
+
+    def compare(self, op, value):
+        """Returns a boolean mask of the values v of this column for which
+        v <op> value holds. Values of other types never match, as in MongoDB.
+
+        Raises
+        ------
+        TypeError
+            If this column cannot be filtered.
+        """
+        if self.bracket is None:
+            raise TypeError("Column holds values of several types.")
+        if self.bracket != bracket(value):
+            return np.zeros(len(self.values), dtype=bool)
+        if self.values.dtype.kind == 'M':
+            if value.tzinfo is not None:
+                value = value.astimezone(datetime.timezone.utc).replace(
+                    tzinfo=None)
+            value = np.datetime64(value, 'us')
+        if op == 'eq':
+            mask = self.values == value
+        elif op == '$gt':
+            mask = self.values > value
+        elif op == '$gte':
+            mask = self.values >= value
+        elif op == '$lt':
+            mask = self.values < value
+        else:
+            mask = self.values <= value
+        return mask & self.present
+
+
+def filter_mask(filter_columns, query, num_rows):
+    """Returns a boolean mask of the rows of the given columns matching the
+    given query.
+
+    Arguments
+    ---------
+    filter_columns : callable
+        Returns the FilterColumn of the given field, and raises a KeyError if
+        there is none.
+    query : dict
+        A resolved query, for which predicates() does not return None.
+    num_rows : int
+        The number of rows of the columns.
+
+    Raises
+    ------
+    TypeError
+        If the query cannot be evaluated on the given columns, e.g. as a field
+        is missing, or holds arrays or values of several types.
+    """
+    mask = np.ones(num_rows, dtype=bool)
+    for field, kind, arg in predicates(query):
+        try:
+            column = filter_columns(field)
+        except KeyError:
+            raise TypeError("Field {} is not cached.".format(field))
+        if kind == 'eq':
+            mask &= column.compare('eq', arg)
+        elif kind == 'in':
+            in_mask = np.zeros(num_rows, dtype=bool)
+            for value in arg:
+                in_mask |= column.compare('eq', value)
+            mask &= in_mask
+        else:
+            if arg.has_lower:
+                mask &= column.compare(
+                    '$gt' if arg.lower_strict else '$gte', arg.lower)
+            if arg.has_upper:
+                mask &= column.compare(
+                    '$lt' if arg.upper_strict else '$lte', arg.upper)
+    return mask
+
+
+class _Entry(object):
+    """A cached query result."""
+
+    def __init__(self, identifier, projection, query, columns, output):
+        self.identifier = identifier
+        self.projection = projection
+        self.query = query
+        self.columns = columns
+        self.output = output
+        self.num_rows = len(next(iter(columns.values()))) if columns else 0
+        self._filter_columns = {}
+
+    def filter_column(self, field):
+        """Returns the given column prepared for filtering, preparing it on
+        first use."""
+        try:
+            return self._filter_columns[field]
+        except KeyError:
+            column = FilterColumn(self.columns[field])
+            self._filter_columns[field] = column
+            return column
+
+
+class ContainmentCache(object):
+    """An in-memory, columnar cache of MongoDB query results, answering
+    queries contained by cached ones by client-side filtering.
+
+    Results are cached per MongoDBQuery identifier, so only taps of the same
+    parameterized query, with different parameters, are answered from each
+    other. Fields needed to filter cached results client-side are fetched
+    along with the projected fields. Queries with a skip or a limit are never
+    cached.
+
+    Arguments
+    ---------
+    max_entries : int, optional
+        The maximal number of cached results. When exceeded, the least
+        recently used results are evicted. Defaults to 16.
+    """
+
+    def __init__(self, max_entries=None):
+        if max_entries is None:
+            max_entries = DEFAULT_MAX_ENTRIES
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()
+
+    def __repr__(self):
+        return "ContainmentCache: {} entries, {} hits, {} misses".format(
+            len(self._entries), self.hits, self.misses)
+
+    def clear(self):
+        """Removes all cached results."""
+        with self._lock:
+            self._entries.clear()
+
+    def _find_entry(self, mongodb_query, query):
+        projection = repr(mongodb_query.projection)
+        with self._lock:
+            for key, entry in reversed(list(self._entries.items())):
+                if entry.identifier != mongodb_query.identifier or (
+                        entry.projection != projection):
+                    continue
+                if contains(entry.query, query):
+                    self._entries.move_to_end(key)
+                    return entry
+        return None
+
+    def contains(self, mongodb_query, **kwargs):
+        """Returns True if the result of tapping the given query with the
+        given keyword arguments can be answered from a cached result."""
+        if mongodb_query.skip or mongodb_query.limit:
+            return False
+        query = mongodb_query.tap_key(**kwargs)['filter']
+        return self._find_entry(mongodb_query, query) is not None
+
+    def _fetch(self, mongodb_query, query):
+        fields = {field for field, _, _ in predicates(query)}
+        projection, strip = demux_projection(
+            mongodb_query.projection, fields)
+        if strip is None:
+            # filtered fields are excluded by the projection
+            return None
+        # fetched by a tap, so the fetch is recorded and replayed
+        from .mongodb import MongoDBQuery
+        fetch_query = MongoDBQuery(
+            mongodb_query.mongodb_collection, query=query,
+            identifier=mongodb_query._local_identifier(),
+            projection=projection)
+        columns = documents_to_columns(fetch_query.tap())
+        output = [column for column in columns if not any(
+            column == path or column.startswith(path + '.')
+            for path in strip)]
+        return _Entry(
+            identifier=mongodb_query.identifier,
+            projection=repr(mongodb_query.projection), query=query,
+            columns=columns, output=output)
+
+    def to_columns(self, mongodb_query, columns=None, **kwargs):
+        """Taps the given MongoDBQuery into typed NumPy columns, through this
+        cache.
+
+        If the resolved query is contained by the query of a cached result
+        with the same identifier and projection, the cached columns are
+        filtered client-side. Otherwise, the query is run and its result is
+        cached. Fields needed only for client-side filtering are not
+        returned.
+
+        Arguments
+        ---------
+        mongodb_query : valve.mongodb.mongodb.MongoDBQuery
+            The query to tap.
+        columns : list of str, optional
+            The columns to return, given as field names or dotted paths into
+            nested documents. Defaults to all columns of the result.
+        **kwargs : extra keyword arguments
+            Used to resolve callables in the query, as in tap().
+
+        Returns
+        -------
+        dict
+            A dict mapping column names to NumPy arrays.
+        """
+        if mongodb_query.skip or mongodb_query.limit:
+            return mongodb_query.to_columns(columns=columns, **kwargs)
+        query = mongodb_query.tap_key(**kwargs)['filter']
+        if predicates(query) is None:
+            return mongodb_query.to_columns(columns=columns, **kwargs)
+        entry = self._find_entry(mongodb_query, query)
+        mask = None
+        if entry is not None and entry.num_rows == 0:
+            # nothing matches a query contained by one matching nothing
+            mask = np.zeros(0, dtype=bool)
+        elif entry is not None:
+            try:
+                mask = filter_mask(
+                    entry.filter_column, query, entry.num_rows)
+            except TypeError:
+                entry = None
+        if entry is None:
+            self.misses += 1
+            entry = self._fetch(mongodb_query, query)
+            if entry is None:
+                return mongodb_query.to_columns(columns=columns, **kwargs)
+            with self._lock:
+                self._entries[(entry.identifier, entry.projection,
+                               id(entry))] = entry
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        else:
+            self.hits += 1
+        if columns is None:
+            columns = entry.output
+        elif entry.num_rows and not all(
+                column in entry.columns for column in columns):
+            return mongodb_query.to_columns(columns=columns, **kwargs)
+        if not entry.num_rows:
+            return {column: np.empty(0, dtype=object) for column in columns}
+        if mask is None:
+            return {
+                column: entry.columns[column].copy() for column in columns}
+        return {column: entry.columns[column][mask] for column in columns}
@@ -0,0 +1,207 @@
+"""Client-side handling of MongoDB documents.
+
+Helpers shared by the execution modes of MongoDB data taps which read,
+compare or reshape documents client-side, as the server would: walking dotted
+paths, bracketing and ordering BSON values, and projecting documents.
+"""
+
+import math
+import numbers
+import datetime
+
+from bson import (
+    BSON,
+    ObjectId,
+    Decimal128,
+)
+
+
+def path_values(value, parts):
+    """Returns the values found at the given path, traversing arrays as
+    MongoDB does. An empty list means the path is missing.
+
+    Arguments
+    ---------
+    value : object
+        The document, or value, to walk.
+    parts : list of str
+        The keys of a dotted path, in order.
+    """
+    if not parts:
+        return [value]
+    key = parts[0]
+    if isinstance(value, dict):
+        if key in value:
+            return path_values(value[key], parts[1:])
+        return []
+    if isinstance(value, list):
+        results = []
+        if key.isdigit() and int(key) < len(value):
+            results.extend(path_values(value[int(key)], parts[1:]))
+        for item in value:
+            if isinstance(item, dict):
+                results.extend(path_values(item, parts))
+        return results
+    return []
+
+
+def get_field(document, field):
+    """Returns the first value found at the given dotted path of the given
+    document, traversing arrays as MongoDB does, or None if it is missing."""
+    values = path_values(document, field.split('.'))
+    return values[0] if values else None
+
+
+def bracket(value):
+    """Returns the name of the type bracket of the given value. MongoDB only
+    compares values of the same bracket in queries."""
+    if isinstance(value, bool):
+        return 'bool'
+    if isinstance(value, numbers.Number):
+        return 'number'
+    if isinstance(value, str):
+        return 'string'
+    if isinstance(value, datetime.datetime):
+        return 'date'
+    if isinstance(value, ObjectId):
+        return 'objectid'
+    if value is None:
+        return 'null'
+    return type(value).__name__
+
+
+_TYPE_ORDER = {
+    'null': 1, 'number': 2, 'string': 3, 'object': 4, 'array': 5,
+    'binary': 6, 'objectid': 7, 'bool': 8, 'date': 9,
+}
+
+
+def sort_key(value):
+    """Returns a key ordering values of different types as MongoDB does."""
+    if value is None:
+        return (_TYPE_ORDER['null'], 0)
+    if isinstance(value, bool):
+        return (_TYPE_ORDER['bool'], value)
+    if isinstance(value, (int, float)):
+        return (_TYPE_ORDER['number'], value)
+    if isinstance(value, Decimal128):
+        number = value.to_decimal()
+        # NaN sorts before all other numbers, and fails decimal comparisons
+        if number.is_nan():
+            return (_TYPE_ORDER['number'], -math.inf)
+        return (_TYPE_ORDER['number'], number)
+    if isinstance(value, str):
+        return (_TYPE_ORDER['string'], value)
+    if isinstance(value, dict):
+        return (_TYPE_ORDER['object'], BSON.encode(value))
+    if isinstance(value, list):
+        return (_TYPE_ORDER['array'], [sort_key(item) for item in value])
+    if isinstance(value, bytes):
+        return (_TYPE_ORDER['binary'], value)
+    if isinstance(value, ObjectId):
+        return (_TYPE_ORDER['objectid'], value)
+    if isinstance(value, datetime.datetime):
+        return (_TYPE_ORDER['date'], value)
+    return (len(_TYPE_ORDER) + 1, repr(value))
+
+
+def strip_path(document, path):
+    """Removes the given dotted path from the given document, also from
+    documents in arrays along the path."""
+    if isinstance(document, list):
+        for item in document:
+            strip_path(item, path)
+    elif isinstance(document, dict):
+        key, _, rest = path.partition('.')
+        if rest:
+            strip_path(document.get(key), rest)
+        else:
+            document.pop(key, None)
+
+
+def demux_projection(projection, fields):
+    """Returns the projection to use for a merged query so that all fields
+    needed for client-side matching are returned, and the set of dotted
+    paths to strip from results, or None if matching is impossible."""
+    if not projection:
+        return projection, set()
+    if isinstance(projection, dict):
+        included = [
+            field for field, include in projection.items() if include]
+        if not [field for field in included if field != '_id']:
+            # an exclusion projection
+            for field in fields:
+                for excluded in projection:
+                    if field == excluded or field.startswith(
+                            excluded + '.') or excluded.startswith(
+                                field + '.'):
+                        return None, None
+            return projection, set()
+    else:
+        included = list(projection)
+    # _id is returned by inclusion projections unless explicitly excluded
+    if '_id' not in included and (
+            not isinstance(projection, dict) or projection.get('_id', True)):
+        included.append('_id')
+    needed = [field for field in fields if not any(
+        field == inc or field.startswith(inc + '.') for inc in included)]
+    # paths into needed fields are returned with them
+    needed = [field for field in needed if not any(
+        field.startswith(other + '.') for other in needed)]
+    new_projection = {field: True for field in included}
+    if isinstance(projection, dict) and '_id' in projection:
+        new_projection['_id'] = projection['_id']
+    strip = set()
+    for field in needed:
+        if any(inc.startswith(field + '.') for inc in included):
+            # projecting both a field and a path into it is a path collision
+            return None, None
+        new_projection[field] = True
+        # strip the shortest prefix of the field no projected path shares
+        parts = field.split('.')
+        for depth in range(1, len(parts) + 1):
+            prefix = '.'.join(parts[:depth])
+            if not any(inc == prefix or inc.startswith(prefix + '.')
+                       for inc in included):
+                strip.add(prefix)
+                break
+    return new_projection, strip
+
+
+def paging_projection(projection, sort_key):
+    """Returns a projection including the fields needed to build page tokens,
+    and the set of top-level keys to strip from returned documents."""
+    if not projection:
+        return projection, set()
+    if isinstance(projection, dict):
+        included = [
+            field for field, include in projection.items()
+            if include and field != '_id']
+        if not included:
+            # an exclusion projection
+            new_projection = {
+                field: include for field, include in projection.items()
+                if field not in ('_id', sort_key)
+                and not sort_key.startswith(field + '.')}
+            strip = set()
+            if not projection.get('_id', True):
+                strip.add('_id')
+            if sort_key in projection or any(
+                    sort_key.startswith(field + '.') for field in projection):
+                strip.add(sort_key.split('.')[0])
+            return new_projection or None, strip
+        keep_id = bool(projection.get('_id', True))
+    else:
+        included = list(projection)
+        keep_id = True
+    new_projection = {field: True for field in included}
+    strip = set()
+    if not keep_id:
+        strip.add('_id')
+    if not any(sort_key == field or sort_key.startswith(field + '.')
+               for field in included + ['_id']):
+        new_projection[sort_key] = True
+        top = sort_key.split('.')[0]
+        if not any(field.split('.')[0] == top for field in included):
+            strip.add(top)
+    return new_projection, strip
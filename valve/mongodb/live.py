@@ -0,0 +1,284 @@
+"""Live datasets of MongoDB queries, kept fresh with change streams.
+
+A live dataset is materialized once by tapping its query, and then kept up to
+date by applying the events of a change stream opened on the collection of
+the query, instead of tapping the query again. The materialized documents and
+the resume token of the last applied event are persisted together, so syncing
+after a restart continues where the last sync left off.
+
+Insert events are filtered by the query's predicate on the server. Update
+and replace events cannot be, as documents updated out of the predicate must
+be removed from the dataset, so the documents they touch are re-read by _id,
+with the query's predicate and projection, in a single query per batch of
+events. Deleted documents are removed. If the change stream cannot be
+resumed, or is invalidated, the dataset is rebuilt by a full tap.
+"""
+
+import os
+import collections
+
+from bson import BSON
+
+from valve.core import DataTap
+from valve.shared import SHLEEM_DIR_PATH
+from valve.cache import safe_dirname
+from valve.replay import not_replayable
+from valve.exceptions import UnsupportedQueryException
+from valve.docfile import (
+    DOCFILE_EXT,
+    write_documents,
+    read_documents,
+)
+
+
+SHLEEM_LIVE_DIR_NAME = 'live'
+SHLEEM_LIVE_DIR_PATH = os.path.join(SHLEEM_DIR_PATH, SHLEEM_LIVE_DIR_NAME)
+DEFAULT_MAX_AWAIT_TIME_MS = 1000
+REFETCH_BATCH_SIZE = 1000
+
+INVALIDATING_EVENTS = ('drop', 'rename', 'dropDatabase', 'invalidate')
+# ChangeStreamFatalError and ChangeStreamHistoryLost
+UNRESUMABLE_ERROR_CODES = (280, 286)
+
+
+def _doc_key(_id):
+    try:
+        hash(_id)
+        return _id
+    except TypeError:
+        return BSON.encode({'_id': _id})
+
+
+def _prefix_fields(query, prefix):
+    """Returns the given query with all field paths prefixed by the given
+    prefix."""
+    prefixed = {}
+    for key, cond in query.items():
+        if key in ('$and', '$or', '$nor'):
+            prefixed[key] = [_prefix_fields(sub, prefix) for sub in cond]
+        elif key.startswith('$'):
+            raise UnsupportedQueryException(
+                "Unsupported query operator {}.".format(key))
+        else:
+            prefixed[prefix + key] = cond
+    return prefixed
+
+
+def change_stream_pipeline(query):
+    """Returns the change stream pipeline feeding a live dataset of the given
+    resolved query."""
+    insert_filter = {'operationType': 'insert'}
+    try:
+        insert_filter.update(_prefix_fields(query, 'fullDocument.'))
+    except UnsupportedQueryException:
+        pass
+    return [
+        {'$match': {'$or': [
+            insert_filter, {'operationType': {'$ne': 'insert'}}]}},
+        {'$project': {'operationType': 1, 'documentKey': 1}},
+    ]
+
+
+class LiveDataset(DataTap):
+    """A materialized dataset of a MongoDB query, kept fresh by applying the
+    events of a change stream.
+
+    Requires a MongoDB replica set or sharded cluster, as change streams do.
+
+    Arguments
+    ---------
+    mongodb_query : MongoDBQuery
+        The query whose dataset is maintained. Queries with skip or limit are
+        not supported.
+    live_dir : str, optional
+        The directory in which live datasets are persisted. Defaults to a
+        'live' folder inside the .valve folder in your home folder.
+    read_preference : str, dict or pymongo read preference, optional
+        The read preference of the taps of the query and of the change
+        stream, as in MongoDBQuery.tap().
+    **kwargs : extra keyword arguments
+        Used to resolve callables in the query, once.
+    """
+
+    def __init__(self, mongodb_query, live_dir=None, read_preference=None,
+                 **kwargs):
+        if mongodb_query.skip or mongodb_query.limit:
+            raise ValueError(
+                "Queries with skip or limit cannot be maintained live.")
+        super().__init__(identifier=mongodb_query.identifier)
+        if live_dir is None:
+            live_dir = SHLEEM_LIVE_DIR_PATH
+        self.mongodb_query = mongodb_query
+        self.read_preference = read_preference
+        self.kwargs = kwargs
+        self.query = mongodb_query._resolve(**kwargs)
+        self.fpath = os.path.join(
+            live_dir, safe_dirname(self.identifier),
+            mongodb_query.tap_hash(**kwargs) + DOCFILE_EXT)
+        self.resume_token = None
+        self._documents = None
+
+    def __repr__(self):
+        return "Live dataset: {}".format(self.identifier)
+
+    def __len__(self):
+        self._load()
+        return len(self._documents)
+
+    def tap_key(self, **kwargs):
+        return self.mongodb_query.tap_key(**self.kwargs)
+
+    def projected_fields(self):
+        return self.mongodb_query.projected_fields()
+
+    def _collection(self):
+        return self.mongodb_query.mongodb_collection._get_connection(
+            self.read_preference)
+
+    def _load(self):
+        if self._documents is not None:
+            return
+        self._documents = collections.OrderedDict()
+        try:
+            documents = read_documents(self.fpath)
+            header = next(documents)
+        except (FileNotFoundError, StopIteration):
+            return
+        self.resume_token = header['resume_token']
+        for doc in documents:
+            self._documents[_doc_key(doc['_id'])] = doc
+
+    def _persist(self):
+        write_documents(self.fpath, self._iter_persisted())
+
+    def _iter_persisted(self):
+        yield {'resume_token': self.resume_token}
+        for doc in self._documents.values():
+            yield doc
+
+    def _watch(self, resume_token=None, max_await_time_ms=None):
+        return self._collection().watch(
+            pipeline=change_stream_pipeline(self.query),
+            resume_after=resume_token,
+            max_await_time_ms=max_await_time_ms,
+        )
+
+    @not_replayable
+    def rebuild(self):
+        """Materializes the dataset again by a full tap of its query, and
+        persists it."""
+        # the stream is opened first, so that no change made during the tap
+        # is missed; changes applied by the tap are harmlessly applied again
+        with self._watch() as stream:
+            # servers older than MongoDB 4.0.7 report no resume token before
+            # the stream is first read; an event read here precedes the tap,
+            # so the tap reflects it
+            stream.try_next()
+            resume_token = stream.resume_token
+        self._documents = collections.OrderedDict(
+            (_doc_key(doc['_id']), doc)
+            for doc in self.mongodb_query.tap(
+                read_preference=self.read_preference, **self.kwargs))
+        self.resume_token = resume_token
+        self._persist()
+
+    def _refetch(self, touched):
+        ids = list(touched.values())
+        for i in range(0, len(ids), REFETCH_BATCH_SIZE):
+            batch = ids[i:i + REFETCH_BATCH_SIZE]
+            found = set()
+            for doc in self._collection().find(
+                    filter={'$and': [self.query, {'_id': {'$in': batch}}]},
+                    projection=self.mongodb_query.projection):
+                key = _doc_key(doc['_id'])
+                found.add(key)
+                self._documents[key] = doc
+            for _id in batch:
+                key = _doc_key(_id)
+                if key not in found:
+                    self._documents.pop(key, None)
+
+    @not_replayable
+    def sync(self, max_events=None, max_await_time_ms=None):
+        """Applies all changes made since the last sync to the dataset, and
+        persists it. The dataset is materialized by a full tap on its first
+        sync, and rebuilt if the change stream cannot be resumed.
+
+        Arguments
+        ---------
+        max_events : int, optional
+            The maximal number of change events to apply. All available
+            events are applied if not given.
+        max_await_time_ms : int, optional
+            The maximal time, in milliseconds, to wait for new events on each
+            read of the change stream. Defaults to 1000.
+
+        Returns
+        -------
+        int
+            The number of change events applied, or -1 if the dataset was
+            rebuilt instead.
+        """
+        from pymongo.errors import OperationFailure
+        if max_await_time_ms is None:
+            max_await_time_ms = DEFAULT_MAX_AWAIT_TIME_MS
+        self._load()
+        if self.resume_token is None:
+            self.rebuild()
+            return -1
+        num_events = 0
+        touched = collections.OrderedDict()
+        try:
+            with self._watch(self.resume_token, max_await_time_ms) as stream:
+                while max_events is None or num_events < max_events:
+                    event = stream.try_next()
+                    if event is None:
+                        break
+                    operation = event['operationType']
+                    if operation in INVALIDATING_EVENTS:
+                        self.rebuild()
+                        return -1
+                    num_events += 1
+                    _id = event['documentKey']['_id']
+                    key = _doc_key(_id)
+                    if operation == 'delete':
+                        touched.pop(key, None)
+                        self._documents.pop(key, None)
+                    else:
+                        touched[key] = _id
+                resume_token = stream.resume_token
+        except OperationFailure as error:
+            if error.code not in UNRESUMABLE_ERROR_CODES:
+                raise
+            self.rebuild()
+            return -1
+        self._refetch(touched)
+        if num_events or resume_token != self.resume_token:
+            self.resume_token = resume_token
+            self._persist()
+        return num_events
+
+    def tap(self, sync=True, **kwargs):
+        """Taps this live dataset, returning an iterator over its documents.
+
+        Arguments
+        ---------
+        sync : bool, optional
+            If True, the default, the dataset is synced before being tapped.
+            Otherwise, the persisted dataset is tapped as it is.
+        """
+        if sync:
+            self.sync()
+        else:
+            self._load()
+        return iter(list(self._documents.values()))
+
+    def clear(self):
+        """Removes the persisted dataset, so that the next sync rebuilds
+        it."""
+        try:
+            os.remove(self.fpath)
+        except FileNotFoundError:
+            pass
+        self.resume_token = None
+        self._documents = None
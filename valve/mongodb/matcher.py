@@ -0,0 +1,228 @@
+"""Client-side matching of documents against MongoDB queries.
+
+Supports a commonly used subset of the MongoDB query language: implicit and
+explicit equality, comparison operators ($gt, $gte, $lt, $lte, $ne), set
+operators ($in, $nin, $all), $exists, $regex, $size, $mod, $elemMatch, $not
+and the $and, $or and $nor logical operators, with dotted paths traversing
+nested documents and arrays as MongoDB does. Other operators raise an
+UnsupportedQueryException.
+"""
+
+import re
+
+from valve.exceptions import UnsupportedQueryException
+from .documents import (
+    path_values,
+    bracket,
+)
+
+
+_PATTERN_TYPE = type(re.compile(''))
+
+_LOGICAL_OPERATORS = ('$and', '$or', '$nor')
+
+_FIELD_OPERATORS = (
+    '$eq', '$ne', '$gt', '$gte', '$lt', '$lte', '$in', '$nin', '$all',
+    '$exists', '$regex', '$options', '$size', '$mod', '$elemMatch', '$not',
+)
+
+
+def _is_operator_expression(cond):
+    return isinstance(cond, dict) and bool(cond) and all(
+        key.startswith('$') for key in cond)
+
+
+def query_fields(query):
+    """Returns the set of field paths referenced by the given query.
+
+    Raises
+    ------
+    UnsupportedQueryException
+        If the query uses an operator not supported by this module.
+    """
+    fields = set()
+    for key, cond in query.items():
+        if key in _LOGICAL_OPERATORS:
+            for subquery in cond:
+                fields.update(query_fields(subquery))
+        elif key == '$comment':
+            continue
+        elif key.startswith('$'):
+            raise UnsupportedQueryException(
+                "Unsupported query operator {}.".format(key))
+        else:
+            fields.add(key)
+            if _is_operator_expression(cond):
+                _check_operators(cond)
+    return fields
+
+
+def _check_operators(cond):
+    for op, arg in cond.items():
+        if op not in _FIELD_OPERATORS:
+            raise UnsupportedQueryException(
+                "Unsupported query operator {}.".format(op))
+        if op == '$not' and isinstance(arg, dict):
+            _check_operators(arg)
+        if op == '$elemMatch':
+            if _is_operator_expression(arg):
+                _check_operators(arg)
+            else:
+                query_fields(arg)
+
+
+def _expand(values):
+    """Adds the elements of array values to the given values."""
+    expanded = []
+    for value in values:
+        expanded.append(value)
+        if isinstance(value, list):
+            expanded.extend(value)
+    return expanded
+
+
+def _equals(value, target):
+    if isinstance(target, _PATTERN_TYPE):
+        return isinstance(value, str) and bool(target.search(value))
+    if bracket(value) != bracket(target):
+        return False
+    return value == target
+
+
+def _compare(value, target, op):
+    if bracket(value) != bracket(target) or value is None:
+        return False
+    try:
+        if op == '$gt':
+            return value > target
+        if op == '$gte':
+            return value >= target
+        if op == '$lt':
+            return value < target
+        return value <= target
+    except TypeError:
+        return False
+
+
+def _eq_any(values, target):
+    if target is None and not values:
+        return True
+    return any(_equals(value, target) for value in _expand(values))
+
+
+def _regex(cond):
+    pattern = cond['$regex']
+    if isinstance(pattern, _PATTERN_TYPE):
+        return pattern
+    flags = 0
+    for option in cond.get('$options', ''):
+        flags |= {'i': re.I, 'm': re.M, 's': re.S, 'x': re.X}.get(option, 0)
+    return re.compile(pattern, flags)
+
+
+def _match_operators(values, cond):
+    for op, arg in cond.items():
+        if op == '$eq':
+            if not _eq_any(values, arg):
+                return False
+        elif op == '$ne':
+            if _eq_any(values, arg):
+                return False
+        elif op in ('$gt', '$gte', '$lt', '$lte'):
+            if not any(_compare(value, arg, op)
+                       for value in _expand(values)):
+                return False
+        elif op == '$in':
+            if not any(_eq_any(values, target) for target in arg):
+                return False
+        elif op == '$nin':
+            if any(_eq_any(values, target) for target in arg):
+                return False
+        elif op == '$all':
+            if not all(_eq_any(values, target) for target in arg):
+                return False
+        elif op == '$exists':
+            if bool(values) != bool(arg):
+                return False
+        elif op == '$regex':
+            pattern = _regex(cond)
+            if not any(isinstance(value, str) and pattern.search(value)
+                       for value in _expand(values)):
+                return False
+        elif op == '$options':
+            continue
+        elif op == '$size':
+            if not any(isinstance(value, list) and len(value) == arg
+                       for value in values):
+                return False
+        elif op == '$mod':
+            divisor, remainder = arg
+            if not any(bracket(value) == 'number' and
+                       value % divisor == remainder
+                       for value in _expand(values)):
+                return False
+        elif op == '$elemMatch':
+            if not any(_elem_match(value, arg) for value in values):
+                return False
+        elif op == '$not':
+            if isinstance(arg, dict):
+                if _match_operators(values, arg):
+                    return False
+            elif _eq_any(values, arg):
+                return False
+        else:
+            raise UnsupportedQueryException(
+                "Unsupported query operator {}.".format(op))
+    return True
+
+
+def _elem_match(value, cond):
+    if not isinstance(value, list):
+        return False
+    for item in value:
+        if _is_operator_expression(cond):
+            if _match_operators([item], cond):
+                return True
+        elif isinstance(item, dict) and match(item, cond):
+            return True
+    return False
+
+
+def match(document, query):
+    """Returns True if the given document matches the given query.
+
+    Arguments
+    ---------
+    document : dict
+        A MongoDB document.
+    query : dict
+        A resolved pymongo-compliant MongoDB query.
+
+    Raises
+    ------
+    UnsupportedQueryException
+        If the query uses an operator not supported by this module.
+    """
+    for key, cond in query.items():
+        if key == '$and':
+            if not all(match(document, subquery) for subquery in cond):
+                return False
+        elif key == '$or':
+            if not any(match(document, subquery) for subquery in cond):
+                return False
+        elif key == '$nor':
+            if any(match(document, subquery) for subquery in cond):
+                return False
+        elif key == '$comment':
+            continue
+        elif key.startswith('$'):
+            raise UnsupportedQueryException(
+                "Unsupported query operator {}.".format(key))
+        else:
+            values = path_values(document, key.split('.'))
+            if _is_operator_expression(cond):
+                if not _match_operators(values, cond):
+                    return False
+            elif not _eq_any(values, cond):
+                return False
+    return True
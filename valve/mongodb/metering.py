@@ -0,0 +1,76 @@
+"""Metering of the bytes returned by MongoDB to instrumented taps, and of the
+time spent fetching and decoding them. See valve.instrument."""
+
+import time
+
+from bson import decode
+from bson.raw_bson import RawBSONDocument
+from pymongo.collection import Collection
+
+from valve.instrument import record_fetch
+
+
+def raw_collection(col_obj):
+    """Returns a view of the given collection returning undecoded documents,
+    or None if it is not a pymongo collection, e.g. a mongomock one."""
+    if not isinstance(col_obj, Collection):
+        return None
+    return col_obj.with_options(
+        codec_options=col_obj.codec_options.with_options(
+            document_class=RawBSONDocument))
+
+
+class MeteredCursor(object):
+    """Wraps a cursor over undecoded documents, decoding them and recording
+    their size, and the time spent fetching and decoding them, with
+    valve.instrument.record_fetch. Other attributes, like the methods of a
+    pymongo cursor, are forwarded to the wrapped cursor.
+
+    Arguments
+    ---------
+    cursor : iterator of bson.raw_bson.RawBSONDocument
+        The cursor to wrap.
+    codec_options : bson.codec_options.CodecOptions
+        The codec options used to decode documents.
+    """
+
+    def __init__(self, cursor, codec_options):
+        self._cursor = cursor
+        self._codec_options = codec_options
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        before = time.perf_counter()
+        raw_document = next(self._cursor)
+        fetched = time.perf_counter()
+        document = decode(raw_document.raw, self._codec_options)
+        record_fetch(
+            len(raw_document.raw), fetched - before,
+            time.perf_counter() - fetched)
+        return document
+
+    next = __next__
+
+    def __enter__(self):
+        self._cursor.__enter__()
+        return self
+
+    def __exit__(self, *args):
+        return self._cursor.__exit__(*args)
+
+    def __getattr__(self, name):
+        try:
+            cursor = self.__dict__['_cursor']
+        except KeyError:
+            raise AttributeError(name)
+        attribute = getattr(cursor, name)
+        if not callable(attribute):
+            return attribute
+
+        def _forwarded(*args, **kwargs):
+            result = attribute(*args, **kwargs)
+            # chained cursor methods, like sort, keep decoding
+            return self if result is cursor else result
+        return _forwarded
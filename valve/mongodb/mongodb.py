@@ -3,18 +3,26 @@
 import os
 import copy
 import json
+import weakref
 import urllib.parse
 from functools import lru_cache
 
-
-from pymongo import MongoClient
-from strct.hash import stable_hash
-
 from valve.core import (
     DataSource,
     DataTap,
 )
 from valve.shared import SHLEEM_DIR_PATH
+from valve.instrument import is_metering
+from valve.replay import (
+    replayable,
+    not_replayable,
+    replay_enabled,
+)
+from .template import QueryTemplate
+from .connection import CONNECTIONS
+
+# pymongo, strct and all optional execution modes are imported lazily, where
+# first used, to keep importing valve cheap for short-lived processes.
 
 
 MONGODB_SOURCE_TYPE = 'MongoDB'
@@ -31,25 +39,52 @@ MONGO_CRED_FILE_MSG = (
     '        "production_data_store": {\n'
     '            "hosts": ["ds192763.mlab.com:51829"],\n'
     '             "username": "valve_reader",\n'
-    '             "password": "8d728673tfi8h723yds"\n'
+    '             "password": "8d728673tfi8h723yds",\n'
+    '             "read_preference": "secondaryPreferred"\n'
     '        }\n'
     '    }\n'
     '}'
 )
 
 
+_CRED_CACHE = {}
+_MISSING_CRED_REPORTED = False
+
+
 def _get_cred():
-    """Returns MongoDB credentials dict."""
+    """Returns MongoDB credentials dict.
+
+    The credentials file is parsed once, and parsed again only if its
+    modification time changes. If it is missing, instructions for creating it
+    are printed once per process.
+    """
+    global _MISSING_CRED_REPORTED  # pylint: disable=W0603
     try:
-        with open(SHLEEM_MONGODB_CRED_FPATH, 'r') as mongo_cred_file:
-            return json.load(mongo_cred_file)
+        mtime = os.path.getmtime(SHLEEM_MONGODB_CRED_FPATH)
     except FileNotFoundError:  # pragma: no cover
-        print(MONGO_CRED_FILE_MSG)
+        if not _MISSING_CRED_REPORTED:
+            _MISSING_CRED_REPORTED = True
+            print(MONGO_CRED_FILE_MSG)
+        return None
+    try:
+        cached_mtime, cred = _CRED_CACHE[SHLEEM_MONGODB_CRED_FPATH]
+        if cached_mtime == mtime:
+            return cred
+    except KeyError:
+        pass
+    with open(SHLEEM_MONGODB_CRED_FPATH, 'r') as mongo_cred_file:
+        cred = json.load(mongo_cred_file)
+    _CRED_CACHE[SHLEEM_MONGODB_CRED_FPATH] = (mtime, cred)
+    return cred
 
 
 class MongoDBSource(DataSource):
     """A MongoDB data source.
 
+    MongoDB data source objects hold no connection. Clients are built lazily,
+    once per server per process, so data sources can be cheaply pickled and
+    safely used across forked processes.
+
     Arguments
     ---------
     identifier : str
@@ -73,6 +108,7 @@ class MongoDBServer(MongoDBSource):
     def __init__(self, server_name):
         MongoDBSource.__init__(self, identifier=server_name)
         self.server_name = server_name
+        self._async_clients = weakref.WeakKeyDictionary()
 
     def __repr__(self):
         return "MongoDB server DataSource: {}".format(self.identifier)
@@ -81,8 +117,13 @@ class MongoDBServer(MongoDBSource):
         return self.db(db_name)
 
     def __getattr__(self, db_name):
+        if db_name.startswith('__'):
+            raise AttributeError(db_name)
         return self.db(db_name)
 
+    def __reduce__(self):
+        return (server, (self.server_name,))
+
     @lru_cache(maxsize=1024)
     def db(self, db_name):
         """Returns a MongoDBDataBase object with the given name, hosted on this
@@ -99,15 +140,14 @@ class MongoDBServer(MongoDBSource):
             for host in hosts
         ]
 
-    @lru_cache(maxsize=2)
-    def _get_connection(self):
-        """Returns a pymongo client connected to this server.
+    def _client_args(self):
+        """Returns the host URIs and extra client keyword arguments of this
+        server, as given in valve's MongoDB credentials file.
 
-        Returns
-        -------
-        pymongo.MongoClient
-            Returns a pymongo.MongoClient object with reading permissions
-            connected to this server.
+        The optional read_preference entry of the server sets the default
+        read preference of its client, given either as the name of a read
+        preference mode or as a dict with mode, tag_sets, max_staleness and
+        latency_window_ms keys. See valve.mongodb.routing for details.
         """
         cred = copy.deepcopy(_get_cred())
         try:
@@ -117,11 +157,91 @@ class MongoDBServer(MongoDBSource):
                 pwd=server_cred.pop('password'),
                 hosts=server_cred.pop('hosts'),
             )
-            return MongoClient(host=uris, **server_cred)
         except KeyError:
             msg = ("The server {} is missing for valve's MongoDB credentials"
                    "file.\n".format(self.server_name) + MONGO_CRED_FILE_MSG)
             raise ValueError(msg)
+        read_preference = server_cred.pop('read_preference', None)
+        if read_preference is not None:
+            from .routing import client_options
+            server_cred.update(client_options(read_preference))
+        return uris, server_cred
+
+    def _new_connection(self):
+        from pymongo import MongoClient
+        uris, server_cred = self._client_args()
+        return MongoClient(host=uris, **server_cred)
+
+    def _get_connection(self):
+        """Returns a pymongo client connected to this server.
+
+        A single pooled client is built per server per process, so a client
+        created before a fork is never used by the forked process.
+
+        Returns
+        -------
+        pymongo.MongoClient
+            Returns a pymongo.MongoClient object with reading permissions
+            connected to this server.
+        """
+        return CONNECTIONS.client(self.server_name, self._new_connection)
+
+    def close(self):
+        """Closes the clients of this server in the current process, if any.
+        New ones are built if the server is used again.
+
+        Asyncio clients are closed on the event loops they are bound to, so
+        if called from a running event loop, asyncio clients are left open;
+        await aclose() from their loop to close them instead.
+        """
+        import asyncio
+        CONNECTIONS.close(self.server_name)
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            in_loop = False
+        else:
+            in_loop = True
+        for loop, client in list(self._async_clients.items()):
+            if loop.is_closed():
+                # the client cannot be closed anymore, only dropped
+                del self._async_clients[loop]
+            elif not in_loop:
+                del self._async_clients[loop]
+                loop.run_until_complete(client.close())
+
+    async def aclose(self):
+        """Closes the asyncio client of this server bound to the running
+        event loop, if any, and the synchronous client of this server in the
+        current process."""
+        import asyncio
+        client = self._async_clients.pop(asyncio.get_running_loop(), None)
+        CONNECTIONS.close(self.server_name)
+        if client is not None:
+            await client.close()
+
+    def _get_async_connection(self):
+        """Returns a pymongo asyncio client connected to this server.
+
+        Must be called from a running event loop, as asyncio clients are bound
+        to the loop they are used on; a single client is kept per loop.
+
+        Returns
+        -------
+        pymongo.AsyncMongoClient
+            Returns a pymongo.AsyncMongoClient object with reading permissions
+            connected to this server.
+        """
+        import asyncio
+        from .aio import AsyncMongoClient
+        loop = asyncio.get_running_loop()
+        try:
+            return self._async_clients[loop]
+        except KeyError:
+            uris, server_cred = self._client_args()
+            client = AsyncMongoClient(host=uris, **server_cred)
+            self._async_clients[loop] = client
+            return client
 
 
 @lru_cache(maxsize=1024)
@@ -130,12 +250,6 @@ def server(server_name):
     return MongoDBServer(server_name)
 
 
-def _add_servers_attr(module):
-    cred = _get_cred()
-    for server_name in cred['servers']:
-        setattr(module, server_name, server(server_name))
-
-
 class MongoDBDatabase(MongoDBSource):
     """A specific MongoDB database data source.
 
@@ -161,19 +275,28 @@ class MongoDBDatabase(MongoDBSource):
         return MongoDBCollection(self, collection_name)
 
     def __getattr__(self, collection_name):
+        if collection_name.startswith('__'):
+            raise AttributeError(collection_name)
         return self[collection_name]
 
+    def __reduce__(self):
+        return (MongoDBDatabase, (self.mongodb_server, self.db_name))
+
     def collection(self, collection_name):
         """Returns a MongoDBCollection data source object with the given name,
         located at this MongoDB database."""
         return self[collection_name]
 
-    @lru_cache(maxsize=2)
     def _get_connection(self):
         """Returns a pymongo.database.Database object connected to this
         database."""
         return self.mongodb_server._get_connection()[self.db_name]
 
+    def _get_async_connection(self):
+        """Returns a pymongo.asynchronous.database.AsyncDatabase object
+        connected to this database."""
+        return self.mongodb_server._get_async_connection()[self.db_name]
+
 
 class MongoDBCollection(MongoDBSource):
     """A specific MongoDB collection data source.
@@ -195,6 +318,9 @@ class MongoDBCollection(MongoDBSource):
     def __repr__(self):
         return "MongoDB collection DataSource: {}".format(self.identifier)
 
+    def __reduce__(self):
+        return (MongoDBCollection, (self.mongodb_db, self.collection_name))
+
     def query(self, query_dict, identifier=None, projection=None, skip=None,
               limit=None):
         """Returns a MongoDBQuery source object representing a query ran
@@ -219,7 +345,8 @@ class MongoDBCollection(MongoDBSource):
         return MongoDBQuery(self, query=query_dict, identifier=identifier,
                             projection=projection, skip=skip, limit=limit)
 
-    def aggregation(self, aggregation_pipeline, identifier=None):
+    def aggregation(self, aggregation_pipeline, identifier=None,
+                    optimize=False):
         """Returns a MongoDBAggregation source object representing an
         aggregation ran against this collection.
 
@@ -230,16 +357,69 @@ class MongoDBCollection(MongoDBSource):
         identifier : str, optional
             A string identifier unique to this aggregation. If none is given, a
             stable hash function is used to compute a good candidate.
+        optimize : bool, optional
+            If True, the pipeline is rewritten into an equivalent, cheaper one
+            before being run. Defaults to False.
         """
         return MongoDBAggregation(
             self, aggregation_pipeline=aggregation_pipeline,
-            identifier=identifier)
+            identifier=identifier, optimize=optimize)
 
-    @lru_cache(maxsize=2)
-    def _get_connection(self):
+    def live(self, query_dict, identifier=None, projection=None,
+             live_dir=None, **kwargs):
+        """Returns a live dataset of the given query, materialized once and
+        kept fresh by applying the events of a change stream on this
+        collection.
+
+        See MongoDBCollection.query() and MongoDBQuery.live() for a
+        description of all arguments.
+
+        Returns
+        -------
+        valve.mongodb.live.LiveDataset
+            A DataTap over the maintained dataset, synced on each tap.
+        """
+        return self.query(
+            query_dict, identifier=identifier, projection=projection).live(
+                live_dir=live_dir, **kwargs)
+
+    def _get_connection(self, read_preference=None):
         """Returns a pymongo.collection.Collection object connected to this
-        database."""
-        return self.mongodb_db._get_connection()[self.collection_name]
+        database, reading with the given read preference, if given, and with
+        the one of its server otherwise."""
+        col_obj = self.mongodb_db._get_connection()[self.collection_name]
+        if read_preference is None:
+            return col_obj
+        from .routing import parse_read_preference
+        return col_obj.with_options(
+            read_preference=parse_read_preference(read_preference))
+
+    def _get_async_connection(self, read_preference=None):
+        """Returns a pymongo.asynchronous.collection.AsyncCollection object
+        connected to this collection, reading with the given read preference,
+        if given, and with the one of its server otherwise."""
+        col_obj = self.mongodb_db._get_async_connection()[
+            self.collection_name]
+        if read_preference is None:
+            return col_obj
+        from .routing import parse_read_preference
+        return col_obj.with_options(
+            read_preference=parse_read_preference(read_preference))
+
+
+def _metered(col_obj, run):
+    """Runs the given function returning a cursor over the given collection,
+    metering the bytes it returns, and the time spent fetching and decoding
+    them, if an instrumented tap runs. See valve.instrument."""
+    if is_metering():
+        from .metering import (
+            MeteredCursor,
+            raw_collection,
+        )
+        raw_col_obj = raw_collection(col_obj)
+        if raw_col_obj is not None:
+            return MeteredCursor(run(raw_col_obj), col_obj.codec_options)
+    return run(col_obj)
 
 
 def _clean_query_helper(obj):
@@ -267,30 +447,33 @@ def _clean_query_from_callables(query):
     return _clean_query_helper(new)
 
 
-def _resolve_helper(obj, **kwargs):
-    if isinstance(obj, dict):
-        for key in obj.keys():
-            if callable(obj[key]):
-                obj[key] = obj[key](**kwargs)
-            if isinstance(obj[key], (dict, list, tuple)):
-                obj[key] = _resolve_helper(obj[key], **kwargs)
-        return obj
-    # else, it's a list or a tuple
-    # if isinstance(obj, (list, tuple)):
-    new_list = []
-    for item in obj:
-        if callable(item):
-            new_list.append(item(**kwargs))
-        elif isinstance(item, (dict, list, tuple)):
-            new_list.append(_resolve_helper(item, **kwargs))
-        else:
-            new_list.append(item)
-    return new_list
-
-
-def _resolve_query(query, **kwargs):
-    resolved_query = copy.deepcopy(query)
-    return _resolve_helper(resolved_query, **kwargs)
+def default_identifier(query):
+    """Returns a stable hash-based identifier for the given query or
+    pipeline, with callables represented by their names."""
+    from strct.hash import stable_hash
+    try:
+        return str(abs(stable_hash(query)))
+    except TypeError:
+        return str(abs(stable_hash(_clean_query_from_callables(query))))
+
+
+def projected_fields(projection):
+    """Returns the names of the fields included by the given projection, or
+    None if it is not an inclusion projection."""
+    if not projection:
+        return None
+    if isinstance(projection, dict):
+        fields = [field for field, include in projection.items()
+                  if include and field != '_id']
+        if not fields:
+            return None  # an exclusion projection
+        if projection.get('_id', True):
+            fields.insert(0, '_id')
+        return fields
+    fields = list(projection)
+    if '_id' not in fields:
+        fields.insert(0, '_id')
+    return fields
 
 
 class MongoDBQuery(MongoDBSource, DataTap):
@@ -321,15 +504,12 @@ class MongoDBQuery(MongoDBSource, DataTap):
     def __init__(self, mongodb_collection, query, identifier=None,
                  projection=None, skip=None, limit=None):
         if identifier is None:
-            try:
-                identifier = str(abs(stable_hash(query)))
-            except TypeError:
-                clean_query = _clean_query_from_callables(query)
-                identifier = str(abs(stable_hash(clean_query)))
+            identifier = default_identifier(query)
         identifier = mongodb_collection.identifier + '.' + identifier
         super().__init__(identifier=identifier)
         self.mongodb_collection = mongodb_collection
         self.query = query
+        self._template = QueryTemplate(query)
         self.projection = projection
         if skip is None:
             skip = 0
@@ -341,14 +521,479 @@ class MongoDBQuery(MongoDBSource, DataTap):
     def __repr__(self):
         return "MongoDB query DataSource: {}".format(self.identifier)
 
-    def tap(self, **kwargs):
-        col_obj = self.mongodb_collection._get_connection()
-        query = _resolve_query(self.query, **kwargs)
-        return col_obj.find(
+    def _local_identifier(self):
+        """Returns the identifier of this query, without the identifier of its
+        collection."""
+        return self.identifier[len(self.mongodb_collection.identifier) + 1:]
+
+    def __reduce__(self):
+        # callables in the query must be picklable, e.g. module-level
+        return (MongoDBQuery, (
+            self.mongodb_collection, self.query, self._local_identifier(),
+            self.projection, self.skip, self.limit))
+
+    def _resolve(self, **kwargs):
+        """Returns the query of this data source, resolved with the given
+        keyword arguments. Branches holding no callables are shared with the
+        query itself, as is the whole query if it holds none, so the result
+        must not be modified in place. See QueryTemplate.resolve."""
+        if self._template.query is not self.query:
+            self._template = QueryTemplate(self.query)
+        return self._template.resolve(**kwargs)
+
+    def projected_fields(self):
+        """Returns the names of the fields included by the projection of this
+        query, or None if no inclusion projection was given."""
+        return projected_fields(self.projection)
+
+    def tap_key(self, **kwargs):
+        """Returns the fully resolved find request this query issues when
+        tapped with the given keyword arguments.
+
+        The returned filter shares its branches holding no callables with the
+        query of this data source, so it must be copied before it is
+        modified."""
+        return {
+            'filter': self._resolve(**kwargs),
+            'projection': self.projection,
+            'skip': self.skip,
+            'limit': self.limit,
+        }
+
+    def _find(self, query, read_preference=None):
+        col_obj = self.mongodb_collection._get_connection(read_preference)
+        return _metered(col_obj, lambda col: col.find(
             filter=query,
             projection=self.projection,
             skip=self.skip,
             limit=self.limit,
+        ))
+
+    @replayable
+    def tap(self, read_preference=None, **kwargs):
+        """Taps this query, returning an iterator over the matching documents.
+
+        The output is recorded or replayed if a replay mode is set, see
+        valve.replay.
+
+        Arguments
+        ---------
+        read_preference : str, dict or pymongo read preference, optional
+            The read preference of this tap, overriding the one of its server,
+            to route it to secondaries, for example. Given either as the name
+            of a read preference mode, e.g. 'secondaryPreferred', or as a dict
+            with mode, tag_sets and max_staleness keys. See
+            valve.mongodb.routing for details.
+        **kwargs : extra keyword arguments
+            Used to resolve callables in the query.
+
+        Returns
+        -------
+        iterator of dict
+            An iterator over the documents matching the query.
+        """
+        return self._find(self._resolve(**kwargs), read_preference)
+
+    def atap(self, read_preference=None, **kwargs):
+        """Taps this query asynchronously, returning an async iterator over
+        the matching documents.
+
+        Uses the native asyncio client of pymongo when available, and falls
+        back to running the blocking tap on an executor otherwise, or if a
+        replay mode is set, so the tap is recorded and replayed.
+
+        Arguments
+        ---------
+        read_preference : str, dict or pymongo read preference, optional
+            The read preference of this tap, as in tap().
+        **kwargs : extra keyword arguments
+            Used to resolve callables in the query, as in tap().
+        """
+        from .aio import (
+            has_async_client,
+            async_find,
+        )
+        if not has_async_client() or replay_enabled():
+            return DataTap.atap(
+                self, read_preference=read_preference, **kwargs)
+        return async_find(
+            mongodb_collection=self.mongodb_collection,
+            query=self._resolve(**kwargs),
+            projection=self.projection,
+            skip=self.skip,
+            limit=self.limit,
+            read_preference=read_preference,
+        )
+
+    def tap_many(self, kwargs_list, max_batch_size=None,
+                 max_batch_bytes=None):
+        """Taps this query with many sets of keyword arguments, in few server
+        round trips.
+
+        All parameter sets are resolved, identical resolved queries are run
+        once, and the rest are merged, in bounded batches, into $in or $or
+        queries. Returned documents are routed back to the parameter sets
+        whose queries they match by a client-side matcher; queries it does
+        not support are run one by one, as are all queries if this query has
+        a skip or a limit, or if a replay mode is set, so they are recorded
+        and replayed.
+
+        Arguments
+        ---------
+        kwargs_list : list of dict
+            A list of keyword argument sets, each used to resolve callables in
+            the query, as in tap().
+        max_batch_size : int, optional
+            The maximal number of resolved queries merged into a single
+            query. Defaults to 100.
+        max_batch_bytes : int, optional
+            The maximal encoded BSON size of the resolved queries merged into
+            a single query. Defaults to 4MB.
+
+        Returns
+        -------
+        list of list of dict
+            The documents matching the query, resolved with each set of
+            keyword arguments, in order.
+        """
+        if self.skip or self.limit or replay_enabled():
+            return [list(self.tap(**kwargs)) for kwargs in kwargs_list]
+        from .batching import find_many
+        return find_many(
+            col_obj=self.mongodb_collection._get_connection(),
+            queries=[self._resolve(**kwargs) for kwargs in kwargs_list],
+            projection=self.projection,
+            max_batch_size=max_batch_size,
+            max_batch_bytes=max_batch_bytes,
+        )
+
+    @not_replayable
+    def tap_page(self, page_size=None, page_token=None, sort_key=None,
+                 descending=False, read_preference=None, **kwargs):
+        """Returns a single page of the documents matching this query, using
+        keyset pagination.
+
+        Rather than skipping over previous pages, each page is fetched by
+        filtering on the sort key of the last document of the previous page,
+        which is encoded in the page token returned with it, so that deep
+        pages cost the same as the first one. The skip of this query, if any,
+        is applied to the first page only, and its limit caps the total
+        number of documents returned across all pages.
+
+        Arguments
+        ---------
+        page_size : int, optional
+            The maximal number of documents in the page. Defaults to 1000.
+        page_token : str, optional
+            The token of the page to fetch, as returned with the previous
+            page. The first page is fetched if not given.
+        sort_key : str, optional
+            The name of the field to paginate by, which should be indexed.
+            Ties are broken by _id. All matching documents must hold a value
+            of the same type in this field. Defaults to '_id'.
+        descending : bool, optional
+            If True, pages are walked in descending sort key order. Defaults
+            to False.
+        read_preference : str, dict or pymongo read preference, optional
+            The read preference of this tap, as in tap().
+        **kwargs : extra keyword arguments
+            Used to resolve callables in the query, as in tap().
+
+        Returns
+        -------
+        valve.mongodb.pagination.Page
+            A named tuple of the documents of the page and the token of the
+            next page, which is None if this is the last page.
+
+        Raises
+        ------
+        ValueError
+            If the given page token is invalid, or was issued for another
+            request or pagination order.
+        MissingRecordingException
+            In 'replay' mode, as pages are never recorded. See valve.replay.
+        """
+        from .pagination import find_page
+        return find_page(
+            col_obj=self.mongodb_collection._get_connection(read_preference),
+            query=self._resolve(**kwargs),
+            projection=self.projection,
+            page_size=page_size,
+            sort_key=sort_key,
+            descending=descending,
+            skip=self.skip,
+            limit=self.limit,
+            page_token=page_token,
+            query_hash=self.tap_hash(**kwargs),
+        )
+
+    @not_replayable
+    def tap_pages(self, page_size=None, page_token=None, sort_key=None,
+                  descending=False, **kwargs):
+        """Iterates over pages of the documents matching this query, using
+        keyset pagination, starting at the page of the given token, if any.
+
+        See tap_page() for a description of all arguments.
+
+        Yields
+        ------
+        valve.mongodb.pagination.Page
+            Pages of documents, each with the token resuming iteration at the
+            page following it.
+        """
+        while True:
+            page = self.tap_page(
+                page_size=page_size, page_token=page_token,
+                sort_key=sort_key, descending=descending, **kwargs)
+            yield page
+            page_token = page.next_token
+            if page_token is None:
+                return
+
+    def _checkpoint_path(self, checkpoint_dir=None, **kwargs):
+        from .resumable import checkpoint_path
+        return checkpoint_path(
+            self.identifier, self.tap_hash(**kwargs), checkpoint_dir)
+
+    @not_replayable
+    def tap_resumable(self, sort_key=None, checkpoint_every=None,
+                      max_retries=None, retry_delay=None, restart=False,
+                      checkpoint_dir=None, read_preference=None, **kwargs):
+        """Taps this query with a resumable, checkpointed scan.
+
+        Documents are read in sort key order, and the sort key of the last
+        consumed document is periodically checkpointed to disk. Transient
+        errors, like network errors and cursor timeouts, are recovered from by
+        reopening the cursor after the last consumed document. If the tap is
+        interrupted altogether, tapping again with the same arguments resumes
+        it from its last checkpoint. Documents are delivered at least once:
+        those consumed after the last checkpoint are delivered again after a
+        hard interruption. The checkpoint is removed once the tap completes.
+        Resumable taps are never recorded, and raise a
+        MissingRecordingException in 'replay' mode. See valve.replay.
+
+        Arguments
+        ---------
+        sort_key : str, optional
+            The name of the field to scan by, which should be indexed. Ties
+            are broken by _id. All matching documents must hold a value of the
+            same type in this field. Defaults to '_id'.
+        checkpoint_every : int, optional
+            The number of consumed documents between checkpoints. Defaults to
+            10000.
+        max_retries : int, optional
+            The maximal number of consecutive transient errors recovered from
+            before failing. Defaults to 5.
+        retry_delay : float, optional
+            The delay, in seconds, before the first retry, doubled on each
+            consecutive retry. Defaults to 1.
+        restart : bool, optional
+            If True, any existing checkpoint is ignored. Defaults to False.
+        checkpoint_dir : str, optional
+            The directory in which checkpoints are stored. Defaults to a
+            'checkpoints' folder inside the .valve folder in your home folder.
+        read_preference : str, dict or pymongo read preference, optional
+            The read preference of this tap, as in tap().
+        **kwargs : extra keyword arguments
+            Used to resolve callables in the query, as in tap().
+
+        Returns
+        -------
+        iterator of dict
+            An iterator over the documents matching the query.
+        """
+        if self.skip or self.limit:
+            raise ValueError(
+                "Queries with skip or limit cannot be tapped resumably.")
+        from .resumable import resumable_find
+        return resumable_find(
+            col_obj=self.mongodb_collection._get_connection(read_preference),
+            query=self._resolve(**kwargs),
+            checkpoint_fpath=self._checkpoint_path(checkpoint_dir, **kwargs),
+            projection=self.projection,
+            sort_key=sort_key,
+            checkpoint_every=checkpoint_every,
+            max_retries=max_retries,
+            retry_delay=retry_delay,
+            restart=restart,
+        )
+
+    def clear_checkpoint(self, checkpoint_dir=None, **kwargs):
+        """Removes the checkpoint of the resumable tap of this query with the
+        given keyword arguments, if any."""
+        from .resumable import remove_checkpoint
+        remove_checkpoint(self._checkpoint_path(checkpoint_dir, **kwargs))
+
+    @not_replayable
+    def live(self, live_dir=None, read_preference=None, **kwargs):
+        """Returns a live dataset of this query, materialized once and kept
+        fresh by applying the events of a change stream on its collection.
+
+        Live datasets are never recorded, and a MissingRecordingException is
+        raised in 'replay' mode. See valve.replay.
+
+        Arguments
+        ---------
+        live_dir : str, optional
+            The directory in which live datasets are persisted. Defaults to a
+            'live' folder inside the .valve folder in your home folder.
+        read_preference : str, dict or pymongo read preference, optional
+            The read preference of the taps of the dataset, as in tap().
+        **kwargs : extra keyword arguments
+            Used to resolve callables in the query, as in tap().
+
+        Returns
+        -------
+        valve.mongodb.live.LiveDataset
+            A DataTap over the maintained dataset, synced on each tap.
+        """
+        from .live import LiveDataset
+        return LiveDataset(
+            self, live_dir=live_dir, read_preference=read_preference,
+            **kwargs)
+
+    @not_replayable
+    def watermark(self, field, **kwargs):
+        """Returns the maximal value of the given field among the documents
+        matching this query, or None if no document matches. Raises a
+        MissingRecordingException in 'replay' mode. See valve.replay.
+
+        Arguments
+        ---------
+        field : str
+            The name of the field. Dotted paths are supported. The field
+            should be indexed for this to be efficient.
+        **kwargs : extra keyword arguments
+            Used to resolve callables in the query, as in tap().
+        """
+        from .documents import get_field
+        col_obj = self.mongodb_collection._get_connection()
+        cursor = col_obj.find(
+            filter=self._resolve(**kwargs),
+            projection={field: True},
+        ).sort(field, -1).limit(1)
+        for doc in cursor:
+            return get_field(doc, field)
+        return None
+
+    def between(self, field, lower=None, upper=None):
+        """Returns a query restricted to documents matching this query with
+        lower < field <= upper.
+
+        The returned query shares the identifier and projection of this
+        query, as it taps a subset of the same dataset.
+
+        Arguments
+        ---------
+        field : str
+            The name of the field to restrict. Dotted paths are supported.
+        lower : object, optional
+            The exclusive lower bound of the field. Unbounded if not given.
+        upper : object, optional
+            The inclusive upper bound of the field. Unbounded if not given.
+        """
+        if self.skip or self.limit:
+            raise ValueError(
+                "Queries with skip or limit cannot be restricted by range.")
+        field_range = {}
+        if lower is not None:
+            field_range['$gt'] = lower
+        if upper is not None:
+            field_range['$lte'] = upper
+        query = self.query
+        if field_range:
+            query = {'$and': [self.query, {field: field_range}]}
+        return MongoDBQuery(
+            self.mongodb_collection, query=query,
+            identifier=self._local_identifier(),
+            projection=self.projection)
+
+    def tap_arrow(self, schema=None, batch_size=None, read_preference=None,
+                  **kwargs):
+        """Taps this query into a stream of Arrow record batches, decoded
+        directly from raw BSON batches, without materializing documents as
+        dicts. Requires pyarrow, and uses pymongoarrow if installed.
+
+        Arguments
+        ---------
+        schema : pyarrow.Schema or dict, optional
+            The schema of the record batches, given either as a pyarrow schema
+            or as a dict mapping field names to pyarrow types. If not given,
+            it is inferred from the first batch. ObjectId and Decimal128
+            fields are returned as strings, and should be given as such.
+        batch_size : int, optional
+            The number of documents per batch returned by the server, and so
+            per record batch. Defaults to the batch size of the server.
+        read_preference : str, dict or pymongo read preference, optional
+            The read preference of this tap, as in tap().
+        **kwargs : extra keyword arguments
+            Used to resolve callables in the query, as in tap().
+
+        Returns
+        -------
+        iterator of pyarrow.RecordBatch
+            An iterator over record batches of matching documents.
+        """
+        if replay_enabled():
+            return DataTap.tap_arrow(
+                self, schema=schema, batch_size=batch_size,
+                read_preference=read_preference, **kwargs)
+        from .arrow import find_arrow_batches
+        return find_arrow_batches(
+            col_obj=self.mongodb_collection._get_connection(read_preference),
+            query=self._resolve(**kwargs),
+            projection=self.projection,
+            skip=self.skip,
+            limit=self.limit,
+            schema=schema,
+            batch_size=batch_size,
+        )
+
+    def tap_parallel(self, num_partitions=None, partition_key=None,
+                     max_workers=None, read_preference=None, **kwargs):
+        """Taps this query by running it as several concurrent queries over
+        disjoint ranges of a partition key.
+
+        Range bounds are estimated by sampling the collection, and all
+        partitions share the pymongo client of this query's server. Results
+        are merged in arrival order, so no ordering is guaranteed. As skip and
+        limit cannot be applied to partitions separately, queries with either
+        set fall back to a regular tap, as do all queries if a replay mode is
+        set, so they are recorded and replayed.
+
+        Arguments
+        ---------
+        num_partitions : int, optional
+            The number of partitions to split the query into. Defaults to 4.
+        partition_key : str, optional
+            The name of the field to partition by. Documents holding no value,
+            or a value of a type other than the most common one, in this field
+            are queried by an extra catch-all partition. Defaults to '_id'.
+        max_workers : int, optional
+            The maximal number of partitions queried at the same time.
+            Defaults to num_partitions.
+        read_preference : str, dict or pymongo read preference, optional
+            The read preference of this tap, as in tap().
+        **kwargs : extra keyword arguments
+            Used to resolve callables in the query, as in tap().
+
+        Returns
+        -------
+        iterator of dict
+            An iterator over the documents matching the query.
+        """
+        if self.skip or self.limit or replay_enabled():
+            return self.tap(read_preference=read_preference, **kwargs)
+        col_obj = self.mongodb_collection._get_connection(read_preference)
+        query = self._resolve(**kwargs)
+        from .parallel import parallel_find
+        return parallel_find(
+            col_obj=col_obj,
+            query=query,
+            projection=self.projection,
+            partition_key=partition_key,
+            num_partitions=num_partitions,
+            max_workers=max_workers,
         )
 
 
@@ -365,27 +1010,242 @@ class MongoDBAggregation(MongoDBSource, DataTap):
     identifier : str, optional
         A string identifier unique to this aggregation. If none is given, a
         stable hash function is used to compute a good candidate.
+    optimize : bool, optional
+        If True, the pipeline is rewritten into an equivalent, cheaper one
+        before being run, by pushing $match stages down, pruning projected
+        fields and coalescing $sort and $limit stages. The identifier is
+        still computed from the given pipeline, and the rewrites applied are
+        described by the optimization_report attribute. Defaults to False.
     """
 
     def __init__(self, mongodb_collection, aggregation_pipeline,
-                 identifier=None):
+                 identifier=None, optimize=False):
         if identifier is None:
-            try:
-                identifier = str(abs(stable_hash(
-                    aggregation_pipeline)))
-            except TypeError:
-                clean_pipe = _clean_query_from_callables(
-                    aggregation_pipeline)
-                identifier = str(abs(stable_hash(clean_pipe)))
+            identifier = default_identifier(aggregation_pipeline)
         identifier = mongodb_collection.identifier + '.' + identifier
         super().__init__(identifier=identifier)
         self.mongodb_collection = mongodb_collection
+        self.original_pipeline = aggregation_pipeline
+        self.optimization_report = None
+        if optimize:
+            from .optimizer import optimize_pipeline
+            self.optimization_report = optimize_pipeline(aggregation_pipeline)
+            aggregation_pipeline = self.optimization_report.optimized
         self.aggregation_pipeline = aggregation_pipeline
+        self._template = QueryTemplate(aggregation_pipeline)
 
     def __repr__(self):
         return "MongoDB aggregation DataSource: {}".format(self.identifier)
 
-    def tap(self, **kwargs):
+    def __reduce__(self):
+        # callables in the pipeline must be picklable, e.g. module-level
+        identifier = self.identifier[
+            len(self.mongodb_collection.identifier) + 1:]
+        return (MongoDBAggregation, (
+            self.mongodb_collection, self.original_pipeline, identifier,
+            self.optimization_report is not None))
+
+    def _resolve(self, **kwargs):
+        """Returns the aggregation pipeline of this data source, resolved with
+        the given keyword arguments. Stages and branches holding no callables
+        are shared with the pipeline itself, as is the whole pipeline if it
+        holds none, so the result must not be modified in place. See
+        QueryTemplate.resolve."""
+        if self._template.query is not self.aggregation_pipeline:
+            self._template = QueryTemplate(self.aggregation_pipeline)
+        return self._template.resolve(**kwargs)
+
+    def tap_key(self, **kwargs):
+        """Returns the fully resolved pipeline this aggregation runs when
+        tapped with the given keyword arguments.
+
+        The returned pipeline shares its stages and branches holding no
+        callables with the pipeline of this data source, so it must be copied
+        before it is modified."""
+        return self._resolve(**kwargs)
+
+    def _aggregate(self, pipeline, read_preference=None):
+        col_obj = self.mongodb_collection._get_connection(read_preference)
+        return _metered(col_obj, lambda col: col.aggregate(pipeline))
+
+    @replayable
+    def tap(self, read_preference=None, **kwargs):
+        """Taps this aggregation, returning an iterator over the resulting
+        documents, recorded or replayed if a replay mode is set, as in
+        MongoDBQuery.tap().
+
+        Arguments
+        ---------
+        read_preference : str, dict or pymongo read preference, optional
+            The read preference of this tap, overriding the one of its server,
+            as in MongoDBQuery.tap().
+        **kwargs : extra keyword arguments
+            Used to resolve callables in the pipeline.
+
+        Returns
+        -------
+        iterator of dict
+            An iterator over the resulting documents.
+        """
+        return self._aggregate(self._resolve(**kwargs), read_preference)
+
+    @not_replayable
+    def explain_costs(self, **kwargs):
+        """Returns the execution statistics of the original and the optimized
+        pipelines of this aggregation, as reported by the server's explain
+        command, to compare the two. Raises a MissingRecordingException in
+        'replay' mode. See valve.replay.
+
+        Arguments
+        ---------
+        **kwargs : extra keyword arguments
+            Used to resolve callables in the pipelines, as in tap().
+
+        Returns
+        -------
+        dict
+            A dict mapping 'original' and 'optimized' to dicts mapping the
+            names of execution metrics, namely executionTimeMillis,
+            totalKeysExamined, totalDocsExamined and nReturned, to their
+            values.
+        """
+        from .optimizer import explain_cost
         col_obj = self.mongodb_collection._get_connection()
-        pipe = _resolve_query(self.aggregation_pipeline, **kwargs)
-        return col_obj.aggregate(pipe)
+        original = QueryTemplate(self.original_pipeline).resolve(**kwargs)
+        return {
+            'original': explain_cost(col_obj, original),
+            'optimized': explain_cost(col_obj, self._resolve(**kwargs)),
+        }
+
+    def tap_arrow(self, schema=None, batch_size=None, read_preference=None,
+                  **kwargs):
+        """Taps this aggregation into a stream of Arrow record batches, decoded
+        directly from raw BSON batches, without materializing documents as
+        dicts. Requires pyarrow, and uses pymongoarrow if installed.
+
+        Arguments
+        ---------
+        schema : pyarrow.Schema or dict, optional
+            The schema of the record batches, given either as a pyarrow schema
+            or as a dict mapping field names to pyarrow types. If not given,
+            it is inferred from the first batch. ObjectId and Decimal128
+            fields are returned as strings, and should be given as such.
+        batch_size : int, optional
+            The number of documents per batch returned by the server, and so
+            per record batch. Defaults to the batch size of the server.
+        read_preference : str, dict or pymongo read preference, optional
+            The read preference of this tap, as in tap().
+        **kwargs : extra keyword arguments
+            Used to resolve callables in the pipeline, as in tap().
+
+        Returns
+        -------
+        iterator of pyarrow.RecordBatch
+            An iterator over record batches of resulting documents.
+        """
+        if replay_enabled():
+            return DataTap.tap_arrow(
+                self, schema=schema, batch_size=batch_size,
+                read_preference=read_preference, **kwargs)
+        from .arrow import aggregate_arrow_batches
+        return aggregate_arrow_batches(
+            col_obj=self.mongodb_collection._get_connection(read_preference),
+            pipeline=self._resolve(**kwargs),
+            schema=schema,
+            batch_size=batch_size,
+        )
+
+    def tap_parallel(self, num_partitions=None, partition_key=None,
+                     max_workers=None, strict=False, read_preference=None,
+                     **kwargs):
+        """Taps this aggregation by running it as several concurrent partial
+        aggregations over disjoint ranges of a partition key, combining their
+        results client-side.
+
+        Only pipelines made of per-document stages ($match, $project,
+        $addFields, $set, $unset, $unwind, $replaceRoot, $replaceWith and
+        $lookup), followed by a $group or $count stage using only $sum,
+        $count, $min, $max and $avg accumulators, optionally followed by
+        $match, $sort, $skip and $limit stages, can be aggregated partially.
+        Range bounds are estimated by sampling the collection, and a leading
+        $match stage restricting the input to its range is injected into the
+        pipeline of each partition. Other pipelines fall back to a regular
+        tap, unless strict is set, as do all pipelines if a replay mode is
+        set, so they are recorded and replayed.
+
+        Arguments
+        ---------
+        num_partitions : int, optional
+            The number of partitions to split the input into. Defaults to 4.
+        partition_key : str, optional
+            The name of the field of input documents to partition by.
+            Documents holding no value, or a value of a type other than the
+            most common one, in this field are aggregated by an extra
+            catch-all partition. Defaults to '_id'.
+        max_workers : int, optional
+            The maximal number of partitions aggregated at the same time.
+            Defaults to num_partitions.
+        strict : bool, optional
+            If True, an UnsupportedQueryException is raised for pipelines
+            that cannot be aggregated partially, instead of falling back to a
+            regular tap. Defaults to False.
+        read_preference : str, dict or pymongo read preference, optional
+            The read preference of this tap, as in tap().
+        **kwargs : extra keyword arguments
+            Used to resolve callables in the pipeline, as in tap().
+
+        Returns
+        -------
+        iterator of dict
+            An iterator over the resulting documents.
+        """
+        from valve.exceptions import UnsupportedQueryException
+        from .partial import (
+            split_pipeline,
+            partial_group,
+            parallel_aggregate,
+        )
+        pipeline = self._resolve(**kwargs)
+        try:
+            partial_group(split_pipeline(pipeline)[1])
+        except UnsupportedQueryException:
+            if strict:
+                raise
+            return self.tap(read_preference=read_preference, **kwargs)
+        if replay_enabled():
+            return self.tap(read_preference=read_preference, **kwargs)
+        return iter(parallel_aggregate(
+            col_obj=self.mongodb_collection._get_connection(read_preference),
+            pipeline=pipeline,
+            partition_key=partition_key,
+            num_partitions=num_partitions,
+            max_workers=max_workers,
+        ))
+
+    def atap(self, read_preference=None, **kwargs):
+        """Taps this aggregation asynchronously, returning an async iterator
+        over the resulting documents.
+
+        Uses the native asyncio client of pymongo when available, and falls
+        back to running the blocking tap on an executor otherwise, or if a
+        replay mode is set, as in MongoDBQuery.atap().
+
+        Arguments
+        ---------
+        read_preference : str, dict or pymongo read preference, optional
+            The read preference of this tap, as in tap().
+        **kwargs : extra keyword arguments
+            Used to resolve callables in the pipeline, as in tap().
+        """
+        from .aio import (
+            has_async_client,
+            async_aggregate,
+        )
+        if not has_async_client() or replay_enabled():
+            return DataTap.atap(
+                self, read_preference=read_preference, **kwargs)
+        return async_aggregate(
+            mongodb_collection=self.mongodb_collection,
+            pipeline=self._resolve(**kwargs),
+            read_preference=read_preference,
+        )
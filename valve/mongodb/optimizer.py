@@ -0,0 +1,325 @@
+"""A client-side optimizer of MongoDB aggregation pipelines.
+
+Pipelines are rewritten with the following rules, applied until none applies:
+
+- Predicate pushdown: a $match stage is moved before a preceding $sort stage,
+  and before a preceding $project, $addFields, $set or $unset stage that
+  passes all fields the $match stage filters by through unchanged, so that
+  it can use indexes. Adjacent $match stages are merged.
+- Projection pruning: fields added by an $addFields or $set stage and
+  dropped by a following inclusion $project stage are not computed, and
+  adjacent inclusion $project stages are merged.
+- $sort and $limit coalescing: $skip and $limit stages are moved before
+  preceding one-to-one stages ($project, $addFields, $set and $unset), so
+  that they directly follow the $sort stage they bound, letting the server
+  run a top-k sort. Adjacent $limit and $skip stages are merged.
+
+Stages holding callables, to be resolved on tap, are moved but never
+inspected. Unbounded $sort stages are reported, as they are not rewritten.
+"""
+
+import copy
+
+from valve.exceptions import UnsupportedQueryException
+from .matcher import query_fields
+
+
+ONE_TO_ONE_STAGES = ('$project', '$addFields', '$set', '$unset')
+
+
+class OptimizationReport(object):
+    """A report of the rewrites applied to an aggregation pipeline.
+
+    Attributes
+    ----------
+    original : list of dict
+        The original pipeline.
+    optimized : list of dict
+        The optimized pipeline.
+    changes : list of str
+        A description of each rewrite applied, in order.
+    warnings : list of str
+        Descriptions of inefficiencies found but not rewritten.
+    """
+
+    def __init__(self, original, optimized, changes, warnings):
+        self.original = original
+        self.optimized = optimized
+        self.changes = changes
+        self.warnings = warnings
+
+    @property
+    def changed(self):
+        """True if the pipeline was rewritten."""
+        return bool(self.changes)
+
+    def __repr__(self):
+        lines = ["OptimizationReport: {} changes, {} warnings".format(
+            len(self.changes), len(self.warnings))]
+        lines.extend('  - ' + change for change in self.changes)
+        lines.extend('  ! ' + warning for warning in self.warnings)
+        return '\n'.join(lines)
+
+
+def _name(stage):
+    return next(iter(stage)) if len(stage) == 1 else None
+
+
+def _spec(stage):
+    return next(iter(stage.values()))
+
+
+def _overlaps(field, other):
+    return field == other or field.startswith(other + '.') or (
+        other.startswith(field + '.'))
+
+
+def _is_plain_projection(spec):
+    """Returns True if the given $project specification only includes or
+    excludes fields, without computing any."""
+    return isinstance(spec, dict) and all(
+        isinstance(value, (bool, int)) for value in spec.values())
+
+
+def _is_inclusion(spec):
+    return _is_plain_projection(spec) and any(
+        value for field, value in spec.items() if field != '_id')
+
+
+def _passes_through(stage, fields):
+    """Returns True if the given one-to-one stage passes all the given
+    fields through unchanged."""
+    name, spec = _name(stage), _spec(stage)
+    if name in ('$addFields', '$set'):
+        if not isinstance(spec, dict):
+            return False
+        return not any(_overlaps(field, added)
+                       for field in fields for added in spec)
+    if name == '$unset':
+        unset = [spec] if isinstance(spec, str) else spec
+        if not isinstance(unset, list):
+            return False
+        return not any(_overlaps(field, removed)
+                       for field in fields for removed in unset)
+    if name == '$project':
+        if not _is_plain_projection(spec):
+            return False
+        if _is_inclusion(spec):
+            included = [f for f, value in spec.items() if value] + ['_id']
+            if spec.get('_id', 1) in (0, False):
+                included.remove('_id')
+            return all(
+                any(field == inc or field.startswith(inc + '.')
+                    for inc in included)
+                for field in fields)
+        return not any(_overlaps(field, excluded)
+                       for field in fields for excluded in spec)
+    return False
+
+
+def _match_fields(spec):
+    """Returns the fields the given $match specification filters by, or None
+    if they cannot be determined."""
+    if not isinstance(spec, dict):
+        return None
+    try:
+        return query_fields(spec)
+    except (UnsupportedQueryException, AttributeError, TypeError):
+        return None
+
+
+def _pushdown(pipeline, changes):
+    for i in range(1, len(pipeline)):
+        stage = pipeline[i]
+        if _name(stage) != '$match':
+            continue
+        previous = pipeline[i - 1]
+        prev_name = _name(previous)
+        if prev_name == '$match':
+            pipeline[i - 1:i + 1] = [{'$match': {
+                '$and': [_spec(previous), _spec(stage)]}}]
+            changes.append(
+                "Merged adjacent $match stages at positions {} and {}.".format(
+                    i - 1, i))
+            return True
+        if prev_name == '$sort':
+            pipeline[i - 1], pipeline[i] = stage, previous
+            changes.append(
+                "Moved $match at position {} before $sort.".format(i))
+            return True
+        if prev_name in ONE_TO_ONE_STAGES:
+            fields = _match_fields(_spec(stage))
+            if fields is not None and _passes_through(previous, fields):
+                pipeline[i - 1], pipeline[i] = stage, previous
+                changes.append(
+                    "Moved $match at position {} before {}.".format(
+                        i, prev_name))
+                return True
+    return False
+
+
+def _prune_projections(pipeline, changes):
+    for i in range(1, len(pipeline)):
+        stage = pipeline[i]
+        if _name(stage) != '$project' or not _is_inclusion(_spec(stage)):
+            continue
+        spec = _spec(stage)
+        previous = pipeline[i - 1]
+        prev_name = _name(previous)
+        if prev_name == '$project' and _is_inclusion(_spec(previous)):
+            prev_spec = _spec(previous)
+            prev_included = [
+                field for field, value in prev_spec.items()
+                if value and field != '_id']
+            if not all(
+                    any(field == inc or field.startswith(inc + '.')
+                        for inc in prev_included)
+                    for field, value in spec.items()
+                    if value and field != '_id'):
+                continue
+            merged = dict(spec)
+            if prev_spec.get('_id', 1) in (0, False):
+                merged['_id'] = 0
+            pipeline[i - 1:i + 1] = [{'$project': merged}]
+            changes.append(
+                "Merged adjacent $project stages at positions {} and "
+                "{}.".format(i - 1, i))
+            return True
+        if prev_name in ('$addFields', '$set') and isinstance(
+                _spec(previous), dict):
+            included = [f for f, value in spec.items() if value]
+            dropped = [added for added in _spec(previous)
+                       if not any(_overlaps(added, inc) for inc in included)
+                       and added != '_id']
+            if not dropped:
+                continue
+            kept = {field: value for field, value in _spec(previous).items()
+                    if field not in dropped}
+            if kept:
+                pipeline[i - 1] = {prev_name: kept}
+            else:
+                del pipeline[i - 1]
+            changes.append(
+                "Pruned fields {} of {} at position {}, dropped by the "
+                "following $project.".format(
+                    ', '.join(sorted(dropped)), prev_name, i - 1))
+            return True
+    return False
+
+
+def _coalesce_limits(pipeline, changes):
+    for i in range(1, len(pipeline)):
+        stage = pipeline[i]
+        name = _name(stage)
+        if name not in ('$limit', '$skip'):
+            continue
+        previous = pipeline[i - 1]
+        prev_name = _name(previous)
+        if prev_name == name and isinstance(_spec(stage), int) and (
+                isinstance(_spec(previous), int)):
+            if name == '$limit':
+                merged = min(_spec(previous), _spec(stage))
+            else:
+                merged = _spec(previous) + _spec(stage)
+            pipeline[i - 1:i + 1] = [{name: merged}]
+            changes.append(
+                "Merged adjacent {} stages at positions {} and {}.".format(
+                    name, i - 1, i))
+            return True
+        if prev_name in ONE_TO_ONE_STAGES:
+            # only worth it if it brings the stage closer to a $sort
+            j = i - 1
+            while j >= 0 and _name(pipeline[j]) in ONE_TO_ONE_STAGES + (
+                    '$skip', '$limit'):
+                j -= 1
+            if j >= 0 and _name(pipeline[j]) == '$sort':
+                pipeline[i - 1], pipeline[i] = stage, previous
+                changes.append(
+                    "Moved {} at position {} before {}.".format(
+                        name, i, prev_name))
+                return True
+    return False
+
+
+def _unbounded_sorts(pipeline):
+    warnings = []
+    for i, stage in enumerate(pipeline):
+        if _name(stage) != '$sort':
+            continue
+        following = [_name(other) for other in pipeline[i + 1:]]
+        bounded = following[:1] == ['$limit'] or (
+            following[:2] == ['$skip', '$limit'])
+        if not bounded:
+            warnings.append((
+                "$sort at position {} is not followed by a $limit, and "
+                "sorts all its input documents.").format(i))
+    return warnings
+
+
+def optimize_pipeline(pipeline):
+    """Rewrites the given aggregation pipeline into an equivalent, cheaper
+    one.
+
+    Arguments
+    ---------
+    pipeline : list of dict
+        A pymongo-compliant MongoDB aggregation pipeline, possibly holding
+        callables to be resolved on tap. It is not modified.
+
+    Returns
+    -------
+    OptimizationReport
+        The report of the optimization, holding the optimized pipeline.
+    """
+    optimized = [copy.copy(stage) for stage in pipeline]
+    changes = []
+    rules = (_pushdown, _prune_projections, _coalesce_limits)
+    while any(rule(optimized, changes) for rule in rules):
+        pass
+    return OptimizationReport(
+        original=pipeline, optimized=optimized, changes=changes,
+        warnings=_unbounded_sorts(optimized))
+
+
+def _find_stats(explain_output):
+    """Returns the first executionStats document found in the given explain
+    output, or an empty dict."""
+    if isinstance(explain_output, dict):
+        if 'executionStats' in explain_output:
+            return explain_output['executionStats']
+        values = explain_output.values()
+    elif isinstance(explain_output, list):
+        values = explain_output
+    else:
+        return {}
+    for value in values:
+        stats = _find_stats(value)
+        if stats:
+            return stats
+    return {}
+
+
+EXPLAIN_METRICS = (
+    'executionTimeMillis', 'totalKeysExamined', 'totalDocsExamined',
+    'nReturned')
+
+
+def explain_cost(col_obj, pipeline):
+    """Returns the execution statistics of the given resolved pipeline, as
+    reported by the server's explain command with the executionStats
+    verbosity.
+
+    Returns
+    -------
+    dict
+        A dict mapping the names of the collected metrics, namely
+        executionTimeMillis, totalKeysExamined, totalDocsExamined and
+        nReturned, to their values, for all metrics reported.
+    """
+    explain_output = col_obj.database.command(
+        'explain',
+        {'aggregate': col_obj.name, 'pipeline': pipeline, 'cursor': {}},
+        verbosity='executionStats')
+    stats = _find_stats(explain_output)
+    return {metric: stats[metric] for metric in EXPLAIN_METRICS
+            if metric in stats}
@@ -0,0 +1,164 @@
+"""Keyset pagination of MongoDB queries, with resumable page tokens.
+
+Pages are walked by filtering on the sort key of the last document of the
+previous page, instead of skipping over all previous pages, so that, given an
+index on the sort key, deep pages cost the same as the first one. Documents
+are ordered by the sort key, with ties broken by _id.
+"""
+
+import base64
+import collections
+
+from bson import json_util
+
+from .documents import (
+    get_field,
+    paging_projection,
+)
+
+
+DEFAULT_PAGE_SIZE = 1000
+DEFAULT_SORT_KEY = '_id'
+
+Page = collections.namedtuple('Page', ['documents', 'next_token'])
+Page.__doc__ = """A page of documents, and the token of the next page, which
+is None if this is the last page."""
+
+
+def encode_page_token(state):
+    """Encodes the given pagination state into an opaque, URL-safe string."""
+    text = json_util.dumps(
+        state, json_options=json_util.CANONICAL_JSON_OPTIONS)
+    return base64.urlsafe_b64encode(text.encode('utf-8')).decode('ascii')
+
+
+def decode_page_token(page_token):
+    """Decodes a pagination state from the given page token.
+
+    Raises
+    ------
+    ValueError
+        If the given string is not a valid page token.
+    """
+    try:
+        text = base64.urlsafe_b64decode(page_token.encode('ascii'))
+        state = json_util.loads(text.decode('utf-8'))
+    except (TypeError, ValueError, UnicodeError):
+        raise ValueError("Invalid page token: {!r}".format(page_token))
+    if not isinstance(state, dict) or 'key' not in state:
+        raise ValueError("Invalid page token: {!r}".format(page_token))
+    return state
+
+
+def keyset_query(query, sort_key, last_value, last_id, descending=False):
+    """Returns the given query restricted to the documents following the
+    document with the given sort key value and _id, in pagination order."""
+    op = '$lt' if descending else '$gt'
+    if sort_key == '_id':
+        after = {'_id': {op: last_id}}
+    else:
+        after = {'$or': [
+            {sort_key: {op: last_value}},
+            {sort_key: last_value, '_id': {op: last_id}},
+        ]}
+    if not query:
+        return after
+    return {'$and': [query, after]}
+
+
+def find_page(col_obj, query, projection=None, page_size=None, sort_key=None,
+              descending=False, skip=0, limit=0, page_token=None,
+              query_hash=None):
+    """Returns a page of the results of a find query, using keyset
+    pagination.
+
+    Arguments
+    ---------
+    col_obj : pymongo.collection.Collection
+        The collection to query.
+    query : dict
+        A resolved pymongo-compliant MongoDB query.
+    projection : list or dict, optional
+        A projection to apply to the results.
+    page_size : int, optional
+        The maximal number of documents in the page. Defaults to 1000.
+    sort_key : str, optional
+        The name of the field to paginate by, which should be indexed. All
+        matching documents must hold a value of the same type in this field.
+        Dotted paths are supported. Defaults to '_id'.
+    descending : bool, optional
+        If True, pages are walked in descending sort key order. Defaults to
+        False.
+    skip : int, optional
+        The number of documents to omit from the start of the paginated
+        result set. Only applied when fetching the first page.
+    limit : int, optional
+        The maximal total number of documents to return across all pages.
+    page_token : str, optional
+        The token of the page to fetch, as returned with the previous page.
+        The first page is fetched if not given.
+    query_hash : str, optional
+        A hash of the request being paginated. If given, it is embedded in
+        page tokens, and page tokens of other requests are rejected.
+
+    Returns
+    -------
+    Page
+        The documents of the page, and the token of the next page.
+
+    Raises
+    ------
+    ValueError
+        If the given page token is invalid, or was issued for another request
+        or pagination order.
+    """
+    if page_size is None:
+        page_size = DEFAULT_PAGE_SIZE
+    if sort_key is None:
+        sort_key = DEFAULT_SORT_KEY
+    remaining = limit or None
+    if page_token is not None:
+        state = decode_page_token(page_token)
+        if state['key'] != sort_key or state['desc'] != bool(descending):
+            raise ValueError(
+                "The page token was issued for another pagination order.")
+        if query_hash is not None and state['hash'] != query_hash:
+            raise ValueError("The page token was issued for another query.")
+        query = keyset_query(
+            query, sort_key, state['value'], state['id'], descending)
+        remaining = state['remaining']
+        skip = 0
+    if remaining is not None and remaining <= 0:  # pragma: no cover
+        return Page([], None)
+    num_to_fetch = page_size
+    if remaining is not None:
+        num_to_fetch = min(page_size, remaining)
+    direction = -1 if descending else 1
+    sort = [(sort_key, direction)]
+    if sort_key != '_id':
+        sort.append(('_id', direction))
+    page_projection, strip = paging_projection(projection, sort_key)
+    # one more document is fetched to know if there is a next page
+    documents = list(col_obj.find(
+        filter=query, projection=page_projection, sort=sort, skip=skip,
+        limit=num_to_fetch + 1))
+    has_next = len(documents) > num_to_fetch
+    documents = documents[:num_to_fetch]
+    if remaining is not None:
+        remaining -= len(documents)
+        has_next = has_next and remaining > 0
+    next_token = None
+    if has_next:
+        last = documents[-1]
+        next_token = encode_page_token({
+            'key': sort_key,
+            'desc': bool(descending),
+            'value': get_field(last, sort_key),
+            'id': last['_id'],
+            'remaining': remaining,
+            'hash': query_hash,
+        })
+    for document in documents:
+        for key in strip:
+            document.pop(key, None)
+    return Page(documents, next_token)
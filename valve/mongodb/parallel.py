@@ -0,0 +1,174 @@
+"""Range-partitioned parallel execution of MongoDB queries."""
+
+import datetime
+import functools
+import collections
+
+from bson import (
+    ObjectId,
+    Decimal128,
+)
+
+from valve.merge import merge_iterators
+
+
+DEFAULT_NUM_PARTITIONS = 4
+DEFAULT_PARTITION_KEY = '_id'
+SAMPLES_PER_PARTITION = 32
+
+
+def _bound_type(value):
+    """Returns the $type alias of the given key value, if ranges of values of
+    its type can be used as partitions, and None otherwise."""
+    if isinstance(value, bool):
+        return 'bool'
+    if isinstance(value, (int, float, Decimal128)):
+        return 'number'
+    if isinstance(value, str):
+        return 'string'
+    if isinstance(value, ObjectId):
+        return 'objectId'
+    if isinstance(value, datetime.datetime):
+        return 'date'
+    return None
+
+
+def _bound_order(value):
+    if isinstance(value, Decimal128):
+        return value.to_decimal()
+    return value
+
+
+def sample_bounds(col_obj, key, num_partitions):
+    """Estimates the bounds splitting the given collection into partitions of
+    roughly equal size along the given key, by sampling it.
+
+    The whole collection is sampled, rather than the result set of a specific
+    query, as this lets the server use a random cursor instead of scanning
+    all matching documents.
+
+    Bounds are only drawn from sampled values of the most common type among
+    numbers, strings, ObjectIds, dates and booleans. Documents holding no
+    value, or a value of another type, in the partition key are left to the
+    catch-all partition of partition_queries.
+
+    Arguments
+    ---------
+    col_obj : pymongo.collection.Collection
+        The collection to partition.
+    key : str
+        The name of the field to partition by. Dotted paths are supported.
+    num_partitions : int
+        The number of requested partitions.
+
+    Returns
+    -------
+    list
+        A sorted list of at most num_partitions - 1 distinct key values, all
+        of the same type.
+    """
+    if num_partitions < 2:
+        return []
+    pipeline = [
+        {'$sample': {'size': num_partitions * SAMPLES_PER_PARTITION}},
+        {'$project': {'_id': 0, 'k': '$' + key}},
+    ]
+    by_type = collections.defaultdict(list)
+    for doc in col_obj.aggregate(pipeline):
+        bound_type = _bound_type(doc.get('k'))
+        if bound_type is not None:
+            by_type[bound_type].append(doc['k'])
+    if not by_type:
+        return []
+    values = sorted(
+        max(by_type.values(), key=len), key=_bound_order)
+    bounds = []
+    for i in range(1, num_partitions):
+        if not values:
+            break
+        value = values[len(values) * i // num_partitions]
+        if not bounds or value != bounds[-1]:
+            bounds.append(value)
+    return bounds
+
+
+def partition_queries(query, key, bounds):
+    """Splits the given query into disjoint queries, one per key range.
+
+    Arguments
+    ---------
+    query : dict
+        A resolved pymongo-compliant MongoDB query.
+    key : str
+        The name of the field to partition by.
+    bounds : list
+        A sorted list of distinct key values splitting the ranges.
+
+    Returns
+    -------
+    list of dict
+        len(bounds) + 2 queries, the union of the results of which is the
+        result of the given query: one per key range, and a last one matching
+        documents holding no value, or a value of a different type than the
+        bounds, in the partition key. Documents holding an array in the
+        partition key may match several of them.
+    """
+    if not bounds:
+        return [query]
+    ranges = []
+    lower = None
+    for upper in bounds + [None]:
+        key_range = {}
+        if lower is not None:
+            key_range['$gte'] = lower
+        if upper is not None:
+            key_range['$lt'] = upper
+        ranges.append({key: key_range})
+        lower = upper
+    # range operators only match values of the type of their operand, like
+    # {'$gte': 5} does not match '6', null or missing values
+    ranges.append({key: {'$not': {'$type': _bound_type(bounds[0])}}})
+    if not query:
+        return ranges
+    return [{'$and': [query, key_range]} for key_range in ranges]
+
+
+def parallel_find(col_obj, query, projection=None, partition_key=None,
+                  num_partitions=None, max_workers=None):
+    """Runs a find query as several concurrent range-partitioned queries.
+
+    Arguments
+    ---------
+    col_obj : pymongo.collection.Collection
+        The collection to query.
+    query : dict
+        A resolved pymongo-compliant MongoDB query.
+    projection : list or dict, optional
+        A projection to apply to the results.
+    partition_key : str, optional
+        The name of the field to partition by. Defaults to '_id'.
+    num_partitions : int, optional
+        The number of partitions to split the query into. Defaults to 4.
+    max_workers : int, optional
+        The maximal number of partitions queried at the same time. Defaults to
+        num_partitions.
+
+    Returns
+    -------
+    iterator of dict
+        An iterator over the merged results of all partitions, in arrival
+        order.
+    """
+    if partition_key is None:
+        partition_key = DEFAULT_PARTITION_KEY
+    if num_partitions is None:
+        num_partitions = DEFAULT_NUM_PARTITIONS
+    bounds = sample_bounds(col_obj, partition_key, num_partitions)
+    return merge_iterators(
+        iter_factories=[
+            functools.partial(
+                col_obj.find, filter=part_query, projection=projection)
+            for part_query in partition_queries(query, partition_key, bounds)
+        ],
+        max_workers=max_workers,
+    )
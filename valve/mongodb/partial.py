@@ -0,0 +1,338 @@
+"""Parallel partial aggregation of MongoDB aggregation pipelines.
+
+A pipeline made of per-document stages, followed by a $group stage using only
+decomposable accumulators, is run as several concurrent pipelines over
+disjoint ranges of a partition key, each computing partial group results.
+Partial results are then combined client-side, and the stages following the
+$group stage, if any, are applied to the combined results client-side.
+"""
+
+import math
+import decimal
+import functools
+
+from bson import (
+    BSON,
+    Decimal128,
+)
+from bson.decimal128 import create_decimal128_context
+
+from valve.merge import merge_iterators
+from valve.exceptions import UnsupportedQueryException
+from .matcher import (
+    match,
+    query_fields,
+)
+from .documents import (
+    get_field,
+    sort_key,
+)
+from .parallel import (
+    DEFAULT_PARTITION_KEY,
+    DEFAULT_NUM_PARTITIONS,
+    sample_bounds,
+    partition_queries,
+)
+
+
+# stages transforming or filtering each document independently, and so
+# commuting with partitioning the input of the pipeline
+PER_DOCUMENT_STAGES = (
+    '$match', '$project', '$addFields', '$set', '$unset', '$unwind',
+    '$replaceRoot', '$replaceWith', '$lookup',
+)
+
+DECOMPOSABLE_ACCUMULATORS = ('$sum', '$count', '$min', '$max', '$avg')
+
+# stages following the $group stage that can be applied client-side
+CLIENT_SIDE_STAGES = ('$match', '$sort', '$skip', '$limit')
+
+_PARTIAL_PREFIX = '__partial_'
+
+
+def _stage_name(stage):
+    if len(stage) != 1:
+        raise UnsupportedQueryException(
+            "Invalid pipeline stage {}.".format(stage))
+    return next(iter(stage))
+
+
+def _uses_text_search(obj):
+    if isinstance(obj, dict):
+        return '$text' in obj or any(
+            _uses_text_search(value) for value in obj.values())
+    if isinstance(obj, (list, tuple)):
+        return any(_uses_text_search(item) for item in obj)
+    return False
+
+
+def split_pipeline(pipeline):
+    """Splits the given pipeline into per-document stages, a $group stage and
+    client-side stages.
+
+    A final $count stage is treated as a $group stage counting documents.
+
+    Returns
+    -------
+    tuple
+        The list of per-document stages, the $group stage specification and
+        the list of stages to apply client-side.
+
+    Raises
+    ------
+    UnsupportedQueryException
+        If the pipeline cannot be aggregated partially.
+    """
+    for i, stage in enumerate(pipeline):
+        name = _stage_name(stage)
+        if name in PER_DOCUMENT_STAGES:
+            if name == '$match' and _uses_text_search(stage):
+                raise UnsupportedQueryException(
+                    "$text queries must lead the pipeline.")
+            continue
+        if name == '$group':
+            group = stage['$group']
+        elif name == '$count':
+            group = {'_id': None, stage['$count']: {'$sum': 1}}
+        else:
+            raise UnsupportedQueryException(
+                "Stage {} precedes any $group stage.".format(name))
+        suffix = list(pipeline[i + 1:])
+        if name == '$count':
+            suffix.insert(0, {'$project': {'_id': 0}})
+        for suffix_stage in suffix:
+            suffix_name = _stage_name(suffix_stage)
+            if suffix_stage == {'$project': {'_id': 0}}:
+                continue
+            if suffix_name not in CLIENT_SIDE_STAGES:
+                raise UnsupportedQueryException(
+                    "Stage {} cannot be applied client-side.".format(
+                        suffix_name))
+            if suffix_name == '$match':
+                query_fields(suffix_stage['$match'])
+        return list(pipeline[:i]), group, suffix
+    raise UnsupportedQueryException("The pipeline has no $group stage.")
+
+
+def partial_group(group):
+    """Returns the $group stage computing partial results of the given $group
+    stage specification, and the list of (field, accumulator) pairs to
+    combine them with.
+
+    Raises
+    ------
+    UnsupportedQueryException
+        If the $group stage uses a non-decomposable accumulator.
+    """
+    partial = {'_id': group['_id']}
+    combiners = []
+    for field, accumulator in group.items():
+        if field == '_id':
+            continue
+        if not isinstance(accumulator, dict) or len(accumulator) != 1:
+            raise UnsupportedQueryException(
+                "Invalid accumulator for {}.".format(field))
+        op, expr = next(iter(accumulator.items()))
+        if op not in DECOMPOSABLE_ACCUMULATORS:
+            raise UnsupportedQueryException(
+                "Accumulator {} is not decomposable.".format(op))
+        prefix = _PARTIAL_PREFIX + field
+        if op == '$count':
+            partial[prefix] = {'$sum': 1}
+        elif op == '$avg':
+            # $avg ignores non-numeric values, so only those are counted
+            partial[prefix + '_sum'] = {'$sum': expr}
+            partial[prefix + '_count'] = {'$sum': {
+                '$cond': [{'$isNumber': expr}, 1, 0]}}
+        else:
+            partial[prefix] = {op: expr}
+        combiners.append((field, op))
+    return partial, combiners
+
+_INT64_RANGE = (-2 ** 63, 2 ** 63 - 1)
+
+
+def _normalize_number(number):
+    """Returns a single representation of all numbers of different BSON types
+    equal to the given one: an int if it is integral, and a float if it is
+    exactly representable as one."""
+    if isinstance(number, Decimal128):
+        number = number.to_decimal()
+        if number.is_nan():
+            return math.nan
+        if not number.is_finite():
+            return float(number)
+        if number != number.to_integral_value():
+            as_float = float(number)
+            if decimal.Decimal(as_float) == number:
+                return as_float
+            return Decimal128(number.normalize())
+    elif isinstance(number, float):
+        if math.isnan(number):
+            return math.nan
+        if not number.is_integer():
+            return number
+    if _INT64_RANGE[0] <= number <= _INT64_RANGE[1]:
+        return int(number)
+    return float(number)
+
+
+def _normalize_group_id(group_id):
+    if isinstance(group_id, bool):
+        return group_id
+    if isinstance(group_id, (int, float, Decimal128)):
+        return _normalize_number(group_id)
+    if isinstance(group_id, dict):
+        return {key: _normalize_group_id(value)
+                for key, value in group_id.items()}
+    if isinstance(group_id, list):
+        return [_normalize_group_id(item) for item in group_id]
+    return group_id
+
+
+def _group_key(group_id):
+    # $group merges equal numbers of different types, like 1 and 1.0, into
+    # one group, also inside embedded group ids
+    return BSON.encode({'_id': _normalize_group_id(group_id)})
+
+
+def _add(total, value):
+    # as $sum, returns a Decimal128 if any of the summed numbers is one
+    if not isinstance(total, Decimal128) and not isinstance(
+            value, Decimal128):
+        return total + value
+    with decimal.localcontext(create_decimal128_context()):
+        return Decimal128(_to_decimal(total) + _to_decimal(value))
+
+
+def _to_decimal(number):
+    if isinstance(number, Decimal128):
+        return number.to_decimal()
+    return decimal.Decimal(number)
+
+
+def _average(total, count):
+    if not isinstance(total, Decimal128):
+        return total / count
+    with decimal.localcontext(create_decimal128_context()):
+        return Decimal128(total.to_decimal() / count)
+
+
+def combine_partials(partial_docs, combiners):
+    """Combines partial group results into final group results, in order of
+    first appearance of each group."""
+    groups = {}
+    for doc in partial_docs:
+        key = _group_key(doc['_id'])
+        try:
+            combined = groups[key]
+        except KeyError:
+            combined = {'_id': doc['_id']}
+            groups[key] = combined
+        for field, op in combiners:
+            prefix = _PARTIAL_PREFIX + field
+            if op == '$avg':
+                for suffix in ('_sum', '_count'):
+                    combined[prefix + suffix] = _add(combined.get(
+                        prefix + suffix, 0), doc[prefix + suffix])
+            elif op in ('$sum', '$count'):
+                combined[prefix] = _add(combined.get(prefix, 0), doc[prefix])
+            else:
+                value = doc.get(prefix)
+                current = combined.get(prefix)
+                if current is None:
+                    combined[prefix] = value
+                elif value is not None:
+                    choose = min if op == '$min' else max
+                    combined[prefix] = choose(
+                        current, value, key=sort_key)
+    results = []
+    for combined in groups.values():
+        result = {'_id': combined['_id']}
+        for field, op in combiners:
+            prefix = _PARTIAL_PREFIX + field
+            if op == '$avg':
+                count = combined[prefix + '_count']
+                result[field] = (_average(
+                    combined[prefix + '_sum'], count) if count else None)
+            else:
+                result[field] = combined.get(prefix)
+        results.append(result)
+    return results
+
+
+def apply_stages(documents, stages):
+    """Applies $match, $sort, $skip and $limit stages, and projections
+    excluding _id, to the given documents, client-side."""
+    for stage in stages:
+        name, spec = next(iter(stage.items()))
+        if name == '$match':
+            documents = [doc for doc in documents if match(doc, spec)]
+        elif name == '$sort':
+            for field, direction in reversed(list(spec.items())):
+                documents = sorted(
+                    documents,
+                    key=lambda doc: sort_key(get_field(doc, field)),
+                    reverse=direction < 0)
+        elif name == '$skip':
+            documents = documents[spec:]
+        elif name == '$limit':
+            documents = documents[:spec]
+        else:
+            for doc in documents:
+                doc.pop('_id', None)
+    return documents
+
+
+def parallel_aggregate(col_obj, pipeline, partition_key=None,
+                       num_partitions=None, max_workers=None):
+    """Runs an aggregation pipeline as several concurrent partial
+    aggregations over disjoint ranges of a partition key, and combines their
+    results client-side.
+
+    Arguments
+    ---------
+    col_obj : pymongo.collection.Collection
+        The collection to run the aggregation against.
+    pipeline : list of dict
+        A resolved pymongo-compliant MongoDB aggregation pipeline, made of
+        per-document stages, followed by a $group or $count stage using only
+        $sum, $count, $min, $max and $avg accumulators, followed by $match,
+        $sort, $skip and $limit stages.
+    partition_key : str, optional
+        The name of the field of input documents to partition by. Documents
+        holding no value, or a value of a type other than the most common
+        one, in this field are aggregated by an extra catch-all partition.
+        Defaults to '_id'.
+    num_partitions : int, optional
+        The number of partitions to split the input into. Defaults to 4.
+    max_workers : int, optional
+        The maximal number of partitions aggregated at the same time.
+        Defaults to num_partitions.
+
+    Returns
+    -------
+    list of dict
+        The resulting documents.
+
+    Raises
+    ------
+    UnsupportedQueryException
+        If the pipeline cannot be aggregated partially.
+    """
+    if partition_key is None:
+        partition_key = DEFAULT_PARTITION_KEY
+    if num_partitions is None:
+        num_partitions = DEFAULT_NUM_PARTITIONS
+    prefix, group, suffix = split_pipeline(pipeline)
+    partial, combiners = partial_group(group)
+    bounds = sample_bounds(col_obj, partition_key, num_partitions)
+    partial_docs = merge_iterators(
+        iter_factories=[
+            functools.partial(col_obj.aggregate, [
+                {'$match': part_query}] + prefix + [{'$group': partial}])
+            for part_query in partition_queries({}, partition_key, bounds)
+        ],
+        max_workers=max_workers,
+    )
+    return apply_stages(combine_partials(partial_docs, combiners), suffix)
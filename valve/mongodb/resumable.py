@@ -0,0 +1,183 @@
+"""Resumable, checkpointed scans of MongoDB queries.
+
+A resumable scan reads the results of a query in sort key order, on a single
+long-lived cursor, and periodically checkpoints the sort key of the last
+consumed document to disk. If the cursor fails with a transient error, it is
+reopened after the last consumed document; if the scan is interrupted
+altogether, running it again resumes it from its last checkpoint. Documents
+are delivered at least once: those consumed after the last checkpoint are
+delivered again after a hard interruption.
+"""
+
+import os
+import time
+
+from valve.shared import SHLEEM_DIR_PATH
+from valve.cache import safe_dirname
+from valve.docfile import (
+    DOCFILE_EXT,
+    write_documents,
+    read_documents,
+)
+from .pagination import (
+    DEFAULT_SORT_KEY,
+    keyset_query,
+)
+from .documents import (
+    get_field,
+    paging_projection,
+)
+
+
+SHLEEM_CHECKPOINT_DIR_NAME = 'checkpoints'
+SHLEEM_CHECKPOINT_DIR_PATH = os.path.join(
+    SHLEEM_DIR_PATH, SHLEEM_CHECKPOINT_DIR_NAME)
+DEFAULT_CHECKPOINT_EVERY = 10000
+DEFAULT_MAX_RETRIES = 5
+DEFAULT_RETRY_DELAY = 1
+MAX_RETRY_DELAY = 60
+
+
+def checkpoint_path(identifier, query_hash, checkpoint_dir=None):
+    """Returns the path of the checkpoint file of the given scan."""
+    if checkpoint_dir is None:
+        checkpoint_dir = SHLEEM_CHECKPOINT_DIR_PATH
+    return os.path.join(
+        checkpoint_dir, safe_dirname(identifier), query_hash + DOCFILE_EXT)
+
+
+def load_checkpoint(fpath):
+    """Returns the state saved in the given checkpoint file, or None if there
+    is no such file."""
+    try:
+        for state in read_documents(fpath):
+            return state
+    except FileNotFoundError:
+        return None
+    return None  # pragma: no cover
+
+
+def remove_checkpoint(fpath):
+    """Removes the given checkpoint file, if it exists."""
+    try:
+        os.remove(fpath)
+    except FileNotFoundError:
+        pass
+
+
+def is_transient(error):
+    """Returns True if the given error is a transient pymongo error, after
+    which a scan can be resumed by reopening its cursor."""
+    from pymongo.errors import (
+        PyMongoError,
+        ConnectionFailure,
+        CursorNotFound,
+    )
+    if isinstance(error, (ConnectionFailure, CursorNotFound)):
+        return True
+    return isinstance(error, PyMongoError) and (
+        error.has_error_label('RetryableError') or
+        error.has_error_label('ResumableChangeStreamError'))
+
+
+def resumable_find(col_obj, query, checkpoint_fpath, projection=None,
+                   sort_key=None, checkpoint_every=None, max_retries=None,
+                   retry_delay=None, restart=False):
+    """Yields the results of a find query in sort key order, checkpointing
+    progress to disk and recovering from transient errors.
+
+    Arguments
+    ---------
+    col_obj : pymongo.collection.Collection
+        The collection to query.
+    query : dict
+        A resolved pymongo-compliant MongoDB query.
+    checkpoint_fpath : str
+        The path of the checkpoint file of this scan. If it exists, the scan
+        resumes after the document it points to. It is removed once the scan
+        is complete.
+    projection : list or dict, optional
+        A projection to apply to the results.
+    sort_key : str, optional
+        The name of the field to scan by, which should be indexed. Ties are
+        broken by _id. All matching documents must hold a value of the same
+        type in this field. Defaults to '_id'.
+    checkpoint_every : int, optional
+        The number of consumed documents between checkpoints. Defaults to
+        10000. A checkpoint is also saved whenever the scan fails or is
+        closed before completion.
+    max_retries : int, optional
+        The maximal number of consecutive transient errors recovered from
+        before failing. Defaults to 5.
+    retry_delay : float, optional
+        The delay, in seconds, before the first retry. Delays double on each
+        consecutive retry, up to a minute. Defaults to 1.
+    restart : bool, optional
+        If True, any existing checkpoint is ignored, and the scan starts from
+        the first document. Defaults to False.
+    """
+    if sort_key is None:
+        sort_key = DEFAULT_SORT_KEY
+    if checkpoint_every is None:
+        checkpoint_every = DEFAULT_CHECKPOINT_EVERY
+    if max_retries is None:
+        max_retries = DEFAULT_MAX_RETRIES
+    if retry_delay is None:
+        retry_delay = DEFAULT_RETRY_DELAY
+    state = None
+    if not restart:
+        state = load_checkpoint(checkpoint_fpath)
+        if state is not None and state['key'] != sort_key:
+            raise ValueError((
+                "The checkpoint at {} was saved for a scan by {}, not by "
+                "{}.").format(checkpoint_fpath, state['key'], sort_key))
+    if state is None:
+        state = {'key': sort_key, 'value': None, 'id': None, 'count': 0}
+    scan_projection, strip = paging_projection(projection, sort_key)
+    sort = [(sort_key, 1)]
+    if sort_key != '_id':
+        sort.append(('_id', 1))
+    saved_count = state['count']
+
+    def _save():
+        write_documents(checkpoint_fpath, [state])
+
+    retries = 0
+    cursor = None
+    try:
+        while True:
+            scan_query = query
+            if state['id'] is not None:
+                scan_query = keyset_query(
+                    query, sort_key, state['value'], state['id'])
+            cursor = col_obj.find(
+                filter=scan_query, projection=scan_projection, sort=sort)
+            try:
+                for document in cursor:
+                    retries = 0
+                    value = get_field(document, sort_key)
+                    _id = document['_id']
+                    for key in strip:
+                        document.pop(key, None)
+                    yield document
+                    # the consumer asked for the next document, so this one
+                    # was consumed
+                    state['value'] = value
+                    state['id'] = _id
+                    state['count'] += 1
+                    if state['count'] - saved_count >= checkpoint_every:
+                        _save()
+                        saved_count = state['count']
+                break
+            except Exception as error:
+                if not is_transient(error) or retries >= max_retries:
+                    raise
+                time.sleep(min(retry_delay * 2 ** retries, MAX_RETRY_DELAY))
+                retries += 1
+            finally:
+                cursor.close()
+    except BaseException:
+        if state['count'] > saved_count:
+            _save()
+        raise
+    remove_checkpoint(checkpoint_fpath)
@@ -0,0 +1,92 @@
+"""Read preference routing of MongoDB reads across replica set members.
+
+Read preferences are given either as the name of a read preference mode, e.g.
+'secondaryPreferred', or as a dict with the following keys:
+
+- mode: The name of the read preference mode. Required.
+- tag_sets: A list of tag sets, each a dict of replica set member tags, tried
+  in order until members matching one of them are found.
+- max_staleness: The maximal replication lag, in seconds, of secondaries
+  read from.
+- latency_window_ms: The size, in milliseconds, of the latency window of
+  members eligible for reads, above the fastest eligible member. As it is a
+  setting of MongoDB clients, it can only be set per server.
+"""
+
+READ_PREFERENCE_MODES = (
+    'primary', 'primaryPreferred', 'secondary', 'secondaryPreferred',
+    'nearest',
+)
+
+_SPEC_KEYS = ('mode', 'tag_sets', 'max_staleness', 'latency_window_ms')
+
+
+def _mode_class(mode):
+    from pymongo import read_preferences
+    normalized = mode.replace('_', '').lower()
+    for name in READ_PREFERENCE_MODES:
+        if name.lower() == normalized:
+            return getattr(read_preferences, name[0].upper() + name[1:])
+    raise ValueError("Unknown read preference mode {!r}; supported modes "
+                     "are {}.".format(mode, ', '.join(READ_PREFERENCE_MODES)))
+
+
+def parse_read_preference(spec):
+    """Returns the pymongo read preference described by the given
+    specification.
+
+    Arguments
+    ---------
+    spec : str, dict or pymongo read preference
+        The name of a read preference mode, or a dict with mode, tag_sets and
+        max_staleness keys. pymongo read preference objects are returned as
+        they are.
+
+    Returns
+    -------
+    pymongo.read_preferences.ServerMode
+        The described read preference.
+
+    Raises
+    ------
+    ValueError
+        If the given specification is invalid, or sets a latency window.
+    """
+    if isinstance(spec, str):
+        return _mode_class(spec)()
+    if not isinstance(spec, dict):
+        if hasattr(spec, 'mongos_mode'):
+            return spec
+        raise ValueError("Invalid read preference {!r}.".format(spec))
+    unknown = [key for key in spec if key not in _SPEC_KEYS]
+    if unknown or 'mode' not in spec:
+        raise ValueError((
+            "Invalid read preference {!r}; read preferences are given by "
+            "mode, tag_sets, max_staleness and latency_window_ms.").format(
+                spec))
+    if 'latency_window_ms' in spec:
+        raise ValueError(
+            "A latency window can only be set per server, in valve's MongoDB "
+            "credentials file.")
+    mode_class = _mode_class(spec['mode'])
+    options = {}
+    if 'tag_sets' in spec:
+        options['tag_sets'] = spec['tag_sets']
+    if 'max_staleness' in spec:
+        options['max_staleness'] = spec['max_staleness']
+    try:
+        return mode_class(**options)
+    except TypeError as error:
+        raise ValueError("Invalid read preference {!r}: {}".format(
+            spec, error))
+
+
+def client_options(spec):
+    """Returns the pymongo client keyword arguments applying the given read
+    preference specification, which may set a latency window."""
+    options = {}
+    if isinstance(spec, dict) and 'latency_window_ms' in spec:
+        spec = dict(spec)
+        options['localThresholdMS'] = spec.pop('latency_window_ms')
+    options['read_preference'] = parse_read_preference(spec)
+    return options
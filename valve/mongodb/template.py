@@ -0,0 +1,93 @@
+"""Compiled templates of parameterized MongoDB queries and pipelines."""
+
+_LEAF = None
+
+
+def _callable_paths(obj, prefix=()):
+    if isinstance(obj, dict):
+        items = obj.items()
+    elif isinstance(obj, (list, tuple)):
+        items = enumerate(obj)
+    else:
+        return []
+    paths = []
+    for key, value in items:
+        if callable(value):
+            paths.append(prefix + (key,))
+        elif isinstance(value, (dict, list, tuple)):
+            paths.extend(_callable_paths(value, prefix + (key,)))
+    return paths
+
+
+def _build_trie(paths):
+    trie = {}
+    for path in paths:
+        node = trie
+        for key in path[:-1]:
+            node = node.setdefault(key, {})
+        node[path[-1]] = _LEAF
+    return trie
+
+
+def _resolve_value(value, kwargs):
+    resolved = value(**kwargs)
+    # callables may return structures containing further callables
+    paths = _callable_paths(resolved)
+    if paths:
+        return _rebuild(resolved, _build_trie(paths), kwargs)
+    return resolved
+
+
+def _rebuild(obj, trie, kwargs):
+    if isinstance(obj, dict):
+        new = dict(obj)
+    else:
+        new = list(obj)
+    for key, subtrie in trie.items():
+        if subtrie is _LEAF:
+            new[key] = _resolve_value(obj[key], kwargs)
+        else:
+            new[key] = _rebuild(obj[key], subtrie, kwargs)
+    return new
+
+
+class QueryTemplate(object):
+    """A MongoDB query or aggregation pipeline, compiled for fast resolution.
+
+    The paths to all callables in the query are found once, on construction.
+    Resolving the template then only calls these callables and shallow-copies
+    the containers along their paths, while all other branches of the
+    resolved query are shared with the template, and so must not be mutated.
+
+    Arguments
+    ---------
+    query : dict or list
+        A pymongo-compliant MongoDB query or aggregation pipeline, possibly
+        containing callables, at any depth, as parameter placeholders.
+    """
+
+    def __init__(self, query):
+        self.query = query
+        self.paths = _callable_paths(query)
+        self._trie = _build_trie(self.paths)
+
+    def __repr__(self):
+        return "QueryTemplate: {} with {} parameter(s)".format(
+            self.query, len(self.paths))
+
+    @property
+    def is_static(self):
+        """True if this template contains no callables."""
+        return not self.paths
+
+    def resolve(self, **kwargs):
+        """Returns the query of this template, with each callable replaced by
+        the result of calling it with the given keyword arguments.
+
+        Only the containers on the paths to callables are rebuilt: all other
+        branches are shared with the query of this template, which is itself
+        returned if it holds no callables. The result must thus be copied,
+        e.g. with copy.deepcopy, before it is modified in place."""
+        if not self._trie:
+            return self.query
+        return _rebuild(self.query, self._trie, kwargs)
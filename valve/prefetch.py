@@ -0,0 +1,132 @@
+"""Background prefetching of tapped documents."""
+
+import queue
+import weakref
+import threading
+
+from .merge import (
+    put_unless_stopped,
+    Failure,
+    DONE,
+)
+
+
+DEFAULT_DEPTH = 2
+DEFAULT_BATCH_SIZE = 1000
+
+
+def _prefetch(iterator, batch_size, out_queue, stop_event):
+    try:
+        batch = []
+        for item in iterator:
+            batch.append(item)
+            if len(batch) >= batch_size:
+                if not put_unless_stopped(out_queue, batch, stop_event):
+                    return
+                batch = []
+        if batch and not put_unless_stopped(out_queue, batch, stop_event):
+            return
+    except Exception as exc:  # pylint: disable=W0703
+        put_unless_stopped(out_queue, Failure(exc), stop_event)
+    finally:
+        close = getattr(iterator, 'close', None)
+        if close is not None:
+            close()
+        put_unless_stopped(out_queue, DONE, stop_event)
+
+
+def _stop(stop_event, out_queue):
+    stop_event.set()
+    # unblock the worker if waiting on a full queue
+    while True:
+        try:
+            out_queue.get_nowait()
+        except queue.Empty:
+            break
+
+
+class PrefetchingIterator(object):
+    """Iterates over an iterator, fetching its items ahead of the consumer on
+    a background thread.
+
+    Items are fetched in batches into a bounded queue of batches, so that the
+    latency of fetching the next batches, e.g. over the network, overlaps
+    with the work done by the consumer on the current one, while the worker
+    blocks once the queue is full. Exceptions raised by the wrapped iterator
+    are re-raised in the consuming thread. Closing the prefetching iterator,
+    exiting it as a context manager or garbage collecting it stops the
+    worker, which closes the wrapped iterator, if it has a close method (as
+    pymongo cursors do).
+
+    Arguments
+    ---------
+    iterator : iterable
+        The iterable to prefetch the items of.
+    depth : int, optional
+        The maximal number of batches fetched ahead of the consumer. Defaults
+        to 2.
+    batch_size : int, optional
+        The number of items per batch. Defaults to 1000.
+    """
+
+    def __init__(self, iterator, depth=None, batch_size=None):
+        if depth is None:
+            depth = DEFAULT_DEPTH
+        if batch_size is None:
+            batch_size = DEFAULT_BATCH_SIZE
+        self.depth = depth
+        self.batch_size = batch_size
+        self._queue = queue.Queue(maxsize=depth)
+        self._stop_event = threading.Event()
+        self._batch = iter(())
+        self._done = False
+        self._worker = threading.Thread(
+            target=_prefetch, daemon=True,
+            args=(iter(iterator), batch_size, self._queue, self._stop_event))
+        self._worker.start()
+        self._finalizer = weakref.finalize(
+            self, _stop, self._stop_event, self._queue)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        while True:
+            try:
+                return next(self._batch)
+            except StopIteration:
+                pass
+            if self._done:
+                raise StopIteration
+            batch = self._queue.get()
+            if batch is DONE:
+                self._done = True
+                self._finalizer()
+            elif isinstance(batch, Failure):
+                self._done = True
+                self._finalizer()
+                raise batch.exception
+            else:
+                self._batch = iter(batch)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self, timeout=None):
+        """Stops prefetching, discarding all prefetched items, and waits for
+        the worker to close the wrapped iterator.
+
+        Arguments
+        ---------
+        timeout : float, optional
+            The maximal time, in seconds, to wait for the worker, which may
+            be in the middle of fetching a batch. Waits until it is done if
+            not given.
+        """
+        self._done = True
+        self._batch = iter(())
+        self._finalizer()
+        self._worker.join(timeout)
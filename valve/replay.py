@@ -0,0 +1,156 @@
+"""Recording and replaying of tap outputs, for offline, deterministic runs.
+
+When a replay mode is set, taps of replayable DataTaps, like MongoDB queries
+and aggregations, are served from recordings of their output, stored as BSON
+files keyed by the identifier of the tapped DataTap and a stable hash of the
+resolved request (see DataTap.tap_key). Recordings are streamed to disk as
+the tap output is consumed, and are only kept once it is fully consumed.
+
+The replay mode is set globally, either by the SHLEEM_REPLAY_MODE environment
+variable or, taking precedence, with the replay_mode context manager. The
+supported modes are:
+
+- 'auto': Taps are replayed if recorded, and recorded otherwise.
+- 'record': Taps are always run, and recorded, overwriting recordings.
+- 'replay': Taps are always replayed; a MissingRecordingException is raised
+  for taps that were not recorded.
+- 'off': Taps are run as usual. The default.
+
+Tap methods whose output is derived from the output of the tap method, like
+tap_arrow or tap_many, are run over the replayable tap method whenever a
+replay mode is set, so they are recorded and replayed with it. Methods that
+cannot be, like paginated, resumable or live taps, are decorated with
+not_replayable, and raise a MissingRecordingException in 'replay' mode instead
+of connecting to their data source.
+
+Recordings are stored in the folder given by the SHLEEM_REPLAY_DIR environment
+variable, or by the replay_mode context manager, and otherwise in a
+'recordings' folder inside the .valve folder in your home folder.
+"""
+
+import os
+import functools
+import threading
+import contextlib
+
+from .shared import SHLEEM_DIR_PATH
+from .exceptions import MissingRecordingException
+
+
+SHLEEM_RECORDINGS_DIR_NAME = 'recordings'
+SHLEEM_RECORDINGS_DIR_PATH = os.path.join(
+    SHLEEM_DIR_PATH, SHLEEM_RECORDINGS_DIR_NAME)
+REPLAY_MODE_ENV_VAR = 'SHLEEM_REPLAY_MODE'
+REPLAY_DIR_ENV_VAR = 'SHLEEM_REPLAY_DIR'
+REPLAY_MODES = ('auto', 'record', 'replay', 'off')
+
+_LOCK = threading.Lock()
+_MODE_STACK = []
+
+
+def _check_mode(mode):
+    if mode not in REPLAY_MODES:
+        raise ValueError("Unknown replay mode {!r}; supported modes are "
+                         "{}.".format(mode, ', '.join(REPLAY_MODES)))
+
+
+def current_mode():
+    """Returns the current replay mode and recordings folder, as a tuple."""
+    with _LOCK:
+        if _MODE_STACK:
+            return _MODE_STACK[-1]
+    mode = os.environ.get(REPLAY_MODE_ENV_VAR) or 'off'
+    _check_mode(mode)
+    replay_dir = os.environ.get(
+        REPLAY_DIR_ENV_VAR) or SHLEEM_RECORDINGS_DIR_PATH
+    return mode, replay_dir
+
+
+@contextlib.contextmanager
+def replay_mode(mode='auto', replay_dir=None):
+    """Sets the replay mode of all threads inside the managed block, taking
+    precedence over the SHLEEM_REPLAY_MODE environment variable.
+
+    Arguments
+    ---------
+    mode : str, optional
+        One of 'auto', 'record', 'replay' and 'off'. Defaults to 'auto'.
+    replay_dir : str, optional
+        The folder in which recordings are stored. Defaults to the folder set
+        by the SHLEEM_REPLAY_DIR environment variable, if set, and otherwise
+        to a 'recordings' folder inside the .valve folder in your home
+        folder.
+    """
+    _check_mode(mode)
+    if replay_dir is None:
+        replay_dir = os.environ.get(
+            REPLAY_DIR_ENV_VAR) or SHLEEM_RECORDINGS_DIR_PATH
+    with _LOCK:
+        _MODE_STACK.append((mode, replay_dir))
+    try:
+        yield
+    finally:
+        with _LOCK:
+            _MODE_STACK.remove((mode, replay_dir))
+
+
+def replay_enabled():
+    """Returns True if a replay mode other than 'off' is set."""
+    return current_mode()[0] != 'off'
+
+
+def recording_path(data_tap, replay_dir=None, **kwargs):
+    """Returns the path of the recording of tapping the given DataTap with
+    the given keyword arguments."""
+    from .cache import safe_dirname
+    from .docfile import DOCFILE_EXT
+    if replay_dir is None:
+        replay_dir = current_mode()[1]
+    return os.path.join(
+        replay_dir, safe_dirname(data_tap.identifier),
+        data_tap.tap_hash(**kwargs) + DOCFILE_EXT)
+
+
+def replayable(tap_method):
+    """Decorates the tap method of a DataTap, so that its output is recorded
+    and replayed according to the current replay mode.
+
+    Only keyword arguments are passed to the tap_hash method of the DataTap
+    to key recordings.
+    """
+
+    @functools.wraps(tap_method)
+    def _tap(self, *args, **kwargs):
+        mode, replay_dir = current_mode()
+        if mode == 'off':
+            return tap_method(self, *args, **kwargs)
+        from .docfile import (
+            read_documents,
+            record_documents,
+        )
+        fpath = recording_path(self, replay_dir, **kwargs)
+        if mode != 'record' and os.path.isfile(fpath):
+            return read_documents(fpath)
+        if mode == 'replay':
+            raise MissingRecordingException(
+                "No recording of {} was found at {}.".format(
+                    self.identifier, fpath))
+        return record_documents(fpath, tap_method(self, *args, **kwargs))
+    return _tap
+
+
+def not_replayable(method):
+    """Decorates a method of a DataTap that reads its data source without
+    going through a replayable tap method, so that it raises a
+    MissingRecordingException in 'replay' mode instead of reading it. The
+    check is made when the method is called, also for generator methods."""
+
+    @functools.wraps(method)
+    def _method(self, *args, **kwargs):
+        if current_mode()[0] == 'replay':
+            raise MissingRecordingException(
+                "{} of {} cannot be replayed, as it is never recorded; only "
+                "replayable taps are.".format(
+                    method.__name__, self.identifier))
+        return method(self, *args, **kwargs)
+    return _method
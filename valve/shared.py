@@ -1,12 +1,37 @@
 """Shared functionalities for the valve package."""
 
 import os
+import json
+import hashlib
 
 
 HOMEDIR = os.path.expanduser("~")
 SHLEEM_DIR_NAME = '.valve'
 SHLEEM_DIR_PATH = os.path.join(HOMEDIR, SHLEEM_DIR_NAME)
-os.makedirs(SHLEEM_DIR_PATH, exist_ok=True)
 
 SHLEEM_CFG_FNAME = 'config.json'
 SHLEEM_CFG_FPATH = os.path.join(SHLEEM_DIR_PATH, SHLEEM_CFG_FNAME)
+
+
+def key_hash(obj):
+    """Computes a cross-process stable hex digest for a query-like object.
+
+    Unlike strct.hash.stable_hash, the digest is sensitive to the order of
+    list items and dict keys, so that, for example, two aggregation pipelines
+    with the same stages in a different order are not confused. Values that
+    are not JSON-serializable (e.g. ObjectId or datetime objects) are
+    represented by their repr.
+
+    Arguments
+    ---------
+    obj : object
+        A JSON-like object, such as a resolved MongoDB query.
+
+    Returns
+    -------
+    str
+        A hex digest of the given object.
+    """
+    encoded = json.dumps(
+        obj, sort_keys=False, separators=(',', ':'), default=repr)
+    return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
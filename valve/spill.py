@@ -0,0 +1,260 @@
+"""A memory-bounded document buffer, spilling to disk.
+
+Documents are kept in memory, BSON-encoded, until a memory budget is hit,
+and are then spilled to disk in chunks, as BSON document files in a temporary
+directory. The buffered documents can be iterated over any number of times,
+sorted with an external merge sort and shuffled with an external shuffle,
+with at most about one chunk of documents decoded in memory at a time.
+"""
+
+import os
+import heapq
+import random
+import struct
+import shutil
+import weakref
+import tempfile
+
+from bson import BSON
+
+from .shared import SHLEEM_DIR_PATH
+from .docfile import (
+    DOCFILE_EXT,
+    read_documents,
+)
+
+
+SHLEEM_SPILL_DIR_NAME = 'spill'
+SHLEEM_SPILL_DIR_PATH = os.path.join(SHLEEM_DIR_PATH, SHLEEM_SPILL_DIR_NAME)
+DEFAULT_MEMORY_BUDGET = 256 * 2 ** 20
+
+
+def _field_key(field):
+    from .mongodb.documents import (
+        get_field,
+        sort_key,
+    )
+
+    def _key(document):
+        return sort_key(get_field(document, field))
+    return _key
+
+
+def _read_raw(fpath):
+    """Yields the BSON-encoded documents stored in the given BSON file, one by
+    one, without decoding them."""
+    with open(fpath, 'rb') as docfile:
+        while True:
+            size_bytes = docfile.read(4)
+            if not size_bytes:
+                return
+            size = struct.unpack('<i', size_bytes)[0]
+            yield size_bytes + docfile.read(size - 4)
+
+
+def _write_raw(fpath, raw_documents):
+    with open(fpath, 'wb') as docfile:
+        for raw in raw_documents:
+            docfile.write(raw)
+
+
+class SpillBuffer(object):
+    """A memory-bounded buffer of documents, spilling to disk.
+
+    Arguments
+    ---------
+    memory_budget : int, optional
+        The maximal total size, in bytes, of the BSON-encoded documents kept
+        in memory. Once exceeded, buffered documents are spilled to disk as a
+        chunk. Defaults to 256 MiB.
+    spill_dir : str, optional
+        The directory in which spilled chunks are stored, in a temporary
+        sub-directory removed when the buffer is closed or garbage collected.
+        Defaults to a 'spill' folder inside the .valve folder in your home
+        folder.
+    """
+
+    def __init__(self, memory_budget=None, spill_dir=None):
+        if memory_budget is None:
+            memory_budget = DEFAULT_MEMORY_BUDGET
+        if spill_dir is None:
+            spill_dir = SHLEEM_SPILL_DIR_PATH
+        self.memory_budget = memory_budget
+        self.spill_dir = spill_dir
+        self._raw = []
+        self._raw_size = 0
+        self._chunks = []
+        self._num_documents = 0
+        self._num_bytes = 0
+        self._tmp_dir = None
+        self._num_files = 0
+        self._finalizer = None
+
+    def __repr__(self):
+        return "SpillBuffer: {} documents, {} spilled chunks".format(
+            self._num_documents, len(self._chunks))
+
+    def __len__(self):
+        return self._num_documents
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    @property
+    def num_spilled_chunks(self):
+        """The number of chunks spilled to disk."""
+        return len(self._chunks)
+
+    def _new_path(self):
+        if self._tmp_dir is None:
+            os.makedirs(self.spill_dir, exist_ok=True)
+            self._tmp_dir = tempfile.mkdtemp(dir=self.spill_dir)
+            self._finalizer = weakref.finalize(
+                self, shutil.rmtree, self._tmp_dir, ignore_errors=True)
+        self._num_files += 1
+        return os.path.join(
+            self._tmp_dir, '{}{}'.format(self._num_files, DOCFILE_EXT))
+
+    def _spill(self):
+        fpath = self._new_path()
+        _write_raw(fpath, self._raw)
+        self._chunks.append(fpath)
+        self._raw = []
+        self._raw_size = 0
+
+    def append(self, document):
+        """Adds the given document to the end of the buffer."""
+        raw = BSON.encode(document)
+        self._raw.append(raw)
+        self._raw_size += len(raw)
+        self._num_documents += 1
+        self._num_bytes += len(raw)
+        if self._raw_size > self.memory_budget:
+            self._spill()
+
+    def extend(self, documents):
+        """Adds the given documents to the end of the buffer."""
+        for document in documents:
+            self.append(document)
+
+    def _iter_memory(self):
+        for raw in list(self._raw):
+            yield BSON(raw).decode()
+
+    def __iter__(self):
+        """Iterates over the buffered documents, in insertion order."""
+        for fpath in list(self._chunks):
+            for document in read_documents(fpath):
+                yield document
+        for document in self._iter_memory():
+            yield document
+
+    def _sorted_runs(self, key, reverse):
+        runs = []
+        for fpath in self._chunks:
+            documents = sorted(
+                read_documents(fpath), key=key, reverse=reverse)
+            run_fpath = self._new_path()
+            _write_raw(run_fpath, (BSON.encode(doc) for doc in documents))
+            runs.append(run_fpath)
+        return runs
+
+    def sorted(self, key, reverse=False):
+        """Iterates over the buffered documents in sorted order.
+
+        If any documents were spilled, each spilled chunk is sorted into a
+        sorted run on disk, and runs are merged lazily. The sort is stable.
+
+        Arguments
+        ---------
+        key : callable or str
+            A function computing the sort key of a document, or the name of a
+            field to sort by, with dotted paths supported. Values of different
+            types are ordered by field as MongoDB orders them.
+        reverse : bool, optional
+            If True, documents are sorted in descending order. Defaults to
+            False.
+
+        Yields
+        ------
+        dict
+            The buffered documents, in sorted order.
+        """
+        if isinstance(key, str):
+            key = _field_key(key)
+        in_memory = sorted(self._iter_memory(), key=key, reverse=reverse)
+        if not self._chunks:
+            for document in in_memory:
+                yield document
+            return
+        runs = self._sorted_runs(key, reverse)
+        try:
+            iterators = [read_documents(fpath) for fpath in runs]
+            iterators.append(iter(in_memory))
+            for document in heapq.merge(
+                    *iterators, key=key, reverse=reverse):
+                yield document
+        finally:
+            for fpath in runs:
+                os.remove(fpath)
+
+    def shuffled(self, seed=None):
+        """Iterates over the buffered documents in a uniformly random order.
+
+        If any documents were spilled, each document is first assigned to a
+        random bucket on disk, with buckets about half the memory budget in
+        size, and buckets are then shuffled and yielded one at a time.
+
+        Arguments
+        ---------
+        seed : int, optional
+            The seed of the random permutation, for reproducible shuffles.
+
+        Yields
+        ------
+        dict
+            The buffered documents, in random order.
+        """
+        rng = random.Random(seed)
+        if not self._chunks:
+            raw_documents = list(self._raw)
+            rng.shuffle(raw_documents)
+            for raw in raw_documents:
+                yield BSON(raw).decode()
+            return
+        num_buckets = 2 * (self._num_bytes // self.memory_budget + 1)
+        buckets = [self._new_path() for _ in range(num_buckets)]
+        files = [open(fpath, 'wb') for fpath in buckets]
+        try:
+            try:
+                for fpath in self._chunks:
+                    for raw in _read_raw(fpath):
+                        rng.choice(files).write(raw)
+                for raw in self._raw:
+                    rng.choice(files).write(raw)
+            finally:
+                for bucket_file in files:
+                    bucket_file.close()
+            for fpath in buckets:
+                raw_documents = list(_read_raw(fpath))
+                rng.shuffle(raw_documents)
+                for raw in raw_documents:
+                    yield BSON(raw).decode()
+        finally:
+            for fpath in buckets:
+                os.remove(fpath)
+
+    def close(self):
+        """Discards all buffered documents and removes spilled chunks."""
+        self._raw = []
+        self._raw_size = 0
+        self._chunks = []
+        self._num_documents = 0
+        self._num_bytes = 0
+        if self._finalizer is not None:
+            self._finalizer()
+            self._finalizer = None
+            self._tmp_dir = None
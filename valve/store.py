@@ -0,0 +1,459 @@
+"""A versioned Parquet store of tapped datasets.
+
+Requires pyarrow.
+"""
+
+import os
+import json
+import uuid
+import shutil
+import datetime
+import itertools
+
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from bson import json_util
+
+from .shared import SHLEEM_DIR_PATH
+from .cache import safe_dirname
+
+
+SHLEEM_STORE_DIR_NAME = 'datasets'
+SHLEEM_STORE_DIR_PATH = os.path.join(SHLEEM_DIR_PATH, SHLEEM_STORE_DIR_NAME)
+MANIFEST_FNAME = 'manifest.json'
+DEFAULT_COMPRESSION = 'zstd'
+DEFAULT_MAX_ROWS_PER_FILE = 1000000
+VERSION_DIR_TEMPLATE = 'v{}'
+
+
+def _identifier_of(dataset):
+    try:
+        return dataset.identifier
+    except AttributeError:
+        return dataset
+
+
+def _next_version(manifest):
+    """Returns the number of the next version of a dataset, never reissuing
+    the number of a removed version."""
+    next_version = manifest.get('next_version', 1)
+    for entry in manifest['versions']:
+        next_version = max(next_version, entry['version'] + 1)
+    return next_version
+
+
+def _jsonable(obj):
+    return json.loads(json.dumps(obj, default=repr))
+
+
+def _link_tree(src_dir, dst_dir):
+    """Hard-links all files under src_dir into dst_dir, copying them where
+    hard links are not supported."""
+    for dirpath, _, fnames in os.walk(src_dir):
+        target_dir = os.path.join(dst_dir, os.path.relpath(dirpath, src_dir))
+        os.makedirs(target_dir, exist_ok=True)
+        for fname in fnames:
+            src = os.path.join(dirpath, fname)
+            dst = os.path.join(target_dir, fname)
+            try:
+                os.link(src, dst)
+            except OSError:  # pragma: no cover
+                shutil.copy2(src, dst)
+
+
+def _count_rows(record_batches, counter):
+    for record_batch in record_batches:
+        counter[0] += record_batch.num_rows
+        yield record_batch
+
+
+class DatasetStore(object):
+    """A versioned store of tapped datasets, persisted as Parquet files.
+
+    Each DataTap gets a directory named by its identifier, holding a folder
+    of compressed Parquet files per stored version of its dataset, and a
+    manifest describing all versions: the hash and key of the resolved request
+    that produced it (see DataTap.tap_key), its row count and its creation
+    time. Downstream jobs can then load a pinned version, using
+    memory-mapped reads, instead of re-tapping the data source.
+
+    Arguments
+    ---------
+    store_dir : str, optional
+        The directory in which datasets are stored. Defaults to a 'datasets'
+        folder inside the .valve folder in your home folder.
+    compression : str, optional
+        The Parquet compression codec to use. Defaults to 'zstd'.
+    max_rows_per_file : int, optional
+        The maximal number of rows per Parquet file. Defaults to 1000000.
+    """
+
+    def __init__(self, store_dir=None, compression=None,
+                 max_rows_per_file=None):
+        if store_dir is None:
+            store_dir = SHLEEM_STORE_DIR_PATH
+        if compression is None:
+            compression = DEFAULT_COMPRESSION
+        if max_rows_per_file is None:
+            max_rows_per_file = DEFAULT_MAX_ROWS_PER_FILE
+        self.store_dir = store_dir
+        self.compression = compression
+        self.max_rows_per_file = max_rows_per_file
+
+    def __repr__(self):
+        return "DatasetStore: {}".format(self.store_dir)
+
+    def _dataset_dir(self, dataset):
+        return os.path.join(
+            self.store_dir, safe_dirname(_identifier_of(dataset)))
+
+    def _manifest_path(self, dataset):
+        return os.path.join(self._dataset_dir(dataset), MANIFEST_FNAME)
+
+    def _read_manifest(self, dataset):
+        try:
+            with open(self._manifest_path(dataset), 'r') as manifest_file:
+                return json.load(manifest_file)
+        except FileNotFoundError:
+            return {'identifier': _identifier_of(dataset), 'versions': [],
+                    'next_version': 1}
+
+    def _write_manifest(self, dataset, manifest):
+        fpath = self._manifest_path(dataset)
+        tmp_fpath = '{}.{}.tmp'.format(fpath, uuid.uuid4().hex)
+        with open(tmp_fpath, 'w') as manifest_file:
+            json.dump(manifest, manifest_file, indent=2)
+        os.replace(tmp_fpath, fpath)
+
+    def versions(self, dataset):
+        """Returns the manifest entries of all stored versions of a dataset.
+
+        Arguments
+        ---------
+        dataset : valve.DataTap or str
+            A DataTap, or the identifier of one.
+
+        Returns
+        -------
+        list of dict
+            A list of version entries, ordered from oldest to newest.
+        """
+        return self._read_manifest(dataset)['versions']
+
+    def version_info(self, dataset, version=None):
+        """Returns the manifest entry of a stored version of a dataset.
+
+        Arguments
+        ---------
+        dataset : valve.DataTap or str
+            A DataTap, or the identifier of one.
+        version : int, optional
+            The version number. Defaults to the latest version.
+
+        Returns
+        -------
+        dict
+            The manifest entry of the requested version.
+        """
+        versions = self.versions(dataset)
+        if not versions:
+            raise KeyError("No stored versions for dataset {}.".format(
+                _identifier_of(dataset)))
+        if version is None:
+            return versions[-1]
+        for entry in versions:
+            if entry['version'] == version:
+                return entry
+        raise KeyError("No version {} stored for dataset {}.".format(
+            version, _identifier_of(dataset)))
+
+    def find_version(self, data_tap, **kwargs):
+        """Returns the manifest entry of the latest stored version produced by
+        tapping the given DataTap with the given keyword arguments, or None
+        if there is no such version."""
+        tap_hash = data_tap.tap_hash(**kwargs)
+        for entry in reversed(self.versions(data_tap)):
+            if entry['tap_hash'] == tap_hash:
+                return entry
+        return None
+
+    def write_batches(self, dataset, record_batches, tap_hash=None,
+                      tap_key=None, partition_cols=None, schema=None,
+                      base_version=None, extra=None):
+        """Stores a stream of Arrow record batches as a new dataset version.
+
+        If a base version is given, the new version holds all files of the
+        base version, hard-linked rather than copied, and the given batches
+        are appended to them.
+
+        Arguments
+        ---------
+        dataset : valve.DataTap or str
+            A DataTap, or the identifier of one.
+        record_batches : iterable of pyarrow.RecordBatch
+            The record batches to store.
+        tap_hash : str, optional
+            The hash of the resolved request that produced the batches.
+        tap_key : object, optional
+            The resolved request that produced the batches.
+        partition_cols : list of str, optional
+            Columns by which to partition the stored files, using Hive-style
+            directory partitioning.
+        schema : pyarrow.Schema, optional
+            The schema of the batches. If not given, the schema of the base
+            version or of the first batch is used.
+        base_version : int, optional
+            The number of a stored version to append the batches to.
+        extra : dict, optional
+            Extra JSON-serializable fields to record in the manifest entry.
+
+        Returns
+        -------
+        dict
+            The manifest entry of the new version.
+        """
+        record_batches = iter(record_batches)
+        base = None
+        if base_version is not None:
+            base = self.version_info(dataset, base_version)
+            partition_cols = base['partition_cols']
+            if schema is None and base['schema'] is not None:
+                schema = self.dataset(dataset, base_version).schema
+        if schema is None:
+            first = next(record_batches, None)
+            if first is not None:
+                schema = first.schema
+                record_batches = itertools.chain([first], record_batches)
+        dataset_dir = self._dataset_dir(dataset)
+        os.makedirs(dataset_dir, exist_ok=True)
+        tmp_dir = os.path.join(
+            dataset_dir, '.tmp-{}'.format(uuid.uuid4().hex))
+        counter = [0]
+        try:
+            os.makedirs(tmp_dir)
+            if base is not None:
+                _link_tree(os.path.join(dataset_dir, base['path']), tmp_dir)
+                counter[0] = base['num_rows']
+            if schema is not None:
+                file_format = ds.ParquetFileFormat()
+                ds.write_dataset(
+                    data=_count_rows(record_batches, counter),
+                    base_dir=tmp_dir,
+                    schema=schema,
+                    format=file_format,
+                    file_options=file_format.make_write_options(
+                        compression=self.compression),
+                    partitioning=partition_cols,
+                    partitioning_flavor='hive' if partition_cols else None,
+                    max_rows_per_file=self.max_rows_per_file,
+                    max_rows_per_group=min(
+                        self.max_rows_per_file, 1024 * 1024),
+                    basename_template='part-{}-{{i}}.parquet'.format(
+                        uuid.uuid4().hex[:8]),
+                    existing_data_behavior='overwrite_or_ignore',
+                )
+            manifest = self._read_manifest(dataset)
+            version = _next_version(manifest)
+            version_dirname = VERSION_DIR_TEMPLATE.format(version)
+            os.replace(tmp_dir, os.path.join(dataset_dir, version_dirname))
+        except BaseException:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+        entry = {
+            'version': version,
+            'path': version_dirname,
+            'tap_hash': tap_hash,
+            'tap_key': _jsonable(tap_key),
+            'num_rows': counter[0],
+            'created_at': datetime.datetime.now(
+                datetime.timezone.utc).isoformat(),
+            'compression': self.compression,
+            'partition_cols': partition_cols,
+            'schema': schema.to_string() if schema is not None else None,
+            'base_version': base_version,
+        }
+        if extra:
+            entry.update(extra)
+        manifest['versions'].append(entry)
+        manifest['next_version'] = version + 1
+        self._write_manifest(dataset, manifest)
+        return entry
+
+    def write(self, data_tap, partition_cols=None, schema=None, **kwargs):
+        """Taps the given DataTap and stores its output as a new version of
+        its dataset.
+
+        Arguments
+        ---------
+        data_tap : valve.DataTap
+            The DataTap to tap.
+        partition_cols : list of str, optional
+            Columns by which to partition the stored files, using Hive-style
+            directory partitioning.
+        schema : pyarrow.Schema or dict, optional
+            The schema of the dataset. Inferred if not given.
+        **kwargs : extra keyword arguments
+            Keyword arguments are forwarded to the tap_arrow method of
+            data_tap.
+
+        Returns
+        -------
+        dict
+            The manifest entry of the new version.
+        """
+        return self.write_batches(
+            dataset=data_tap,
+            record_batches=data_tap.tap_arrow(schema=schema, **kwargs),
+            tap_hash=data_tap.tap_hash(**kwargs),
+            tap_key=data_tap.tap_key(**kwargs),
+            partition_cols=partition_cols,
+        )
+
+    def write_incremental(self, data_tap, watermark_field='_id',
+                          partition_cols=None, schema=None, **kwargs):
+        """Taps only the documents added to a data source since the latest
+        stored version of its dataset, and stores them appended to it.
+
+        The high-watermark, i.e. the maximal value of the watermark field
+        among tapped documents, is recorded in the manifest entry of each
+        version written by this method. On the next call, only documents with
+        a greater value in this field, and no greater than the current
+        high-watermark, are tapped, and the new version is made of the files
+        of the previous one, hard-linked, plus files holding the new
+        documents. If no previous version was written with the same resolved
+        request and watermark field, the whole dataset is tapped. This suits
+        append-mostly data sources, with a watermark field - like an _id or a
+        creation timestamp - that grows with each inserted document; updates
+        to, and deletions of, previously tapped documents are not reflected.
+
+        The DataTap must provide a watermark(field, **kwargs) method,
+        returning the maximal value of the field in its dataset, and a
+        between(field, lower, upper) method, returning a DataTap restricted
+        to documents with lower < field <= upper, as valve.MongoDBQuery does.
+
+        Arguments
+        ---------
+        data_tap : valve.DataTap
+            The DataTap to tap.
+        watermark_field : str, optional
+            The name of the watermark field. Defaults to '_id'.
+        partition_cols : list of str, optional
+            Columns by which to partition the stored files, when a whole
+            dataset is tapped. Appended versions are partitioned like their
+            base version.
+        schema : pyarrow.Schema or dict, optional
+            The schema of the dataset, when a whole dataset is tapped.
+            Appended versions use the schema of their base version.
+        **kwargs : extra keyword arguments
+            Keyword arguments are forwarded to the tap_arrow method of
+            data_tap.
+
+        Returns
+        -------
+        dict
+            The manifest entry of the new version, or of the latest one if
+            no new documents were found.
+        """
+        if not (hasattr(data_tap, 'watermark') and
+                hasattr(data_tap, 'between')):
+            raise TypeError(
+                "{} does not support incremental taps.".format(data_tap))
+        tap_hash = data_tap.tap_hash(**kwargs)
+        base = None
+        for entry in reversed(self.versions(data_tap)):
+            if entry['tap_hash'] == tap_hash and entry.get(
+                    'watermark_field') == watermark_field:
+                base = entry
+                break
+        lower = None
+        if base is not None:
+            lower = json_util.loads(base['watermark'])
+        upper = data_tap.watermark(watermark_field, **kwargs)
+        if base is not None and (upper is None or (
+                lower is not None and upper <= lower)):
+            return base
+        delta_tap = data_tap.between(watermark_field, lower, upper)
+        if base is not None:
+            schema = None
+            if base['schema'] is not None:
+                schema = self.dataset(data_tap, base['version']).schema
+        return self.write_batches(
+            dataset=data_tap,
+            record_batches=delta_tap.tap_arrow(schema=schema, **kwargs),
+            tap_hash=tap_hash,
+            tap_key=data_tap.tap_key(**kwargs),
+            partition_cols=partition_cols,
+            base_version=base['version'] if base is not None else None,
+            extra={
+                'watermark_field': watermark_field,
+                'watermark': json_util.dumps(upper),
+            },
+        )
+
+    def version_dir(self, dataset, version=None):
+        """Returns the directory holding the Parquet files of a stored version
+        of a dataset. Defaults to the latest version."""
+        entry = self.version_info(dataset, version)
+        return os.path.join(self._dataset_dir(dataset), entry['path'])
+
+    def dataset(self, dataset, version=None):
+        """Returns a stored version of a dataset as a lazily-scanned
+        pyarrow.dataset.Dataset. Defaults to the latest version."""
+        entry = self.version_info(dataset, version)
+        return ds.dataset(
+            os.path.join(self._dataset_dir(dataset), entry['path']),
+            format='parquet',
+            partitioning='hive' if entry['partition_cols'] else None,
+        )
+
+    def load(self, dataset, version=None, columns=None, filters=None):
+        """Loads a stored version of a dataset as an Arrow table, using
+        memory-mapped reads.
+
+        Arguments
+        ---------
+        dataset : valve.DataTap or str
+            A DataTap, or the identifier of one.
+        version : int, optional
+            The version number to load. Defaults to the latest version.
+        columns : list of str, optional
+            The columns to load. Defaults to all columns.
+        filters : list, optional
+            Row filters, in the format accepted by pyarrow.parquet.read_table.
+
+        Returns
+        -------
+        pyarrow.Table
+            The stored dataset.
+        """
+        entry = self.version_info(dataset, version)
+        dpath = os.path.join(self._dataset_dir(dataset), entry['path'])
+        if entry['schema'] is None:
+            return pa.table({})
+        return pq.read_table(
+            dpath, columns=columns, filters=filters, memory_map=True,
+            partitioning='hive' if entry['partition_cols'] else None)
+
+    def remove(self, dataset, version=None):
+        """Removes a stored version of a dataset, or all of its versions if no
+        version is given.
+
+        Version numbers are never reissued: the manifest of the dataset is
+        kept, so versions written later are numbered after removed ones.
+        """
+        manifest = self._read_manifest(dataset)
+        if version is None:
+            removed = manifest['versions']
+        else:
+            removed = [self.version_info(dataset, version)]
+        if not removed:
+            return
+        manifest['next_version'] = _next_version(manifest)
+        manifest['versions'] = [
+            ver for ver in manifest['versions'] if ver not in removed]
+        self._write_manifest(dataset, manifest)
+        for entry in removed:
+            shutil.rmtree(os.path.join(
+                self._dataset_dir(dataset), entry['path']),
+                ignore_errors=True)